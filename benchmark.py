@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+"""
+Benchmarks the fetch paths, consolidation and validation offline.
+
+A `fake_api.py` server is started on a free local port with the requested
+latency, error rate and rate limit, and each benchmark runs in a fresh
+process against it:
+
+* `scrape`: `scrape.py`'s planner and crawler (aiohttp, scheduler, manifest)
+* `slr`: `scrape_sl_predictions.py`'s concurrent page fetch and normalization
+* `spider-harcon`, `spider-watertemp`: the Scrapy spiders with the response
+  cache middleware and shard pipeline
+* `consolidate`, `validate`: the process-pool steps over a synthetic archive
+  of year files with realistic size
+
+For every benchmark it reports wall time, requests/sec, p50/p99 request
+latency, error responses, work units/sec, CPU seconds (including worker
+processes) and peak RSS, and writes them to `benchmark-results.json`:
+
+    python benchmark.py --latency 0.05 --concurrency 16
+    python benchmark.py scrape slr --error-rate 0.02
+"""
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = "benchmark-results.json"
+WORK_DIR = "benchmark-work"
+FIRST_YEAR = 2025
+
+
+def bench_scrape(api_root, options):
+    import scheduler
+    import scrape
+    from fetch import AsyncFetcher
+    from manifest import Manifest
+
+    # Retry failed fetches after seconds, not the production half minute
+    scheduler.BACKOFF_BASE = options.backoff
+    os.mkdir("data")
+    manifest = Manifest("manifest.sqlite")
+    queue = scheduler.Scheduler("schedule.sqlite")
+
+    async def run():
+        async with AsyncFetcher(concurrency=options.concurrency, rate=options.rate,
+                                api_root=api_root) as fetcher:
+            planning = asyncio.create_task(scrape.plan_regions(
+                fetcher, scrape.TIDE_PREDICTION_REGION_IDS[:options.regions],
+                range(FIRST_YEAR, FIRST_YEAR + options.years), manifest, queue))
+            await scrape.crawl(fetcher, queue, manifest, planning, progress=False)
+            return fetcher
+
+    fetcher = asyncio.run(run())
+    files = len(manifest.entries())
+    return dict(requests=fetcher.requests, errors=fetcher.errors, bytes=fetcher.bytes,
+                latencies=fetcher.latencies.sample, units=files, unit="files")
+
+
+def bench_slr(api_root, options):
+    import scrape_sl_predictions
+    from fetch import AsyncFetcher
+
+    scrape_sl_predictions.RETRY_DELAY = options.backoff
+
+    async def run():
+        async with AsyncFetcher(concurrency=options.concurrency, rate=options.rate,
+                                api_root=api_root) as fetcher:
+            frames, failed = await scrape_sl_predictions.fetch_projections(fetcher)
+            return fetcher, frames
+
+    fetcher, frames = asyncio.run(run())
+    data = scrape_sl_predictions.normalize(frames)
+    data.to_parquet("slr_projections.parquet", index=False)
+    return dict(requests=fetcher.requests, errors=fetcher.errors, bytes=fetcher.bytes,
+                latencies=fetcher.latencies.sample, units=len(data), unit="rows")
+
+
+def bench_spider(spider_name, api_root, options):
+    sys.path.insert(0, os.path.join(REPO_DIR, "noaa_scrape"))
+    os.environ["SCRAPY_SETTINGS_MODULE"] = "noaa_scrape.settings"
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.spiderloader import SpiderLoader
+    from scrapy.utils.project import get_project_settings
+
+    from fetch import Reservoir, rebase
+
+    settings = get_project_settings()
+    settings.setdict({
+        "ROBOTSTXT_OBEY": False, "LOG_LEVEL": "ERROR", "TELNETCONSOLE_ENABLED": False,
+        "CONCURRENT_REQUESTS": options.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": options.concurrency,
+        "RESPONSE_CACHE_DIR": ".httpcache", "RETRY_TIMES": 5,
+        # Request the stand-in server's station list, not the saved catalog's
+        "STATION_CATALOG": "",
+    }, priority="cmdline")
+    spider_cls = SpiderLoader.from_settings(settings).load(spider_name)
+    spider_cls = type(spider_cls.__name__, (spider_cls,), {
+        "url": rebase(spider_cls.url, api_root),
+        "stations_url": rebase(spider_cls.stations_url, api_root),
+    })
+    latencies = Reservoir()
+
+    def response_received(response, request, spider):
+        if "download_latency" in request.meta:
+            latencies.add(request.meta["download_latency"])
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spider_cls)
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    process.crawl(crawler)
+    process.start()
+    stats = crawler.stats.get_stats()
+    errors = sum(count for key, count in stats.items()
+                 if key.startswith("downloader/response_status_count/")
+                 and not key.endswith("/200"))
+    errors += stats.get("downloader/exception_count", 0)
+    return dict(requests=stats.get("downloader/request_count", 0), errors=errors,
+                bytes=stats.get("downloader/response_bytes", 0), latencies=latencies.sample,
+                units=stats.get("item_scraped_count", 0), unit="items")
+
+
+def bench_consolidate(api_root, options):
+    import consolidate_tide_predictions as consolidate
+
+    data_dir = os.path.join(options.archive, "data")
+    regions = sorted(os.listdir(data_dir))
+    with ProcessPoolExecutor(options.workers) as executor:
+        results = list(executor.map(consolidate.consolidate_region, regions,
+                                    [data_dir] * len(regions),
+                                    ["consolidated"] * len(regions)))
+    return dict(units=sum(result[1] for result in results), unit="files")
+
+
+def bench_validate(api_root, options):
+    import validate
+
+    checks, _, _ = validate.plan_checks(os.path.join(options.archive, "data"),
+                                        range(FIRST_YEAR, FIRST_YEAR + options.years))
+    failed = 0
+    with ProcessPoolExecutor(options.workers) as executor:
+        for _, (_, issues) in executor.map(validate._check_task, checks, chunksize=16):
+            failed += bool(issues)
+    return dict(units=len(checks), unit="files", failed=failed)
+
+
+BENCHMARKS = {
+    "scrape": bench_scrape,
+    "slr": bench_slr,
+    "spider-harcon": lambda *args: bench_spider("harmonicconstituents", *args),
+    "spider-watertemp": lambda *args: bench_spider("watertemp", *args),
+    "consolidate": bench_consolidate,
+    "validate": bench_validate,
+}
+
+
+def synthetic_archive(directory, regions, stations_per_region, years):
+    """
+    Write a `data/` archive like `scrape.py`'s without any requests.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to create `data/` in
+    regions : int
+        Number of regions, taken from the start of `TIDE_PREDICTION_REGION_IDS`
+    stations_per_region : int
+        Stations in each region's stations.json
+    years : int
+        Years of predictions per station, from `FIRST_YEAR`
+
+    Returns
+    -------
+    int
+        Number of files written
+    """
+    import fake_api
+    import scrape
+
+    config = fake_api.Config(stations_per_region=stations_per_region)
+    written = 0
+    for region_id, state in scrape.TIDE_PREDICTION_REGION_IDS[:regions]:
+        folder_path = os.path.join(directory, "data", state)
+        os.makedirs(folder_path, exist_ok=True)
+        stns = fake_api.region_children(config, region_id)["stationList"]
+        for stn in stns:
+            stn["state"] = state
+        with open(os.path.join(folder_path, "stations.json"), "w") as f:
+            json.dump(stns, f)
+        for stn in stns:
+            for year in range(FIRST_YEAR, FIRST_YEAR + years):
+                body, _, _ = fake_api.predictions_body(
+                    f"{year}-01-01", f"{year}-12-31", scrape.year_data_interval(stn), "csv",
+                    fake_api.station_number(stn["stationId"]) % fake_api.VARIANTS)
+                with open(os.path.join(folder_path, scrape.year_data_filename(stn, year)),
+                          "wb") as f:
+                    f.write(body)
+                written += 1
+    return written
+
+
+def _measure(name, api_root, options, directory):
+    """Run one benchmark in `directory` and measure it; runs in a fresh process."""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(directory)
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    result = BENCHMARKS[name](api_root, options)
+    wall = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+              for before, after in ((self_before, self_after),
+                                    (children_before, children_after)))
+    latencies = np.array(result.pop("latencies", []), dtype=float)
+    requests = result.get("requests")
+    result.update(
+        name=name, wall_s=round(wall, 3), cpu_s=round(cpu, 3),
+        # ru_maxrss is in KiB on Linux
+        peak_rss_mb=round(max(self_after.ru_maxrss, children_after.ru_maxrss) / 1024, 1),
+        units_per_s=round(result["units"] / wall, 2) if wall > 0 else None,
+        requests_per_s=round(requests / wall, 2) if requests and wall > 0 else None,
+        p50_ms=round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+        p99_ms=round(float(np.percentile(latencies, 99)) * 1000, 1) if len(latencies) else None,
+    )
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(options):
+    """
+    Start `fake_api.py` in a subprocess and wait until it accepts connections.
+
+    Returns
+    -------
+    tuple[subprocess.Popen, str]
+        The server process and its API root
+    """
+    port = options.port or free_port()
+    server = subprocess.Popen([
+        sys.executable, os.path.join(REPO_DIR, "fake_api.py"), "--port", str(port),
+        "--latency", str(options.latency), "--jitter", str(options.jitter),
+        "--error-rate", str(options.error_rate), "--rate-limit", str(options.rate_limit),
+        "--stations-per-region", str(options.stations_per_region),
+        "--stations", str(options.stations), "--since", str(options.since),
+        "--slr-pages", str(options.slr_pages), "--warm",
+        *(str(year) for year in range(FIRST_YEAR, FIRST_YEAR + options.years))])
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("fake API server did not start")
+            time.sleep(0.1)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def format_table(results):
+    columns = ["name", "wall_s", "requests", "requests_per_s", "p50_ms", "p99_ms", "errors",
+               "units_per_s", "unit", "cpu_s", "peak_rss_mb"]
+    rows = [[str(r.get(c, "")) if r.get(c) is not None else "-" for c in columns]
+            for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def main(options):
+    names = options.benchmarks or list(BENCHMARKS)
+    work_dir = os.path.abspath(options.work_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    options.archive = os.path.join(work_dir, "archive")
+    if {"consolidate", "validate"} & set(names):
+        written = synthetic_archive(options.archive, options.regions,
+                                    options.stations_per_region, options.years)
+        print(f"Wrote a synthetic archive of {written} files")
+    server, api_root = start_server(options)
+    results = []
+    try:
+        context = multiprocessing.get_context("spawn")
+        for name in names:
+            directory = os.path.join(work_dir, name)
+            os.makedirs(directory)
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(_measure, name, api_root, options, directory).result()
+            results.append(result)
+            print(f"{name}: {result['wall_s']} s")
+        with urllib.request.urlopen(f"{api_root}/_stats") as response:
+            server_stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+    options_out = {k: v for k, v in vars(options).items() if k != "archive"}
+    with open(options.output, "w") as f:
+        json.dump({"time": time.time(), "options": options_out, "server": server_stats,
+                   "results": results}, f, indent=1)
+    print(format_table(results))
+    print(f"Server: {server_stats}")
+    if not options.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Benchmark",
+                    description="Benchmarks fetching, consolidation and validation against a local fake API")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run, by default all of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="server latency per response, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01,
+                        help="random extra server latency of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests the server answers with a 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="server-side requests/sec limit (429 above it)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="client-side requests/sec limit (0 for unlimited)")
+    parser.add_argument("--backoff", type=float, default=0.5,
+                        help="base retry delay for failed requests, in seconds")
+    parser.add_argument("--regions", type=int, default=5)
+    parser.add_argument("--stations-per-region", type=int, default=8)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--stations", type=int, default=20,
+                        help="stations in the spiders' station lists")
+    parser.add_argument("--since", type=int, default=2024,
+                        help="earliest year spider stations are established")
+    parser.add_argument("--slr-pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=0, help="server port, by default any free one")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark outputs")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    main(args)
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from fetch import API_ROOT, AsyncFetcher
+from noaa_scrape.noaa_scrape.response_cache import ResponseCache
+from noaa_scrape.noaa_scrape.station_catalog import (
+    CATALOG_MAX_AGE, CATALOG_PATH, COLUMNS, LIST_COLUMNS, StationCatalog, get_catalog,
+    station_list_type)
+
+"""
+Builds the station catalog read by `noaa_scrape.station_catalog`.
+
+The catalog merges the per-region geogroup lists `scrape.py` crawls with
+the station lists the spiders crawl (tide predictions, harmonic
+constituents, water temperature, historic water levels), all fetched
+concurrently through the shared response cache. A spider list that fails
+to fetch is left out (and the spider requests it itself); a region list
+that fails fails the whole fetch.
+
+`scrape.py` plans its crawl from `region_lists`, which answers from the
+saved catalog while it is younger than `CATALOG_MAX_AGE` and otherwise
+fetches every list once and saves it again, so planning a crawl makes no
+requests at all when the catalog is fresh. The spiders take their station
+lists from a fresh catalog the same way, and the scripts that read the
+region station lists (`datums.py`, `timezones.py`, `residuals.py`,
+`harmonic.py`, `hilo.py`) use `station_catalog.region_station_lists`.
+"""
+
+
+def spider_station_lists():
+    """
+    Station list URLs crawled by the spiders, by list type (e.g.
+    "tidepredictions", "harcon").
+    """
+    from noaa_scrape.noaa_scrape.spiders.water_levels_spiders import (
+        HarmonicConstituentsSpider, MonthlyMeanWaterLevelSpider, TidePredictionOffsetsSpider)
+    from noaa_scrape.noaa_scrape.spiders.water_temps_spider import WaterTempSpider
+
+    return {station_list_type(spider.stations_url): spider.stations_url
+            for spider in (TidePredictionOffsetsSpider, HarmonicConstituentsSpider,
+                           WaterTempSpider, MonthlyMeanWaterLevelSpider)}
+
+
+def _region_station(stn, region):
+    return {"station_id": str(stn["stationId"]), "name": stn.get("stationName"),
+            "lat": stn.get("lat"), "lon": stn.get("lon"), "state": region,
+            "type": stn.get("stationType"), "ref_station_id": stn.get("refStationId"),
+            "regions": region, "sources": "regions", "details": dict(stn, state=region)}
+
+
+def _api_station(stn, name):
+    return {"station_id": str(stn["id"]), "name": stn.get("name"), "lat": stn.get("lat"),
+            "lon": stn.get("lng"), "state": stn.get("state"), "type": stn.get("type"),
+            "ref_station_id": stn.get("reference_id"), "sources": name, "details": stn}
+
+
+def region_stations(data_dir="data"):
+    """
+    Stations from the per-region lists written by `scrape.py`.
+
+    Yields
+    ------
+    dict
+        Station with the keys in `COLUMNS` and its raw entry as "details"
+    """
+    if not os.path.isdir(data_dir):
+        return
+    for region in sorted(os.listdir(data_dir)):
+        stations_file = os.path.join(data_dir, region, "stations.json")
+        if not os.path.exists(stations_file):
+            continue
+        with open(stations_file, "r") as f:
+            for stn in json.load(f):
+                yield _region_station(stn, region)
+
+
+async def fetch_region_stations(fetcher, region_id, region):
+    """
+    Tide prediction stations of one region, as `scrape.py` plans them.
+
+    Returns
+    -------
+    list[dict]
+        Stations with the keys in `COLUMNS` and their raw entries as "details"
+    """
+    from scrape import get_region_stations_async
+
+    stns = await get_region_stations_async(fetcher, region_id, station_type="both")
+    return [_region_station(stn, region) for stn in stns]
+
+
+async def fetch_api_stations(fetcher, name, url):
+    """
+    Stations from one mdapi station list.
+
+    Returns
+    -------
+    list[dict]
+        Stations with the keys in `COLUMNS` and their raw entries as "details"
+    """
+    status, text = await fetcher.get(url)
+    if status != 200:
+        raise Exception(f"Response code {status} for {name} stations")
+    return [_api_station(stn, name) for stn in json.loads(text)["stations"]]
+
+
+def merge_stations(sources):
+    """
+    Merge station dicts from several lists into one per station ID.
+
+    Each field takes the first non-empty value in source order, the
+    `LIST_COLUMNS` join the names of every list the station appears in, and
+    "entries" maps each of those names to the station's raw entry in that
+    list.
+    """
+    merged = {}
+    for stations in sources:
+        for stn in stations:
+            current = merged.get(stn["station_id"])
+            if current is None:
+                current = merged[stn["station_id"]] = dict(
+                    stn, **{name: "" for name in LIST_COLUMNS}, entries={})
+                del current["details"]
+            current["entries"].setdefault(stn["sources"], stn.get("details") or {})
+            for name in COLUMNS:
+                if name in LIST_COLUMNS:
+                    names = current[name].split(",") if current[name] else []
+                    if stn.get(name) and stn[name] not in names:
+                        current[name] = ",".join(names + [stn[name]])
+                elif current.get(name) in (None, "") and stn.get(name) not in (None, ""):
+                    current[name] = stn[name]
+    return list(merged.values())
+
+
+async def fetch_catalog(fetcher, region_ids=None):
+    """
+    Fetch every region's and spider's station list concurrently and merge
+    them into a catalog.
+
+    A spider list that fails is left out of the catalog (its name is not in
+    `source_names`), so the spider requests it itself; a region list that
+    fails raises.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher
+    region_ids : list[tuple[int, str]], optional
+        (NOAA region ID, folder name) pairs; defaults to
+        `scrape.TIDE_PREDICTION_REGION_IDS`
+
+    Returns
+    -------
+    StationCatalog
+    """
+    if region_ids is None:
+        from scrape import TIDE_PREDICTION_REGION_IDS as region_ids
+    lists = spider_station_lists()
+    results = await asyncio.gather(
+        *(fetch_region_stations(fetcher, region_id, region) for region_id, region in region_ids),
+        *(fetch_api_stations(fetcher, name, url) for name, url in lists.items()),
+        return_exceptions=True)
+    sources = results[:len(region_ids)]
+    for result in sources:
+        if isinstance(result, BaseException):
+            raise result
+    source_names = []
+    for name, result in zip(lists, results[len(region_ids):]):
+        if isinstance(result, BaseException):
+            print(f"Leaving the {name} station list out of the catalog: {result!r}")
+            continue
+        sources.append(result)
+        source_names.append(name)
+    return StationCatalog.from_stations(merge_stations(sources),
+                                        [region for _, region in region_ids], source_names)
+
+
+async def region_lists(fetcher, region_ids, path=CATALOG_PATH, max_age=CATALOG_MAX_AGE):
+    """
+    Station lists of regions, from the saved catalog when it is fresh.
+
+    Otherwise the lists are fetched again (see `fetch_catalog`) and the
+    catalog saved; when that fails, an older catalog with every region is
+    used instead.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher
+    region_ids : list[tuple[int, str]]
+        (NOAA region ID, folder name) pairs
+    path : str, optional
+        Saved catalog
+    max_age : float, optional
+        Seconds a saved catalog stays fresh; 0 always fetches
+
+    Returns
+    -------
+    dict[str, list[dict]]
+        Region folder mapped to its stations, as in its stations.json
+    """
+    catalog = get_catalog(path)
+    regions = [region for _, region in region_ids]
+    known = catalog is not None and set(regions) <= set(catalog.region_names)
+    if not known or time.time() - catalog.built_at >= max_age:
+        try:
+            fetched = await fetch_catalog(fetcher, region_ids)
+        except Exception as e:
+            if not known:
+                raise
+            print(f"Using the station catalog from {time.ctime(catalog.built_at)}: {e!r}")
+        else:
+            fetched.save(path)
+            catalog = fetched
+    return {region: catalog.region_stations(region) for region in regions}
+
+
+def build(data_dir="data", api_root=API_ROOT, path=CATALOG_PATH, fetch=True, concurrency=8,
+          rate=10.0, cache=None):
+    """
+    Build and save the catalog from every station list or, without `fetch`,
+    from the region lists in `data_dir`, dated by the oldest of them.
+
+    Returns
+    -------
+    StationCatalog
+    """
+    if fetch:
+        async def fetch_all():
+            async with AsyncFetcher(concurrency=concurrency, rate=rate, api_root=api_root,
+                                    cache=cache) as fetcher:
+                catalog = await fetch_catalog(fetcher)
+                print(fetcher.summary())
+                return catalog
+
+        catalog = asyncio.run(fetch_all())
+    else:
+        regions = sorted(region for region in os.listdir(data_dir)
+                         if os.path.exists(os.path.join(data_dir, region, "stations.json")))
+        catalog = StationCatalog.from_stations(merge_stations([region_stations(data_dir)]),
+                                               regions)
+        # The lists are as old as the oldest file, so `region_lists` does not
+        # take an offline catalog for a fresh fetch
+        catalog.built_at = min((os.path.getmtime(os.path.join(data_dir, region, "stations.json"))
+                                for region in regions), default=0.0)
+    catalog.save(path)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Catalog",
+                    description="Builds and queries the station catalog and its spatial index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build the catalog from the station lists")
+    build_parser.add_argument("--data-dir", default="data")
+    build_parser.add_argument("--api-root", default=API_ROOT,
+                              help="API scheme and host, e.g. a local stand-in server")
+    build_parser.add_argument("--offline", action="store_true",
+                              help="only use the region lists already on disk")
+    build_parser.add_argument("--concurrency", type=int, default=8)
+    build_parser.add_argument("--rate", type=float, default=10.0,
+                              help="maximum requests per second (0 for unlimited)")
+    build_parser.add_argument("--no-cache", action="store_true")
+    build_parser.add_argument("--output", default=CATALOG_PATH)
+    show_parser = subparsers.add_parser("show", help="print one station's catalog entry")
+    show_parser.add_argument("station_id")
+    show_parser.add_argument("--path", default=CATALOG_PATH)
+    nearest_parser = subparsers.add_parser("nearest", help="print the stations nearest a point")
+    nearest_parser.add_argument("lat", type=float)
+    nearest_parser.add_argument("lon", type=float)
+    nearest_parser.add_argument("-k", type=int, default=5)
+    nearest_parser.add_argument("--path", default=CATALOG_PATH)
+    box_parser = subparsers.add_parser("box", help="print the stations inside a box")
+    box_parser.add_argument("south", type=float)
+    box_parser.add_argument("west", type=float)
+    box_parser.add_argument("north", type=float)
+    box_parser.add_argument("east", type=float)
+    box_parser.add_argument("--path", default=CATALOG_PATH)
+    args = parser.parse_args()
+    if args.command == "build":
+        started = time.monotonic()
+        cache = None if args.no_cache else ResponseCache()
+        catalog = build(args.data_dir, args.api_root, args.output, not args.offline,
+                        args.concurrency, args.rate, cache)
+        print(f"Wrote {len(catalog)} stations to {args.output} "
+              f"in {time.monotonic() - started:.1f} s (version {catalog.version[:12]})")
+    elif args.command == "show":
+        catalog = StationCatalog.load(args.path)
+        print(json.dumps(catalog.station(args.station_id), indent=1))
+        print(f"Catalog version {catalog.version[:12]}, built {time.ctime(catalog.built_at)}")
+    else:
+        catalog = StationCatalog.load(args.path)
+        if args.command == "nearest":
+            rows, km = catalog.nearest(args.lat, args.lon, args.k)
+            matches = [(row, distance) for row, distance in zip(rows[0], km[0]) if row >= 0]
+        else:
+            matches = [(row, None) for row in catalog.within(args.south, args.west,
+                                                              args.north, args.east)]
+        for row, distance in matches:
+            stn = catalog.row(row)
+            line = f"{stn['station_id']}\t{stn['name']}\t{stn['lat']:.4f}\t{stn['lon']:.4f}"
+            if distance is not None:
+                line += f"\t{distance:.1f} km"
+            print(line)
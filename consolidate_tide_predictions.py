@@ -1,20 +1,199 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
 import os
 
 import pandas as pd
 
-for region in os.listdir("data"):
-    region_path = os.path.join("data", region)
-    consolidated_data = {}
-    for filename in os.listdir(region_path):
-        file_path = os.path.join(region_path, filename)
-        if filename != "stations.json":
-            data = pd.read_csv(file_path)
-            station_id = filename.split(" ")[-3]
-            data["Station ID"] = station_id
-            year = filename[:4]
-            if consolidated_data.get(year) is not None:
-                consolidated_data[year] = pd.concat([consolidated_data[year], data])
-            else:
-                consolidated_data[year] = data
-    for year in consolidated_data:
-        consolidated_data[year].to_csv(os.path.join("data", f"{region}-{year}.csv"), index=False)
+from noaa_scrape.noaa_scrape import profiling
+
+"""
+Consolidates the per-station-year prediction CSVs into Parquet datasets
+partitioned by region and year:
+
+    consolidated/region=<region>/year=<year>/part-<n>.parquet
+
+Files are read in bounded batches with explicit dtypes, and each batch is
+written as its own part file, so memory stays flat regardless of region size.
+Regions are processed in parallel. Each region keeps a record of the size and
+modification time of every file it has consolidated, so a rerun only reads
+files added since the last run; a year with a file that has changed (e.g.
+rewritten by `scrape.py --refresh`) or disappeared since is rewritten from
+scratch. Read the result back with `pd.read_parquet("consolidated")`.
+"""
+
+OUTPUT_DIR = "consolidated"
+STATE_FILE = "_consolidated.json"
+BATCH_SIZE = 64
+CSV_DTYPES = {"Prediction": "float32", "Type": "category"}
+
+
+def read_prediction_csv(file_path, station_id):
+    """
+    Read one prediction CSV saved by `scrape.py`.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the CSV file
+    station_id : str
+        NOAA station ID to tag the rows with
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        Columns "Date Time", "Prediction", "Type" (hilo files only) and
+        "Station ID", or None when the file is not prediction data (e.g. a
+        saved API error message)
+    """
+    with profiling.stage("consolidate.read_csv") as record:
+        data = pd.read_csv(file_path, skipinitialspace=True, dtype=CSV_DTYPES)
+        if "Date Time" not in data.columns or "Prediction" not in data.columns:
+            return None
+        data["Date Time"] = pd.to_datetime(data["Date Time"], format="%Y-%m-%d %H:%M")
+        if "Type" not in data.columns:
+            data["Type"] = pd.Categorical([None] * len(data), categories=["H", "L"])
+        data["Station ID"] = station_id
+        record.units = len(data)
+        return data[["Date Time", "Prediction", "Type", "Station ID"]]
+
+
+def write_batch(frames, folder_path):
+    """Write a batch of frames as the next part file in `folder_path`."""
+    os.makedirs(folder_path, exist_ok=True)
+    part = len([i for i in os.listdir(folder_path) if i.endswith(".parquet")])
+    with profiling.stage("consolidate.write_parquet") as record:
+        data = pd.concat(frames, ignore_index=True)
+        data["Station ID"] = data["Station ID"].astype("category")
+        data["Type"] = data["Type"].astype(pd.CategoricalDtype(["H", "L"]))
+        data.to_parquet(os.path.join(folder_path, f"part-{part:05d}.parquet"), index=False)
+        record.units = len(data)
+
+
+def _unchanged(entry, stat):
+    """Whether a state file entry still matches a file's (size, mtime_ns)."""
+    if isinstance(entry, int):
+        # Entries written before modification times were recorded
+        return entry == stat[0]
+    return list(entry) == list(stat)
+
+
+def _save_state(done, region_output, state_path):
+    os.makedirs(region_output, exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(done, f)
+
+
+def consolidate_region(region, data_dir="data", output_dir=OUTPUT_DIR,
+                       batch_size=BATCH_SIZE):
+    """
+    Consolidate the files of one region that are new since the last run, and
+    rewrite the years whose files have changed.
+
+    Parameters
+    ----------
+    region : str
+        Region folder name, e.g. "wa"
+    data_dir : str, optional
+        Directory with one folder per region
+    output_dir : str, optional
+        Root of the partitioned Parquet output
+    batch_size : int, optional
+        Number of CSV files held in memory at once
+
+    Returns
+    -------
+    tuple[str, int, list[str], list[str]]
+        The region, the number of files consolidated, the files that were
+        skipped because they did not contain prediction data and the years
+        that were rewritten
+    """
+    region_path = os.path.join(data_dir, region)
+    region_output = os.path.join(output_dir, f"region={region}")
+    state_path = os.path.join(region_output, STATE_FILE)
+    done = {}
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            done = json.load(f)
+    stats = {}
+    for filename in sorted(os.listdir(region_path)):
+        if filename.endswith(".csv"):
+            stat = os.stat(os.path.join(region_path, filename))
+            stats[filename] = [stat.st_size, stat.st_mtime_ns]
+    stale = sorted({filename[:4] for filename, entry in done.items()
+                    if entry is not None and (filename not in stats
+                                              or not _unchanged(entry, stats[filename]))})
+    # Drop the stale years' parts before forgetting their files: a run
+    # interrupted in between finds the same changes again
+    for year in stale:
+        folder_path = os.path.join(region_output, f"year={year}")
+        if os.path.isdir(folder_path):
+            for part in os.listdir(folder_path):
+                if part.endswith(".parquet"):
+                    os.remove(os.path.join(folder_path, part))
+    for filename in list(done):
+        entry = done[filename]
+        if filename[:4] in stale or filename not in stats:
+            del done[filename]
+        elif isinstance(entry, int) and _unchanged(entry, stats[filename]):
+            done[filename] = stats[filename]
+    if stale or os.path.exists(state_path):
+        _save_state(done, region_output, state_path)
+    by_year = {}
+    for filename, stat in stats.items():
+        # Files skipped as non-prediction data are retried in case they have
+        # been fetched again since.
+        if done.get(filename) is not None:
+            continue
+        by_year.setdefault(filename[:4], []).append((filename, stat))
+    skipped = []
+    consolidated = 0
+    for year, files in by_year.items():
+        folder_path = os.path.join(region_output, f"year={year}")
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            frames = []
+            for filename, _ in batch:
+                data = read_prediction_csv(
+                    os.path.join(region_path, filename), filename.split(" ")[-3])
+                if data is None:
+                    skipped.append(filename)
+                else:
+                    frames.append(data)
+            if frames:
+                write_batch(frames, folder_path)
+            for filename, stat in batch:
+                done[filename] = None if filename in skipped else stat
+            consolidated += len(batch)
+            # Record progress after every part so an interrupted run resumes
+            # without writing duplicate rows.
+            _save_state(done, region_output, state_path)
+    return region, consolidated, skipped, stale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Consolidate",
+                    description="Consolidates tide prediction CSVs into Parquet partitioned by region and year")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--profile", nargs="?", const="time", metavar="MODES",
+                        help="profile the parsing and writing stages, see profiling.py")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(args.profile)
+    regions = [i for i in sorted(os.listdir(args.data_dir))
+               if os.path.isdir(os.path.join(args.data_dir, i))]
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(consolidate_region, region, args.data_dir,
+                                   args.output_dir, args.batch_size)
+                   for region in regions]
+        for future in futures:
+            region, consolidated, skipped, rewritten = future.result()
+            print(f"{region}: {consolidated} files consolidated")
+            if rewritten:
+                print(f"  rewrote years with changed files: {' '.join(rewritten)}")
+            for filename in skipped:
+                print(f"  skipped {filename}")
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from fetch import API_ROOT, AsyncFetcher
+from harmonic import FEET_PER_METER
+from noaa_scrape.noaa_scrape.response_cache import ResponseCache
+from noaa_scrape.noaa_scrape.station_catalog import CATALOG_PATH
+from scrape import DATUM, load_region_stations
+from store import STORE_PATH, SeriesStore, write_store
+
+"""
+Station datums and local datum/unit conversion of stored predictions.
+
+The archive is fetched once with `datum=MLLW&units=english`. Every tidal
+datum NOAA publishes for a station is a fixed height above the station's
+own datum (STND), so converting a series between datums is one add:
+
+    height[to] = height[from] + (datum[from] - datum[to])
+
+and converting units is one multiply. `fetch` downloads each station's
+mdapi `datums.json` (in metres) into a `DatumTable`, a dense (stations x
+datums) float64 array saved as `station-datums.npz`; NaN marks a datum a
+station does not have (NAVD88 is missing at many stations). Conversions
+take arrays of station IDs, so a whole batch of stations converts in one
+vectorized call:
+
+    table = DatumTable.load()
+    heights_navd = table.convert(heights, station_ids, to_datum="NAVD88", to_units="metric")
+
+`z0` gives the height of MSL above a datum, the offset `harmonic.py` and
+`hilo.py` add to their MSL-referenced predictions.
+"""
+
+DATUMS_URL = ("https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations/"
+              "{stnid}/datums.json?units=metric")
+DATUMS_PATH = "station-datums.npz"
+# Datums a height can be referenced to. Ranges in datums.json (GT, MN, DHQ,
+# DLQ) and lunitidal intervals (HWI, LWI) are not datums and are skipped.
+DATUMS = ["STND", "MHHW", "MHW", "MTL", "MSL", "DTL", "MLW", "MLLW", "NAVD88", "LAT", "HAT",
+          "IGLD", "LWD"]
+# Metres per unit, keyed by the datagetter `units` parameter
+UNITS = {"metric": 1.0, "english": 1 / FEET_PER_METER}
+RETRIES = 4
+RETRY_DELAY = 1.0
+
+
+def parse_datums(data):
+    """
+    Datum heights from a `datums.json` response.
+
+    Returns
+    -------
+    dict[str, float]
+        Datum name mapped to its height above the station datum, in metres
+    """
+    scale = 1.0 if str(data.get("units", "meters")).lower().startswith("m") else 1 / FEET_PER_METER
+    heights = {"STND": 0.0}
+    entries = [(d.get("name"), d.get("value")) for d in data.get("datums") or []]
+    entries += [(name, data.get(name)) for name in ("LAT", "HAT")]
+    for name, value in entries:
+        if name in DATUMS and isinstance(value, (int, float)):
+            heights[name] = float(value) * scale
+    return heights
+
+
+class DatumTable:
+    """
+    Datum heights of many stations, as a sorted ID array and an offsets matrix.
+
+    Attributes
+    ----------
+    station_ids : numpy.ndarray
+        Sorted station IDs (str)
+    offsets : numpy.ndarray
+        float64 (stations, len(DATUMS)) heights above each station's STND
+        in metres; NaN where a station has no such datum
+    """
+
+    def __init__(self, station_ids, offsets):
+        self.station_ids = np.asarray(station_ids, dtype=str)
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    @classmethod
+    def from_datums(cls, datums_by_station):
+        """Build a table from station ID -> output of `parse_datums`."""
+        station_ids = sorted(datums_by_station)
+        offsets = np.full((len(station_ids), len(DATUMS)), np.nan)
+        for row, station_id in enumerate(station_ids):
+            for name, value in datums_by_station[station_id].items():
+                offsets[row, DATUMS.index(name)] = value
+        return cls(station_ids, offsets)
+
+    def save(self, path=DATUMS_PATH):
+        tmp_path = path + ".part.npz"
+        np.savez(tmp_path, station_ids=self.station_ids, offsets=self.offsets,
+                 datums=np.array(DATUMS))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DATUMS_PATH):
+        with np.load(path) as data:
+            names = list(data["datums"])
+            offsets = np.full((len(data["station_ids"]), len(DATUMS)), np.nan)
+            for column, name in enumerate(names):
+                if name in DATUMS:
+                    offsets[:, DATUMS.index(name)] = data["offsets"][:, column]
+            return cls(data["station_ids"], offsets)
+
+    def rows(self, station_ids):
+        """
+        Row of each station ID, in the shape of `station_ids`.
+
+        Raises
+        ------
+        KeyError
+            When a station is not in the table
+        """
+        station_ids = np.asarray(station_ids, dtype=str)
+        rows = np.minimum(np.searchsorted(self.station_ids, station_ids), max(len(self) - 1, 0))
+        missing = (self.station_ids[rows] != station_ids if len(self)
+                   else np.ones(station_ids.shape, dtype=bool))
+        if np.any(missing):
+            raise KeyError(f"no datums for {np.atleast_1d(station_ids[missing])[:5].tolist()}")
+        return rows
+
+    def heights(self, station_ids, datum):
+        """Height of `datum` above each station's STND in metres (NaN when unknown)."""
+        return self.offsets[self.rows(station_ids), DATUMS.index(datum)]
+
+    def shift(self, station_ids, from_datum=DATUM, to_datum=DATUM, units="english"):
+        """
+        What to add to heights above `from_datum` to get heights above
+        `to_datum`, per station, in `units`. NaN when either datum is unknown.
+        """
+        rows = self.rows(station_ids)
+        metres = (self.offsets[rows, DATUMS.index(from_datum)]
+                  - self.offsets[rows, DATUMS.index(to_datum)])
+        return metres / UNITS[units]
+
+    def z0(self, station_ids, datum=DATUM, units="english"):
+        """Height of MSL above `datum`, per station, in `units`."""
+        return self.shift(station_ids, "MSL", datum, units)
+
+    def convert(self, heights, station_ids, from_datum=DATUM, to_datum=DATUM,
+                from_units="english", to_units="english"):
+        """
+        Convert heights to another datum and/or unit.
+
+        Parameters
+        ----------
+        heights : numpy.ndarray
+            Heights above `from_datum` in `from_units`
+        station_ids : str or array_like
+            One station for all heights, one per height, or one per row of
+            2-D `heights` (stations x times)
+        from_datum, to_datum : str, optional
+            Names in `DATUMS`; both default to the archive's MLLW
+        from_units, to_units : str, optional
+            "english" (feet) or "metric" (metres)
+
+        Returns
+        -------
+        numpy.ndarray
+            Converted heights, in the dtype of `heights` when it is floating;
+            NaN for stations without one of the datums
+        """
+        heights = np.asarray(heights)
+        dtype = heights.dtype if heights.dtype.kind == "f" else np.float64
+        shift = np.asarray(self.shift(station_ids, from_datum, to_datum, to_units))
+        shift = shift.reshape(shift.shape + (1,) * (heights.ndim - shift.ndim))
+        scale = UNITS[from_units] / UNITS[to_units]
+        return (heights * scale + shift).astype(dtype, copy=False)
+
+
+def query(store, table, station_id, start=None, end=None, datum=DATUM, units="english"):
+    """
+    `SeriesStore.query` with the heights converted to `datum` and `units`.
+
+    The store is assumed to hold the archive's MLLW heights in feet.
+    """
+    times, heights = store.query(station_id, start, end)
+    return times, table.convert(heights, station_id, to_datum=datum, to_units=units)
+
+
+def convert_store(source, destination, table, datum, units="english"):
+    """
+    Write a copy of a series store in another datum and/or unit.
+
+    Stations stream through one at a time; stations without the datum are
+    left out.
+
+    Returns
+    -------
+    tuple[int, list[str]]
+        Stations written and stations skipped
+    """
+    store = SeriesStore(source)
+    known = set(table.station_ids.tolist())
+    skipped = []
+
+    def series():
+        for station_id in store.stations():
+            if station_id not in known or np.isnan(table.shift(station_id, DATUM, datum)):
+                skipped.append(station_id)
+                continue
+            times, heights = query(store, table, station_id, datum=datum, units=units)
+            yield station_id, times.astype("datetime64[m]"), heights
+
+    return len(write_store(destination, series())), skipped
+
+
+async def get_datums(fetcher, station_id):
+    """
+    Fetch and parse one station's datums, retrying failures with backoff.
+
+    Returns
+    -------
+    dict[str, float] or None
+        Output of `parse_datums`, or None when every attempt failed
+    """
+    url = DATUMS_URL.format(stnid=station_id)
+    for attempt in range(RETRIES):
+        status, text = await fetcher.get(url, revalidate=attempt > 0)
+        if status == 200:
+            try:
+                return parse_datums(json.loads(text))
+            except (ValueError, AttributeError):
+                pass
+        await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+    return None
+
+
+async def fetch(station_ids, concurrency=8, rate=10.0, api_root=API_ROOT, cache=None):
+    """
+    Fetch the datums of every station concurrently.
+
+    Returns
+    -------
+    tuple[DatumTable, list[str]]
+        Table of the stations that answered and the IDs that failed
+    """
+    async with AsyncFetcher(concurrency=concurrency, rate=rate, api_root=api_root,
+                            cache=cache) as fetcher:
+        results = await asyncio.gather(*(get_datums(fetcher, i) for i in station_ids))
+        print(fetcher.summary())
+    found = {i: r for i, r in zip(station_ids, results) if r is not None}
+    failed = [i for i, r in zip(station_ids, results) if r is None]
+    return DatumTable.from_datums(found), failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Datums",
+                    description="Fetches station datums and converts stored predictions between datums and units")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fetch_parser = subparsers.add_parser("fetch", help="fetch datums.json for the archived stations")
+    fetch_parser.add_argument("--data-dir", default="data",
+                              help="directory with one stations.json per region")
+    fetch_parser.add_argument("--catalog", default=CATALOG_PATH,
+                              help="station catalog read instead of --data-dir when it has the region lists")
+    fetch_parser.add_argument("--concurrency", type=int, default=8)
+    fetch_parser.add_argument("--rate", type=float, default=10.0,
+                              help="maximum requests per second (0 for unlimited)")
+    fetch_parser.add_argument("--api-root", default=API_ROOT)
+    fetch_parser.add_argument("--no-cache", action="store_true")
+    fetch_parser.add_argument("--output", default=DATUMS_PATH)
+    convert_parser = subparsers.add_parser("convert", help="write the store in another datum/unit")
+    convert_parser.add_argument("--datum", default=DATUM, choices=DATUMS)
+    convert_parser.add_argument("--units", default="english", choices=list(UNITS))
+    convert_parser.add_argument("--store", default=STORE_PATH)
+    convert_parser.add_argument("--output", help="defaults to predictions-<datum>-<units>.tsdb")
+    convert_parser.add_argument("--datums", default=DATUMS_PATH)
+    z0_parser = subparsers.add_parser(
+        "z0", help="write MSL above a datum per station, for harmonic.py/hilo.py --z0")
+    z0_parser.add_argument("--datum", default=DATUM, choices=DATUMS)
+    z0_parser.add_argument("--units", default="english", choices=list(UNITS))
+    z0_parser.add_argument("--datums", default=DATUMS_PATH)
+    z0_parser.add_argument("--output", default="z0.json")
+    args = parser.parse_args()
+    if args.command == "fetch":
+        started = time.monotonic()
+        station_ids = sorted(load_region_stations(args.data_dir, args.catalog))
+        cache = None if args.no_cache else ResponseCache()
+        table, failed = asyncio.run(fetch(station_ids, args.concurrency, args.rate,
+                                          args.api_root, cache))
+        table.save(args.output)
+        print(f"Wrote datums for {len(table)} stations to {args.output} "
+              f"in {time.monotonic() - started:.1f} s")
+        if failed:
+            print(f"{len(failed)} stations failed: {' '.join(failed[:20])}")
+            raise SystemExit(1)
+    elif args.command == "convert":
+        output = args.output or f"predictions-{args.datum}-{args.units}.tsdb"
+        started = time.monotonic()
+        written, skipped = convert_store(args.store, output, DatumTable.load(args.datums),
+                                         args.datum, args.units)
+        print(f"Wrote {written} stations to {output} in {time.monotonic() - started:.1f} s")
+        if skipped:
+            print(f"{len(skipped)} stations have no {args.datum}: {' '.join(skipped[:20])}")
+    else:
+        table = DatumTable.load(args.datums)
+        z0 = table.z0(table.station_ids, args.datum, args.units)
+        known = ~np.isnan(z0)
+        with open(args.output, "w") as f:
+            json.dump(dict(zip(table.station_ids[known].tolist(), z0[known].round(4).tolist())),
+                      f, indent=1)
+        print(f"Wrote z0 for {known.sum()} stations to {args.output}")
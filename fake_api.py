@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+from datetime import date, datetime
+import functools
+import hashlib
+import json
+import random
+import time
+
+from aiohttp import web
+import numpy as np
+
+"""
+Local stand-in for the NOAA APIs, for benchmarks and offline tuning.
+
+Serves synthetic responses of realistic size for the endpoints the fetch
+scripts and spiders use:
+
+* `/api/prod/datagetter`: predictions (CSV or JSON, 6-minute or hilo),
+  water temperature and monthly means, with NOAA's range limits
+* `/mdapi/prod/webapi/geogroups/{id}/children.json` and `stations.json`
+* `/mdapi/prod/webapi/stations/{id}/harcon.json`, `tidepredoffsets.json` and
+  `datums.json`
+* `/dpapi/prod/webapi/product/slr_projections.json`, paginated
+
+Every response carries an ETag and answers If-None-Match with a 304.
+Latency, error rate and a server-side rate limit are configurable; requests
+over the limit get a 429. Point a script at it with `--api-root`:
+
+    python fake_api.py --port 8800 --latency 0.05 --error-rate 0.01
+    python scrape.py --api-root http://127.0.0.1:8800
+"""
+
+# Name, speed in degrees per hour and a typical amplitude in feet
+CONSTITUENTS = [
+    ("M2", 28.9841042, 2.0), ("S2", 30.0, 0.5), ("N2", 28.4397295, 0.4),
+    ("K1", 15.0410686, 1.2), ("M4", 57.9682084, 0.05), ("O1", 13.9430356, 0.75),
+    ("M6", 86.9523127, 0.01), ("MK3", 44.0251729, 0.02), ("S4", 60.0, 0.005),
+    ("MN4", 57.4238337, 0.02), ("NU2", 28.5125831, 0.08), ("S6", 90.0, 0.001),
+    ("MU2", 27.9682084, 0.05), ("2N2", 27.8953548, 0.05), ("OO1", 16.1391017, 0.03),
+    ("LAM2", 29.4556253, 0.01), ("S1", 15.0, 0.02), ("M1", 14.4966939, 0.04),
+    ("J1", 15.5854433, 0.06), ("MM", 0.5443747, 0.02), ("SSA", 0.0821373, 0.1),
+    ("SA", 0.0410686, 0.2), ("MSF", 1.0158958, 0.01), ("MF", 1.0980331, 0.02),
+    ("RHO", 13.4715145, 0.02), ("Q1", 13.3986609, 0.13), ("T2", 29.9589333, 0.03),
+    ("R2", 30.0410667, 0.005), ("2Q1", 12.8542862, 0.02), ("P1", 14.9589314, 0.38),
+    ("2SM2", 31.0158958, 0.005), ("M3", 43.4761563, 0.01), ("L2", 29.5284789, 0.05),
+    ("2MK3", 42.9271398, 0.01), ("K2", 30.0821373, 0.14), ("M8", 115.9364166, 0.001),
+    ("MS4", 58.9841042, 0.01),
+]
+# NOAA's datagetter range limits, in days
+RANGE_LIMITS = {"6": 31, "1": 4, "h": 365, "hilo": 365, "daily_mean": 3650}
+PREDICTION_RANGE_LIMIT = 3650
+SCENARIOS = ["Low", "Intermediate-Low", "Intermediate", "Intermediate-High", "High",
+             "Extreme"]
+PROJECTION_YEARS = list(range(2020, 2160, 10))
+# Distinct synthetic series per year; stations share them to keep the
+# server cheap while payload sizes stay realistic
+VARIANTS = 8
+
+
+class Config:
+    """Server behaviour, see the command line options."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0,
+                 stations_per_region=5, stations=50, since=2020, slr_pages=20,
+                 slr_locations_per_page=20, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.stations_per_region = stations_per_region
+        self.stations = stations
+        self.since = since
+        self.slr_pages = slr_pages
+        self.slr_locations_per_page = slr_locations_per_page
+        self.random = random.Random(seed)
+
+
+def station_id(number):
+    return str(9400000 + number)
+
+
+def station_number(stn_id):
+    return int(stn_id) - 9400000 if str(stn_id).isdigit() else 0
+
+
+@functools.lru_cache(maxsize=64)
+def series(begin, end, step_minutes, variant):
+    """Timestamps and synthetic tide-like heights between two dates (inclusive)."""
+    times = np.arange(np.datetime64(begin, "m"),
+                      np.datetime64(end, "m") + np.timedelta64(1, "D"),
+                      np.timedelta64(step_minutes, "m"))
+    hours = (times - np.datetime64("2000-01-01T00:00", "m")).astype(np.int64) / 60.0
+    heights = np.full(len(times), 3.0)
+    for name, speed, amplitude in CONSTITUENTS[:8]:
+        heights += amplitude * np.cos(np.radians(speed * hours + 37 * variant + len(name)))
+    return times, heights
+
+
+def extrema(times, heights):
+    """Highs and lows of a series, as (times, heights, "H"/"L")."""
+    diff = np.diff(heights)
+    highs = np.flatnonzero((diff[:-1] > 0) & (diff[1:] <= 0)) + 1
+    lows = np.flatnonzero((diff[:-1] < 0) & (diff[1:] >= 0)) + 1
+    rows = np.sort(np.concatenate([highs, lows]))
+    kinds = np.where(np.isin(rows, highs), "H", "L")
+    return times[rows], heights[rows], kinds
+
+
+def payload(text, content_type):
+    """Encoded response body with its ETag and content type."""
+    body = text.encode() if isinstance(text, str) else text
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"', content_type
+
+
+def format_time(times):
+    return np.datetime_as_string(times, unit="m").astype("U16")
+
+
+@functools.lru_cache(maxsize=256)
+def predictions_body(begin, end, interval, fmt, variant):
+    times, heights = series(begin, end, 6, variant)
+    kinds = None
+    if interval == "hilo":
+        times, heights, kinds = extrema(times, heights)
+    stamps = [t.replace("T", " ") for t in format_time(times)]
+    if fmt == "csv":
+        if kinds is None:
+            rows = [f"{t},{h:.3f}" for t, h in zip(stamps, heights)]
+            return payload("Date Time, Prediction\n" + "\n".join(rows) + "\n", "text/csv")
+        rows = [f"{t},{h:.3f},{k}" for t, h, k in zip(stamps, heights, kinds)]
+        return payload("Date Time, Prediction, Type\n" + "\n".join(rows) + "\n", "text/csv")
+    if kinds is None:
+        data = [{"t": t, "v": f"{h:.3f}"} for t, h in zip(stamps, heights)]
+    else:
+        data = [{"t": t, "v": f"{h:.3f}", "type": k} for t, h, k in zip(stamps, heights, kinds)]
+    return payload(json.dumps({"predictions": data}), "application/json")
+
+
+@functools.lru_cache(maxsize=256)
+def observations_data(begin, end, step_minutes, variant):
+    times, heights = series(begin, end, step_minutes, variant)
+    values = 55.0 + 4 * np.sin(heights)
+    stamps = [t.replace("T", " ") for t in format_time(times)]
+    return json.dumps([{"t": t, "v": f"{v:.1f}", "f": "0,0,0"}
+                       for t, v in zip(stamps, values)]).encode()
+
+
+def observations_body(begin, end, step_minutes, variant, stn_id):
+    metadata = {"id": stn_id, "name": f"Station {stn_id}", "lat": "37.8063", "lon": "-122.4659"}
+    data = observations_data(begin, end, step_minutes, variant)
+    return payload(b'{"metadata": ' + json.dumps(metadata).encode() + b', "data": ' + data + b"}",
+                   "application/json")
+
+
+def warm(years):
+    """Generate the yearly prediction files for `years` ahead of the first request."""
+    for year in years:
+        for variant in range(VARIANTS):
+            for interval in ("6", "hilo"):
+                predictions_body(f"{year}-01-01", f"{year}-12-31", interval, "csv", variant)
+
+
+def range_error(message, fmt):
+    if fmt == "csv":
+        return payload(f"Error: {message}\n", "text/csv")
+    return payload(json.dumps({"error": {"message": message}}), "application/json")
+
+
+def datagetter(config, query):
+    stn_id = query.get("station", "")
+    variant = station_number(stn_id) % VARIANTS
+    fmt = query.get("format", "json")
+    product = query.get("product", "")
+    try:
+        begin = datetime.strptime(query["begin_date"][:8], "%Y%m%d").date()
+        end = datetime.strptime(query["end_date"][:8], "%Y%m%d").date()
+    except (KeyError, ValueError):
+        return range_error("Wrong Begin Date or End Date", fmt)
+    interval = query.get("interval", "6")
+    days = (end - begin).days + 1
+    if product == "predictions":
+        if days > PREDICTION_RANGE_LIMIT:
+            return range_error("Range Limit Exceeded: predictions are limited to 10 years.", fmt)
+        return predictions_body(begin.isoformat(), end.isoformat(), interval, fmt, variant)
+    if product == "monthly_mean":
+        months = []
+        for year in range(begin.year, end.year + 1):
+            for month in range(1, 13):
+                months.append({"year": str(year), "month": str(month),
+                               "highest": "9.1", "MHHW": "6.2", "MHW": "5.6", "MSL": "3.3",
+                               "MTL": "3.2", "MLW": "0.9", "MLLW": "0.0", "DTL": "3.1",
+                               "GT": "6.2", "MN": "4.7", "DHQ": "0.6", "DLQ": "0.9",
+                               "HWI": "11.8", "LWI": "5.6", "lowest": "-2.1", "inferred": "0"})
+        return payload(json.dumps({"data": months}), "application/json")
+    limit = RANGE_LIMITS.get(interval, 31)
+    if days > limit:
+        return range_error(
+            f"Range Limit Exceeded: {interval} data is limited to {limit} days.", fmt)
+    step = 60 if interval == "h" else 6
+    return observations_body(begin.isoformat(), end.isoformat(), step, variant, stn_id)
+
+
+def region_children(config, region_id):
+    stations = []
+    for i in range(config.stations_per_region):
+        number = int(region_id) * 100 + i
+        stations.append({
+            "stationId": station_id(number), "stationName": f"Station {number}",
+            "geoGroupName": f"Station {number}", "geoGroupId": number,
+            "lat": 30 + (number % 200) / 10, "lon": -120 + (number % 300) / 10,
+            "stationType": "S" if i % 4 == 3 else "R", "refStationId":
+            station_id(number - 1) if i % 4 == 3 else "", "level": 5,
+            "timeZoneCorr": "-8", "stateName": None, "shefcode": None,
+            "region": None, "subregion": None, "noaachildren": False,
+        })
+    return {"stationList": stations}
+
+
+def station_list(config, query):
+    details = "details" in query.get("expand", "")
+    stations = []
+    for i in range(config.stations):
+        stn_id = station_id(i)
+        station = {
+            "id": stn_id, "name": f"Station {i}", "state": "CA",
+            "lat": 30 + (i % 200) / 10, "lng": -120 + (i % 300) / 10,
+            "type": "S" if i % 4 == 3 else "R", "affiliations": "",
+            "timezonecorr": -8, "self": f"/mdapi/prod/webapi/stations/{stn_id}.json",
+        }
+        if details:
+            established = date(config.since + i % 3, 1 + i % 12, 1)
+            station["details"] = {
+                "id": stn_id, "established": f"{established} 00:00:00.0",
+                "removed": "", "noaachart": "18649", "timezone": "PST",
+                "origyear": f"{established} 00:00:00.0",
+            }
+        stations.append(station)
+    return {"count": len(stations), "units": query.get("units"), "stations": stations}
+
+
+def harcon(config, stn_id):
+    rng = random.Random(station_number(stn_id))
+    constituents = []
+    for number, (name, speed, amplitude) in enumerate(CONSTITUENTS, start=1):
+        phase = rng.uniform(0, 360)
+        constituents.append({
+            "number": number, "name": name, "description": f"{name} constituent",
+            "amplitude": round(amplitude * rng.uniform(0.5, 1.5), 3),
+            "phase_GMT": round(phase, 1), "phase_local": round((phase + 120) % 360, 1),
+            "speed": speed,
+        })
+    return {"units": "feet", "HarmonicConstituents": constituents,
+            "self": f"/mdapi/prod/webapi/stations/{stn_id}/harcon.json"}
+
+
+def tidepredoffsets(config, stn_id):
+    number = station_number(stn_id)
+    return {
+        "refStationId": station_id(number - number % 4), "type": "S",
+        "heightOffsetHighTide": 0.92, "heightOffsetLowTide": 0.88,
+        "timeOffsetHighTide": 23, "timeOffsetLowTide": 41, "heightAdjustedType": "R",
+        "self": f"/mdapi/prod/webapi/stations/{stn_id}/tidepredoffsets.json",
+    }
+
+
+def datums(config, stn_id, units):
+    rng = random.Random(station_number(stn_id))
+    mllw = rng.uniform(1.0, 5.0)
+    msl = mllw + rng.uniform(0.5, 1.5)
+    mhhw = 2 * msl - mllw
+    values = {"MHHW": mhhw, "MHW": mhhw - 0.2, "MTL": msl, "MSL": msl, "DTL": msl,
+              "MLW": mllw + 0.2, "MLLW": mllw, "STND": 0.0, "GT": mhhw - mllw}
+    if station_number(stn_id) % 3:
+        values["NAVD88"] = msl - rng.uniform(-0.3, 0.3)
+    scale = 1.0 if units == "metric" else 3.28084
+    return {
+        "accepted": "Yes", "superseded": "No", "epoch": "1983-2001",
+        "units": "meters" if units == "metric" else "feet", "OrthometricDatum": "NAVD88",
+        "datums": [{"name": name, "description": name, "value": round(value * scale, 3)}
+                   for name, value in values.items()],
+        "LAT": round((mllw - 0.3) * scale, 3), "HAT": round((mhhw + 0.3) * scale, 3),
+        "self": f"/mdapi/prod/webapi/stations/{stn_id}/datums.json",
+    }
+
+
+def slr_page(config, page):
+    rng = random.Random(page)
+    records = []
+    for i in range(config.slr_locations_per_page):
+        number = page * config.slr_locations_per_page + i
+        grid = number % 3 == 2
+        for scenario_number, scenario in enumerate(SCENARIOS):
+            for year in PROJECTION_YEARS:
+                rise = (year - 2005) / 100 * (0.3 + scenario_number * 0.5)
+                record = {
+                    "lat": 20 + number % 30, "lon": -160 + number % 90,
+                    "scenario": scenario, "projectionYear": year,
+                    "projectionRsl": round(rise + rng.uniform(-0.05, 0.05), 2),
+                    "projectionsCi17": round(rise * 0.8, 2),
+                    "projectionsCi83": round(rise * 1.2, 2),
+                    "projectionUnits": "ft", "reportYear": 2022,
+                }
+                if grid:
+                    record["gridId"] = f"grid-{number}"
+                else:
+                    record.update(stationId=station_id(number), stationName=f"Station {number}")
+                records.append(record)
+    return {"count": len(records), "totalPages": config.slr_pages,
+            "ProjectionsList": records}
+
+
+class RateLimiter:
+    """Fixed one-second window counter; 0 disables limiting."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.window = 0
+        self.count = 0
+
+    def allow(self):
+        if self.rate <= 0:
+            return True
+        window = int(time.monotonic())
+        if window != self.window:
+            self.window, self.count = window, 0
+        self.count += 1
+        return self.count <= self.rate
+
+
+def make_app(config):
+    """
+    Build the aiohttp application.
+
+    Parameters
+    ----------
+    config : Config
+        Server behaviour
+
+    Returns
+    -------
+    aiohttp.web.Application
+    """
+    limiter = RateLimiter(config.rate_limit)
+    stats = {"requests": 0, "errors": 0, "throttled": 0, "not_modified": 0}
+    slr_pages = {}
+
+    def respond(request, response):
+        body, etag, content_type = response
+        if request.headers.get("If-None-Match") == etag:
+            stats["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type=content_type, headers={"ETag": etag})
+
+    @web.middleware
+    async def behaviour(request, handler):
+        stats["requests"] += 1
+        if not limiter.allow():
+            stats["throttled"] += 1
+            return web.Response(status=429, text="Too Many Requests",
+                                headers={"Retry-After": "1"})
+        delay = config.latency + config.random.uniform(0, config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if config.random.random() < config.error_rate:
+            stats["errors"] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        return await handler(request)
+
+    async def get_datagetter(request):
+        response = await asyncio.to_thread(datagetter, config, dict(request.query))
+        return respond(request, response)
+
+    async def get_children(request):
+        data = region_children(config, request.match_info["region_id"])
+        return respond(request, payload(json.dumps(data), "application/json"))
+
+    async def get_stations(request):
+        data = station_list(config, request.query)
+        return respond(request, payload(json.dumps(data), "application/json"))
+
+    async def get_station_resource(request):
+        stn_id, resource = request.match_info["station_id"], request.match_info["resource"]
+        if resource == "harcon":
+            data = harcon(config, stn_id)
+        elif resource == "tidepredoffsets":
+            data = tidepredoffsets(config, stn_id)
+        elif resource == "datums":
+            data = datums(config, stn_id, request.query.get("units", "english"))
+        else:
+            raise web.HTTPNotFound()
+        return respond(request, payload(json.dumps(data), "application/json"))
+
+    async def get_slr(request):
+        page = int(request.query.get("page", 1))
+        if not 1 <= page <= config.slr_pages:
+            data = {"count": 0, "totalPages": config.slr_pages, "ProjectionsList": []}
+            return respond(request, payload(json.dumps(data), "application/json"))
+        if page not in slr_pages:
+            data = await asyncio.to_thread(slr_page, config, page)
+            slr_pages[page] = payload(json.dumps(data), "application/json")
+        return respond(request, slr_pages[page])
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(middlewares=[behaviour])
+    app.router.add_get("/api/prod/datagetter", get_datagetter)
+    app.router.add_get("/mdapi/prod/webapi/geogroups/{region_id}/children.json", get_children)
+    app.router.add_get("/mdapi/prod/webapi/stations.json", get_stations)
+    app.router.add_get("/mdapi/prod/webapi/stations/{station_id}/{resource}.json",
+                       get_station_resource)
+    app.router.add_get("/dpapi/prod/webapi/product/slr_projections.json", get_slr)
+    app.router.add_get("/_stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Fake API",
+                    description="Serves synthetic NOAA API responses for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="extra random delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="requests per second above which a 429 is returned")
+    parser.add_argument("--stations-per-region", type=int, default=5)
+    parser.add_argument("--stations", type=int, default=50,
+                        help="stations in every stations.json list")
+    parser.add_argument("--since", type=int, default=2020,
+                        help="earliest year stations are established")
+    parser.add_argument("--slr-pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm", type=int, nargs="*", default=[], metavar="YEAR",
+                        help="years of yearly prediction files to generate at startup")
+    args = parser.parse_args()
+    config = Config(args.latency, args.jitter, args.error_rate, args.rate_limit,
+                    args.stations_per_region, args.stations, args.since, args.slr_pages,
+                    seed=args.seed)
+    warm(args.warm)
+    web.run_app(make_app(config), host=args.host, port=args.port, print=None)
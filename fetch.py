@@ -0,0 +1,216 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+"""
+Shared asyncio HTTP engine for the plain (non-Scrapy) fetch scripts.
+
+All requests go through one `aiohttp.ClientSession`, so connections to the
+API are kept alive and reused instead of paying a TCP+TLS handshake per
+request. The connection pool caps in-flight requests per host, and a token
+bucket caps the request rate. Point `api_root` at a local stand-in server to
+tune both without touching the real API.
+"""
+
+API_ROOT = "https://api.tidesandcurrents.noaa.gov"
+# Latencies kept for percentiles, however long a crawl runs
+LATENCY_SAMPLE_SIZE = 10000
+
+
+def rebase(url, api_root=API_ROOT):
+    """
+    Swap the NOAA API host of a URL for another root, e.g. a local server.
+
+    Parameters
+    ----------
+    url : str
+        A URL starting with `API_ROOT`
+    api_root : str, optional
+        Replacement scheme and host, by default the real API
+
+    Returns
+    -------
+    str
+        The rewritten URL
+    """
+    if api_root == API_ROOT or not url.startswith(API_ROOT):
+        return url
+    return api_root.rstrip("/") + url[len(API_ROOT):]
+
+
+class Reservoir:
+    """
+    Uniform random sample of at most `size` values from a stream of any
+    length (reservoir sampling), for percentiles in bounded memory.
+    """
+
+    def __init__(self, size=LATENCY_SAMPLE_SIZE, seed=None):
+        self.size = size
+        self.count = 0
+        self.sample = []
+        self.random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        else:
+            index = self.random.randrange(self.count)
+            if index < self.size:
+                self.sample[index] = value
+
+
+class TokenBucket:
+    """Token-bucket rate limiter for coroutines."""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second; 0 or less disables limiting
+        capacity : float, optional
+            Maximum burst size, by default `rate` (one second's worth)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    """
+    Pooled keep-alive HTTP client with per-host concurrency and rate caps.
+
+    Use as an async context manager:
+
+        async with AsyncFetcher(concurrency=8, rate=10) as fetcher:
+            status, text = await fetcher.get(url)
+    """
+
+    def __init__(self, concurrency=8, rate=10.0, api_root=API_ROOT, timeout=120,
+                 cache=None, metrics=None):
+        """
+        Parameters
+        ----------
+        concurrency : int, optional
+            Maximum open connections (and so in-flight requests) per host
+        rate : float, optional
+            Maximum requests per second across all hosts; 0 disables limiting
+        api_root : str, optional
+            Scheme and host to send NOAA API requests to
+        timeout : float, optional
+            Total seconds allowed per request
+        cache : response_cache.ResponseCache, optional
+            Shared on-disk cache; fresh entries skip the network and stale
+            ones are revalidated with conditional requests
+        metrics : metrics.Metrics, optional
+            Where to record per-endpoint latency, bytes and status codes
+        """
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.api_root = api_root
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = cache
+        self.metrics = metrics
+        self.session = None
+        self.cache_hits = 0
+        self.requests = 0
+        self.bytes = 0
+        self.errors = 0
+        # Seconds from sending a request to reading its whole body, sampled
+        self.latencies = Reservoir()
+        self.started = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=0, limit_per_host=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get(self, url, revalidate=False):
+        """
+        Fetch a URL as text.
+
+        Parameters
+        ----------
+        url : str
+            NOAA API URL; rebased onto `api_root`
+        revalidate : bool, optional
+            Check a fresh cache entry with the server anyway, e.g. when
+            looking for revised data
+
+        Returns
+        -------
+        tuple[int, str]
+            HTTP status (0 on a connection error or timeout) and body text
+        """
+        # The cache is keyed on the URL actually requested, so responses of
+        # a stand-in server never pass for the real API's
+        target = rebase(url, self.api_root)
+        cached = None
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.lookup, target)
+        if cached is not None and cached.fresh and not revalidate:
+            self.cache_hits += 1
+            if self.metrics is not None:
+                self.metrics.cache_hit(url)
+            return cached.status, cached.body.decode()
+        headers = cached.conditional_headers() if cached is not None else {}
+        await self.bucket.acquire()
+        sent = time.monotonic()
+        try:
+            async with self.session.get(target, headers=headers) as response:
+                body = await response.read()
+                status = response.status
+                response_headers = dict(response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            if self.metrics is not None:
+                self.metrics.observe(url, 0, time.monotonic() - sent)
+            return 0, str(e)
+        latency = time.monotonic() - sent
+        self.latencies.add(latency)
+        if self.metrics is not None:
+            self.metrics.observe(url, status, latency, len(body))
+        self.requests += 1
+        self.bytes += len(body)
+        if status not in (200, 304):
+            self.errors += 1
+        if status == 304 and cached is not None:
+            self.cache.revalidated(target)
+            return cached.status, cached.body.decode()
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.store, target, status, body, response_headers)
+        return status, body.decode()
+
+    def requests_per_second(self):
+        """Average completed requests per second since the session opened."""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        """One-line throughput report."""
+        return (f"{self.requests} requests, {self.cache_hits} cache hits, "
+                f"{self.bytes / 1e6:.1f} MB, {self.requests_per_second():.2f} req/s")
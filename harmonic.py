@@ -0,0 +1,584 @@
+import argparse
+import json
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from noaa_scrape.noaa_scrape.shards import latest_body
+from noaa_scrape.noaa_scrape.station_catalog import CATALOG_PATH, region_station_lists
+
+"""
+Local tide predictions synthesized from the harmonic constituents archived by
+the `harmonicconstituents` spider (one `harcon.json` response per station, in
+its `<station_id>.jsonl.zst` shard).
+
+A prediction at time t (hours since the start of the year, GMT) is
+
+    h(t) = Z0 + sum_c f_c * H_c * cos(a_c * t + (V0_c + u_c) - kappa_c)
+
+where H, kappa and a are the amplitude, Greenwich phase (phase_GMT) and speed
+of each constituent, V0 is the equilibrium argument at the start of the year
+and f, u are the node factor and nodal phase correction at the middle of the
+year, following Schureman (1958) as NOAA does. The harmonic sum is evaluated
+as one matrix product per year:
+
+    heights = (H f cos kappa) @ cos(a t + V0 + u) + (H f sin kappa) @ sin(a t + V0 + u)
+
+so many stations and long time ranges cost a single (stations x constituents)
+by (constituents x times) product.
+
+The constituents are referenced to mean sea level. Pass the height of MSL
+above the target datum (e.g. MSL - MLLW) as `z0` to get datum-referenced
+predictions; the command line takes it from `datums.py` and will not write
+MSL-referenced files. Its output is in GMT, named after the datum (see
+`station_filename`). With the full 37-constituent NOAA set and the correct `z0`, the
+6-minute heights should agree with NOAA's published predictions to within
+about 0.1 ft; use `residuals` to check a station against a downloaded file.
+"""
+
+# The spiders run from noaa_scrape/ and write their output there
+HARCON_DIR = "noaa_scrape/data-harmonicconstituents"
+DATUM = "MLLW"
+FEET_PER_METER = 3.280839895
+SIX_MINUTES = np.timedelta64(6, "m")
+
+# Equilibrium argument coefficients on (T, s, h, p, p1) plus a constant in
+# degrees, and the nodal u/f formula to use (Schureman, Table 2).
+BASE_CONSTITUENTS = {
+    "M2": ((2, -2, 2, 0, 0, 0), "M2", "M2"),
+    "S2": ((2, 0, 0, 0, 0, 0), None, None),
+    "N2": ((2, -3, 2, 1, 0, 0), "M2", "M2"),
+    "K1": ((1, 0, 1, 0, 0, -90), "K1", "K1"),
+    "O1": ((1, -2, 1, 0, 0, 90), "O1", "O1"),
+    "NU2": ((2, -3, 4, -1, 0, 0), "M2", "M2"),
+    "MU2": ((2, -4, 4, 0, 0, 0), "M2", "M2"),
+    "2N2": ((2, -4, 2, 2, 0, 0), "M2", "M2"),
+    "OO1": ((1, 2, 1, 0, 0, -90), "OO1", "OO1"),
+    "LAM2": ((2, -1, 0, 1, 0, 180), "M2", "M2"),
+    "S1": ((1, 0, 0, 0, 0, 0), None, None),
+    "M1": ((1, -1, 1, 1, 0, -90), "M1", "M1"),
+    "J1": ((1, 1, 1, -1, 0, -90), "J1", "J1"),
+    "MM": ((0, 1, 0, -1, 0, 0), None, "MM"),
+    "SSA": ((0, 0, 2, 0, 0, 0), None, None),
+    "SA": ((0, 0, 1, 0, 0, 0), None, None),
+    "MF": ((0, 2, 0, 0, 0, 0), "MF", "MF"),
+    "RHO": ((1, -3, 3, -1, 0, 90), "O1", "O1"),
+    "Q1": ((1, -3, 1, 1, 0, 90), "O1", "O1"),
+    "T2": ((2, 0, -1, 0, 1, 0), None, None),
+    "R2": ((2, 0, 1, 0, -1, 180), None, None),
+    "2Q1": ((1, -4, 1, 2, 0, 90), "O1", "O1"),
+    "P1": ((1, 0, -1, 0, 0, 90), None, None),
+    "M3": ((3, -3, 3, 0, 0, 0), "M3", "M3"),
+    "L2": ((2, -1, 2, -1, 0, 180), "L2", "L2"),
+    "K2": ((2, 0, 2, 0, 0, 0), "K2", "K2"),
+}
+
+# Shallow-water and compound constituents as combinations of the above.
+COMPOUND_CONSTITUENTS = {
+    "M4": {"M2": 2},
+    "M6": {"M2": 3},
+    "M8": {"M2": 4},
+    "MK3": {"M2": 1, "K1": 1},
+    "MN4": {"M2": 1, "N2": 1},
+    "MS4": {"M2": 1, "S2": 1},
+    "S4": {"S2": 2},
+    "S6": {"S2": 3},
+    "2MK3": {"M2": 2, "K1": -1},
+    "2SM2": {"S2": 2, "M2": -1},
+    "MSF": {"S2": 1, "M2": -1},
+}
+
+
+class HarmonicStations(NamedTuple):
+    """Harmonic constants for a batch of stations on a shared constituent set."""
+    station_ids: list[str]
+    names: list[str]
+    speeds: np.ndarray  # (constituents,) degrees per hour
+    amplitudes: np.ndarray  # (stations, constituents) feet
+    phases: np.ndarray  # (stations, constituents) degrees, GMT
+
+
+def astronomical_arguments(when):
+    """
+    Mean astronomical longitudes and derived lunar orbit angles.
+
+    Parameters
+    ----------
+    when : numpy.datetime64
+        Instant (UTC) at which to evaluate the arguments
+
+    Returns
+    -------
+    dict[str, float]
+        Angles in degrees: T (hour angle of the mean sun), s, h, p, N, p1
+        and the Schureman quantities I, nu, xi, nup, nupp (2nu''), P, R, Q
+        and Qa_inv (1/Qa)
+    """
+    minutes = (np.datetime64(when, "m") - np.datetime64("2000-01-01T12:00", "m")).astype(float)
+    c = minutes / (1440 * 36525)
+    hours_of_day = (minutes / 60 + 12) % 24
+    args = {
+        "T": 180 + 15 * hours_of_day,
+        "s": 218.3164477 + 481267.88123421 * c - 0.0015786 * c**2,
+        "h": 280.46646 + 36000.76983 * c + 0.0003032 * c**2,
+        "p": 83.3532465 + 4069.0137287 * c - 0.0103200 * c**2,
+        "N": 125.04452 - 1934.136261 * c + 0.0020708 * c**2,
+        "p1": 282.93735 + 1.71946 * c + 0.00046 * c**2,
+    }
+    omega = np.radians(23.4392911 - 0.0130042 * c)
+    i = np.radians(5.145)
+    n = np.radians(args["N"])
+
+    cos_incl = np.cos(i) * np.cos(omega) - np.sin(i) * np.sin(omega) * np.cos(n)
+    incl = np.arccos(cos_incl)
+    e1 = np.arctan(np.tan(n / 2) * np.cos((omega - i) / 2) / np.cos((omega + i) / 2)) - n / 2
+    e2 = np.arctan(np.tan(n / 2) * np.sin((omega - i) / 2) / np.sin((omega + i) / 2)) - n / 2
+    xi = -(e1 + e2)
+    nu = e1 - e2
+    nup = np.arctan2(np.sin(2 * incl) * np.sin(nu),
+                     np.sin(2 * incl) * np.cos(nu) + 0.3347)
+    nupp2 = np.arctan2(np.sin(incl)**2 * np.sin(2 * nu),
+                       np.sin(incl)**2 * np.cos(2 * nu) + 0.0727)
+    perigee = np.radians(args["p"]) - xi
+    r = np.arctan2(np.sin(2 * perigee),
+                   np.cos(incl / 2)**2 / np.sin(incl / 2)**2 / 6 - np.cos(2 * perigee))
+    q = np.arctan2((5 * cos_incl - 1) * np.sin(perigee),
+                   (7 * cos_incl + 1) * np.cos(perigee))
+    args.update({
+        "I": np.degrees(incl),
+        "xi": np.degrees(xi),
+        "nu": np.degrees(nu),
+        "nup": np.degrees(nup),
+        "nupp": np.degrees(nupp2),
+        "P": np.degrees(perigee),
+        "R": np.degrees(r),
+        "Q": np.degrees(q),
+        "Qa_inv": np.sqrt(2.310 + 1.435 * np.cos(2 * perigee)),
+    })
+    return args
+
+
+def _nodal_u(key, a):
+    if key is None:
+        return 0.0
+    xi, nu = a["xi"], a["nu"]
+    return {
+        "M2": 2 * xi - 2 * nu,
+        "O1": 2 * xi - nu,
+        "K1": -a["nup"],
+        "K2": -a["nupp"],
+        "OO1": -2 * xi - nu,
+        "J1": -nu,
+        "M1": xi - nu + a["Q"],
+        "MF": -2 * xi,
+        "M3": 3 * xi - 3 * nu,
+        "L2": 2 * xi - 2 * nu - a["R"],
+    }[key]
+
+
+def _nodal_f(key, a):
+    if key is None:
+        return 1.0
+    incl, nu = np.radians(a["I"]), np.radians(a["nu"])
+    f_m2 = np.cos(incl / 2)**4 / 0.9154
+    f_o1 = np.sin(incl) * np.cos(incl / 2)**2 / 0.3800
+    if key == "M2":
+        return f_m2
+    if key == "O1":
+        return f_o1
+    if key == "K1":
+        return np.sqrt(0.8965 * np.sin(2 * incl)**2
+                       + 0.6001 * np.sin(2 * incl) * np.cos(nu) + 0.1006)
+    if key == "K2":
+        return np.sqrt(19.0444 * np.sin(incl)**4
+                       + 2.7702 * np.sin(incl)**2 * np.cos(2 * nu) + 0.0981)
+    if key == "OO1":
+        return np.sin(incl) * np.sin(incl / 2)**2 / 0.0164
+    if key == "J1":
+        return np.sin(2 * incl) / 0.7214
+    if key == "M1":
+        return f_o1 * a["Qa_inv"]
+    if key == "MF":
+        return np.sin(incl)**2 / 0.1578
+    if key == "MM":
+        return (2 / 3 - np.sin(incl)**2) / 0.5021
+    if key == "M3":
+        return f_m2**1.5
+    if key == "L2":
+        tan_half = np.tan(incl / 2)
+        p = np.radians(a["P"])
+        return f_m2 * np.sqrt(1 - 12 * tan_half**2 * np.cos(2 * p) + 36 * tan_half**4)
+    raise KeyError(key)
+
+
+def _base_terms(name, start_args, mid_args):
+    coefficients, u_key, f_key = BASE_CONSTITUENTS[name]
+    v0 = coefficients[-1] + sum(
+        k * start_args[arg] for k, arg in zip(coefficients, ("T", "s", "h", "p", "p1")))
+    return v0, _nodal_u(u_key, mid_args), _nodal_f(f_key, mid_args)
+
+
+def nodal_corrections(names, year):
+    """
+    Equilibrium arguments and node factors for a list of constituents.
+
+    V0 is evaluated at 00:00 GMT on January 1 of `year`; f and u at the
+    middle of the year.
+
+    Parameters
+    ----------
+    names : list[str]
+        NOAA constituent names, e.g. ["M2", "S2", ...]
+    year : int
+        The 4-digit year
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        V0 + u in degrees and f, each with one entry per constituent
+
+    Raises
+    ------
+    KeyError
+        When a constituent name is not known
+    """
+    start_args = astronomical_arguments(np.datetime64(f"{year}-01-01T00:00"))
+    mid_args = astronomical_arguments(np.datetime64(f"{year}-07-02T12:00"))
+    vu = np.zeros(len(names))
+    f = np.ones(len(names))
+    for index, name in enumerate(names):
+        parts = COMPOUND_CONSTITUENTS.get(name, {name: 1})
+        for base, multiple in parts.items():
+            v0, u, base_f = _base_terms(base, start_args, mid_args)
+            vu[index] += multiple * (v0 + u)
+            f[index] *= base_f ** abs(multiple)
+    return np.mod(vu, 360), f
+
+
+def parse_harcon(data):
+    """
+    Constituents of a decoded `harcon.json` response.
+
+    Returns
+    -------
+    dict[str, tuple[float, float, float]]
+        Constituent name mapped to (amplitude in feet, phase_GMT in degrees,
+        speed in degrees per hour)
+    """
+    scale = FEET_PER_METER if str(data.get("units", "feet")).lower().startswith("m") else 1.0
+    return {
+        c["name"].upper(): (c["amplitude"] * scale, c["phase_GMT"], c["speed"])
+        for c in data["HarmonicConstituents"]
+    }
+
+
+def load_harcon(path):
+    """
+    Read a `harcon.json` file, see `parse_harcon`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the JSON file
+    """
+    with open(path, "r") as f:
+        return parse_harcon(json.load(f))
+
+
+def read_harcon(station_id, harcon_dir=HARCON_DIR):
+    """
+    Constituents of one station as archived by the `harmonicconstituents`
+    spider: the latest response in its shard or, from crawls before the
+    shards, its `{station_id}.json` file.
+
+    Returns
+    -------
+    dict or None
+        As `parse_harcon`, or None when nothing is archived or the archived
+        response is an API error
+    """
+    body = latest_body(harcon_dir, station_id)
+    if body is None:
+        path = os.path.join(harcon_dir, f"{station_id}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            body = f.read()
+    data = json.loads(body)
+    if "HarmonicConstituents" not in data:
+        return None
+    return parse_harcon(data)
+
+
+def load_stations(station_ids, harcon_dir=HARCON_DIR):
+    """
+    Load harmonic constants for several stations into aligned matrices.
+
+    Stations without archived constants (see `read_harcon`) are left out.
+    Constituents missing at a station get zero amplitude.
+
+    Parameters
+    ----------
+    station_ids : list[str]
+        NOAA station IDs
+    harcon_dir : str, optional
+        Directory written by the `harmonicconstituents` spider
+
+    Returns
+    -------
+    HarmonicStations
+        Constants for the stations that were found
+
+    Raises
+    ------
+    FileNotFoundError
+        When `harcon_dir` does not exist
+    """
+    if not os.path.isdir(harcon_dir):
+        raise FileNotFoundError(f"no harmonic constituents in {harcon_dir}: crawl them with "
+                                f"the harmonicconstituents spider or pass --harcon-dir")
+    harcons = {}
+    for stn_id in station_ids:
+        harcon = read_harcon(str(stn_id), harcon_dir)
+        if harcon is not None:
+            harcons[str(stn_id)] = harcon
+    speeds = {}
+    for harcon in harcons.values():
+        for name, (_, _, speed) in harcon.items():
+            if name in BASE_CONSTITUENTS or name in COMPOUND_CONSTITUENTS:
+                speeds.setdefault(name, speed)
+    names = sorted(speeds, key=lambda name: speeds[name])
+    amplitudes = np.zeros((len(harcons), len(names)))
+    phases = np.zeros((len(harcons), len(names)))
+    for row, harcon in enumerate(harcons.values()):
+        for col, name in enumerate(names):
+            amplitude, phase, _ = harcon.get(name, (0.0, 0.0, 0.0))
+            amplitudes[row, col] = amplitude
+            phases[row, col] = phase
+    return HarmonicStations(list(harcons), names,
+                            np.array([speeds[n] for n in names]), amplitudes, phases)
+
+
+def predict(stations, start, end, step=SIX_MINUTES, z0=None, utc_offset=0.0,
+            dtype=np.float64):
+    """
+    Synthesize evenly spaced predictions for a batch of stations.
+
+    Parameters
+    ----------
+    stations : HarmonicStations
+        Output of `load_stations`
+    start : str or numpy.datetime64
+        First timestamp (inclusive), in the output time zone
+    end : str or numpy.datetime64
+        Last timestamp (exclusive), in the output time zone
+    step : numpy.timedelta64, optional
+        Sampling interval, by default 6 minutes
+    z0 : numpy.ndarray or float, optional
+        Height of MSL above the target datum, per station or shared. Defaults
+        to 0 (heights relative to MSL).
+    utc_offset : float, optional
+        Hours to add to GMT for the output timestamps, e.g. -8 for local
+        standard time on the US west coast. Defaults to 0 (GMT).
+    dtype : numpy dtype, optional
+        Output precision, by default float64
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        Timestamps (datetime64[m]) and heights of shape (stations, times)
+    """
+    times = np.arange(np.datetime64(start, "m"), np.datetime64(end, "m"),
+                      np.timedelta64(step, "m"))
+    gmt = times - np.timedelta64(int(round(utc_offset * 60)), "m")
+    heights = np.empty((len(stations.station_ids), len(times)), dtype=dtype)
+    years = gmt.astype("datetime64[Y]")
+    amplitudes = stations.amplitudes
+    phases = np.radians(stations.phases)
+    unique_years, bounds = np.unique(years, return_index=True)
+    bounds = list(bounds) + [len(times)]
+    for year, lo, hi in zip(unique_years, bounds[:-1], bounds[1:]):
+        hours = (gmt[lo:hi] - year.astype("datetime64[m]")).astype(float) / 60
+        vu, f = nodal_corrections(stations.names, int(str(year)))
+        angle = np.radians(np.outer(stations.speeds, hours) + vu[:, None])
+        scaled = amplitudes * f
+        heights[:, lo:hi] = (scaled * np.cos(phases)).astype(dtype) @ np.cos(angle).astype(dtype)
+        heights[:, lo:hi] += (scaled * np.sin(phases)).astype(dtype) @ np.sin(angle).astype(dtype)
+    if z0 is not None:
+        heights += np.reshape(np.asarray(z0, dtype=dtype), (-1, 1))
+    return times, heights
+
+
+def format_csv(times, heights):
+    """
+    Render one station's series in the layout of NOAA's datagetter CSV.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Timestamps (datetime64[m])
+    heights : numpy.ndarray
+        Heights in feet, same length as `times`
+
+    Returns
+    -------
+    str
+        CSV text with a "Date Time, Prediction" header
+    """
+    stamps = np.datetime_as_string(times, unit="m")
+    rows = [f"{stamp[:10]} {stamp[11:]},{height:.3f}"
+            for stamp, height in zip(stamps, heights)]
+    return "Date Time, Prediction\n" + "\n".join(rows) + "\n"
+
+
+def residuals(path, stations, row, z0=0.0, utc_offset=0.0):
+    """
+    Compare local predictions for one station with a NOAA CSV download.
+
+    Parameters
+    ----------
+    path : str
+        6-minute prediction CSV saved by `scrape.py`
+    stations : HarmonicStations
+        Output of `load_stations`
+    row : int
+        Index of the station in `stations`
+    z0 : float, optional
+        Height of MSL above the datum of the downloaded file
+    utc_offset : float, optional
+        Hours from GMT of the downloaded file's timestamps
+
+    Returns
+    -------
+    numpy.ndarray
+        Local minus NOAA heights, in feet
+    """
+    stamps, noaa = [], []
+    with open(path, "r") as f:
+        next(f)
+        for line in f:
+            stamp, value = line.strip().split(",")[:2]
+            stamps.append(stamp.replace(" ", "T"))
+            noaa.append(float(value))
+    times = np.array(stamps, dtype="datetime64[m]")
+    single = stations._replace(
+        station_ids=[stations.station_ids[row]],
+        amplitudes=stations.amplitudes[row:row + 1],
+        phases=stations.phases[row:row + 1],
+    )
+    local_times, local = predict(single, times[0], times[-1] + SIX_MINUTES,
+                                 z0=z0, utc_offset=utc_offset)
+    index = ((times - local_times[0]) // SIX_MINUTES).astype(int)
+    return local[0, index] - np.array(noaa)
+
+
+def station_filename(stn, year, datum=DATUM, kind="Predictions"):
+    """
+    File name for a station-year of local predictions.
+
+    Unlike the "Tidal Data" files of `scrape.py` (MLLW, local standard/daylight
+    time), the name carries the datum and says the times are GMT.
+    """
+    filename = f"{year} {stn['geoGroupName']} {stn['stationId']} Harmonic {kind} {datum} GMT.csv"
+    return filename.replace("/", "---")
+
+
+def load_z0(station_ids, z0_path=None, datum=DATUM, datums_path=None):
+    """
+    Height of MSL above `datum` per station, the `z0` of `predict`.
+
+    Parameters
+    ----------
+    station_ids : list[str]
+        NOAA station IDs
+    z0_path : str, optional
+        JSON file written by `datums.py z0`, mapping station ID to z0 in
+        feet; by default z0 is computed from the datum table instead
+    datum : str, optional
+        Datum to reference heights to, when using the datum table
+    datums_path : str, optional
+        Datum table written by `datums.py fetch`, by default
+        `datums.DATUMS_PATH`
+
+    Returns
+    -------
+    numpy.ndarray
+        z0 in feet per station, NaN where it is not known
+    """
+    if z0_path:
+        with open(z0_path, "r") as f:
+            by_station = json.load(f)
+        return np.array([by_station.get(i, np.nan) for i in station_ids], dtype=float)
+    # datums.py imports this module for FEET_PER_METER
+    from datums import DATUMS_PATH, DatumTable
+
+    table = DatumTable.load(datums_path or DATUMS_PATH)
+    station_ids = np.asarray(station_ids, dtype=str)
+    known = np.isin(station_ids, table.station_ids)
+    z0 = np.full(len(station_ids), np.nan)
+    if known.any():
+        z0[known] = table.z0(station_ids[known], datum)
+    return z0
+
+
+def add_z0_arguments(parser):
+    """`--z0`, `--datum` and `--datums`, shared with `hilo.py`."""
+    parser.add_argument("--z0", help="JSON file mapping station ID to MSL above the datum in feet, "
+                                     "from datums.py z0; by default taken from --datums")
+    parser.add_argument("--datum", default=DATUM,
+                        help="datum the heights are referenced to, named in the output files")
+    parser.add_argument("--datums", help="datum table from datums.py fetch, used without --z0; "
+                                         "defaults to station-datums.npz")
+
+
+def check_z0_arguments(parser, args):
+    """Exit with a usage error when neither `--z0` nor a datum table is available."""
+    if args.z0:
+        return
+    from datums import DATUMS_PATH
+
+    if not os.path.exists(args.datums or DATUMS_PATH):
+        parser.error("predictions are relative to MSL: pass --z0 from `datums.py z0` or "
+                     "fetch the datum table with `datums.py fetch`")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Harmonic",
+                    description="Synthesizes 6-minute tide predictions from archived harmonic constituents")
+    parser.add_argument("start_year", type=int)
+    parser.add_argument("end_year", type=int, help="inclusive")
+    parser.add_argument("--data-dir", default="data",
+                        help="directory with one stations.json per region")
+    parser.add_argument("--catalog", default=CATALOG_PATH,
+                        help="station catalog read instead of --data-dir when it has the region lists")
+    parser.add_argument("--harcon-dir", default=HARCON_DIR)
+    parser.add_argument("--output-dir", default="data-harmonic")
+    add_z0_arguments(parser)
+    args = parser.parse_args()
+    check_z0_arguments(parser, args)
+    no_z0 = []
+    for region, region_stns in region_station_lists(args.data_dir, args.catalog).items():
+        stns = [i for i in region_stns if i["stationType"] == "R"]
+        by_id = {str(i["stationId"]): i for i in stns}
+        z0_by_station = dict(zip(by_id, load_z0(list(by_id), args.z0, args.datum, args.datums)))
+        batch = load_stations([i for i in by_id if not np.isnan(z0_by_station[i])],
+                              args.harcon_dir)
+        no_z0 += [i for i in by_id if np.isnan(z0_by_station[i])]
+        if not batch.station_ids:
+            continue
+        z0 = np.array([z0_by_station[i] for i in batch.station_ids])
+        folder_path = os.path.join(args.output_dir, region)
+        os.makedirs(folder_path, exist_ok=True)
+        for year in range(args.start_year, args.end_year + 1):
+            times, heights = predict(batch, f"{year}-01-01", f"{year + 1}-01-01", z0=z0)
+            for row, stn_id in enumerate(batch.station_ids):
+                path = os.path.join(folder_path,
+                                    station_filename(by_id[stn_id], year, args.datum))
+                with open(path, "w") as f:
+                    f.write(format_csv(times, heights[row]))
+        print(f"{region}: {len(batch.station_ids)} stations")
+    if no_z0:
+        print(f"{len(no_z0)} stations have no {args.datum} z0 and were skipped: "
+              f"{' '.join(no_z0[:20])}")
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+import harmonic
+from noaa_scrape.noaa_scrape.shards import latest_body
+from noaa_scrape.noaa_scrape.station_catalog import CATALOG_PATH, region_station_lists
+
+"""
+High/low tide tables computed locally instead of with `&interval=hilo`
+requests.
+
+Extrema are found in dense (6-minute) harmonic predictions for many stations
+at once by looking for sign changes in the first difference, then refined by
+fitting a parabola through each extremum and its two neighbours. Subordinate
+stations are derived from their reference station's extrema using the
+published offsets (`tidepredoffsets.json`, archived by the `tidepredoffsets`
+spider):
+
+    time   = reference time + timeOffsetHighTide / timeOffsetLowTide (minutes)
+    height = reference height * offset    when heightAdjustedType == "R"
+    height = reference height + offset    otherwise
+
+All subordinates sharing a set of reference stations are therefore produced
+by a single prediction and extrema pass over those references. Like
+`harmonic.py`, the command line needs the references' z0 and writes GMT
+times, in files named after the datum.
+"""
+
+# Written by the tidepredoffsets spider, which runs from noaa_scrape/
+OFFSETS_DIR = "noaa_scrape/data-tidepredoffsets"
+
+
+def find_extrema(times, heights):
+    """
+    Locate highs and lows in evenly spaced series for several stations.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Evenly spaced timestamps (datetime64[m]), shared by all stations
+    heights : numpy.ndarray
+        Heights of shape (stations, times)
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Station row, refined time (datetime64[s]), refined height and a
+        boolean that is True for a high tide, one entry per extremum, sorted
+        by station row then time
+    """
+    heights = np.atleast_2d(heights)
+    step = (times[1] - times[0]).astype("timedelta64[s]").astype(float)
+    diff = np.diff(heights, axis=1)
+    # A strict change on the left and a non-strict one on the right picks
+    # the first sample of a flat top or bottom.
+    highs = (diff[:, :-1] > 0) & (diff[:, 1:] <= 0)
+    lows = (diff[:, :-1] < 0) & (diff[:, 1:] >= 0)
+    rows, cols = np.nonzero(highs | lows)
+    cols = cols + 1
+    is_high = highs[rows, cols - 1]
+
+    left = heights[rows, cols - 1]
+    center = heights[rows, cols]
+    right = heights[rows, cols + 1]
+    curvature = left - 2 * center + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(curvature != 0, 0.5 * (left - right) / curvature, 0.0)
+    offset = np.clip(offset, -0.5, 0.5)
+    refined_heights = center - 0.25 * (left - right) * offset
+    seconds = np.round((cols + offset) * step).astype("timedelta64[s]")
+    refined_times = times[0].astype("datetime64[s]") + seconds
+    return rows, refined_times, refined_heights, is_high
+
+
+def load_offsets(station_ids, offsets_dir=OFFSETS_DIR):
+    """
+    Read the archived `tidepredoffsets.json` responses of subordinate
+    stations: the latest one in each station's shard or, from crawls before
+    the shards, its `{station_id}.json` file.
+
+    Parameters
+    ----------
+    station_ids : list[str]
+        NOAA subordinate station IDs
+    offsets_dir : str, optional
+        Directory written by the `tidepredoffsets` spider
+
+    Returns
+    -------
+    dict[str, dict]
+        Station ID mapped to its offsets; stations without a response, or
+        whose response is an API error, are left out
+
+    Raises
+    ------
+    FileNotFoundError
+        When `offsets_dir` does not exist
+    """
+    if not os.path.isdir(offsets_dir):
+        raise FileNotFoundError(f"no tide prediction offsets in {offsets_dir}: crawl them with "
+                                f"the tidepredoffsets spider or pass --offsets-dir")
+    offsets = {}
+    for stn_id in station_ids:
+        body = latest_body(offsets_dir, stn_id)
+        if body is None:
+            path = os.path.join(offsets_dir, f"{stn_id}.json")
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as f:
+                body = f.read()
+        data = json.loads(body)
+        if "refStationId" in data:
+            offsets[str(stn_id)] = data
+    return offsets
+
+
+def apply_offsets(station_ids, offsets, ref_rows, rows, times, heights, is_high):
+    """
+    Derive subordinate-station extrema from their references' extrema.
+
+    Parameters
+    ----------
+    station_ids : list[str]
+        Subordinate station IDs
+    offsets : dict[str, dict]
+        Output of `load_offsets`, covering every ID in `station_ids`
+    ref_rows : dict[str, int]
+        Reference station ID mapped to its row in the extrema arrays
+    rows, times, heights, is_high : numpy.ndarray
+        Output of `find_extrema` over the reference stations
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Index into `station_ids`, time, height and high flag for every
+        subordinate extremum, grouped by subordinate station
+
+    Raises
+    ------
+    KeyError
+        When a subordinate's reference station is not in `ref_rows`
+    """
+    sub_offsets = [offsets[i] for i in station_ids]
+    ref = np.array([ref_rows[str(o["refStationId"])] for o in sub_offsets], dtype=int)
+    # Extrema are grouped by row, so each reference's events are one slice.
+    counts = np.bincount(rows, minlength=max(ref_rows.values(), default=-1) + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lengths = counts[ref]
+    owner = np.repeat(np.arange(len(station_ids)), lengths)
+    first = np.repeat(starts[ref] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    events = first + np.arange(lengths.sum())
+
+    def column(key):
+        return np.array([float(o[key]) for o in sub_offsets])
+
+    high = is_high[events]
+    minutes = np.where(high, column("timeOffsetHighTide")[owner],
+                       column("timeOffsetLowTide")[owner])
+    factor = np.where(high, column("heightOffsetHighTide")[owner],
+                      column("heightOffsetLowTide")[owner])
+    ratio = np.array([o.get("heightAdjustedType") == "R" for o in sub_offsets])[owner]
+    sub_heights = np.where(ratio, heights[events] * factor, heights[events] + factor)
+    sub_times = times[events] + np.round(minutes * 60).astype("timedelta64[s]")
+    return owner, sub_times, sub_heights, high
+
+
+def format_hilo_csv(times, heights, is_high):
+    """
+    Render one station's extrema in the layout of NOAA's hilo CSV.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Event times (datetime64)
+    heights : numpy.ndarray
+        Event heights in feet
+    is_high : numpy.ndarray
+        True for high tides
+
+    Returns
+    -------
+    str
+        CSV text with a "Date Time, Prediction, Type" header
+    """
+    minutes = (np.asarray(times).astype("datetime64[s]") + np.timedelta64(30, "s")).astype("datetime64[m]")
+    stamps = np.datetime_as_string(minutes, unit="m")
+    rows = [f"{stamp[:10]} {stamp[11:]},{height:.3f},{'H' if high else 'L'}"
+            for stamp, height, high in zip(stamps, heights, is_high)]
+    return "Date Time, Prediction, Type\n" + "\n".join(rows) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="HiLo",
+                    description="Synthesizes subordinate-station high/low tables from reference-station harmonics")
+    parser.add_argument("start_year", type=int)
+    parser.add_argument("end_year", type=int, help="inclusive")
+    parser.add_argument("--data-dir", default="data",
+                        help="directory with one stations.json per region")
+    parser.add_argument("--catalog", default=CATALOG_PATH,
+                        help="station catalog read instead of --data-dir when it has the region lists")
+    parser.add_argument("--harcon-dir", default=harmonic.HARCON_DIR)
+    parser.add_argument("--offsets-dir", default=OFFSETS_DIR)
+    parser.add_argument("--output-dir", default="data-harmonic")
+    harmonic.add_z0_arguments(parser)
+    args = parser.parse_args()
+    harmonic.check_z0_arguments(parser, args)
+    no_z0 = []
+    # Pad the window so offsets near the year boundaries still see their
+    # reference extremum.
+    begin = np.datetime64(f"{args.start_year}-01-01") - np.timedelta64(1, "D")
+    end = np.datetime64(f"{args.end_year + 1}-01-01") + np.timedelta64(1, "D")
+    for region, region_stns in region_station_lists(args.data_dir, args.catalog).items():
+        stns = [i for i in region_stns if i["stationType"] == "S"]
+        by_id = {str(i["stationId"]): i for i in stns}
+        offsets = load_offsets(list(by_id), args.offsets_dir)
+        ref_ids = sorted({str(o["refStationId"]) for o in offsets.values()})
+        z0_by_station = dict(zip(ref_ids, harmonic.load_z0(ref_ids, args.z0, args.datum,
+                                                           args.datums)))
+        no_z0 += [i for i in ref_ids if np.isnan(z0_by_station[i])]
+        refs = harmonic.load_stations([i for i in ref_ids if not np.isnan(z0_by_station[i])],
+                                      args.harcon_dir)
+        ref_rows = {stn_id: row for row, stn_id in enumerate(refs.station_ids)}
+        sub_ids = [i for i in offsets if str(offsets[i]["refStationId"]) in ref_rows]
+        if not sub_ids:
+            continue
+        z0 = np.array([z0_by_station[i] for i in refs.station_ids])
+        times, heights = harmonic.predict(refs, begin, end, z0=z0)
+        owner, sub_times, sub_heights, high = apply_offsets(
+            sub_ids, offsets, ref_rows, *find_extrema(times, heights))
+        years = sub_times.astype("datetime64[Y]").astype(int) + 1970
+        folder_path = os.path.join(args.output_dir, region)
+        os.makedirs(folder_path, exist_ok=True)
+        for index, stn_id in enumerate(sub_ids):
+            for year in range(args.start_year, args.end_year + 1):
+                mask = (owner == index) & (years == year)
+                order = np.argsort(sub_times[mask], kind="stable")
+                path = os.path.join(folder_path, harmonic.station_filename(
+                    by_id[stn_id], year, args.datum, "HiLo"))
+                with open(path, "w") as f:
+                    f.write(format_hilo_csv(sub_times[mask][order], sub_heights[mask][order],
+                                            high[mask][order]))
+        print(f"{region}: {len(sub_ids)} subordinate stations from {len(refs.station_ids)} references")
+    if no_z0:
+        print(f"{len(no_z0)} reference stations have no {args.datum} z0, so their subordinates "
+              f"were skipped: {' '.join(no_z0[:20])}")
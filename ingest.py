@@ -0,0 +1,38 @@
+import argparse
+import os
+import time
+
+from noaa_scrape.noaa_scrape.ingest import ingest_directory
+
+"""
+Parse a spider's output directory into typed arrays, one file per station.
+
+    python ingest.py noaa_scrape/data-watertemp --output arrays-watertemp
+
+writes `arrays-watertemp/<station_id>.rec`, sorted by time with repeated
+times keeping the response written last. Read one back with
+`noaa_scrape.noaa_scrape.ingest.read_records(path)` or map it with
+`numpy.memmap(path, dtype=RECORD)`.
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Ingest",
+                    description="Parses stored datagetter responses into typed NumPy arrays")
+    parser.add_argument("directory", help="spider output directory, e.g. noaa_scrape/data-watertemp")
+    parser.add_argument("--output", help="defaults to arrays-<spider> next to the directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        name = os.path.basename(os.path.normpath(args.directory))
+        output = os.path.join(os.path.dirname(os.path.normpath(args.directory)),
+                              name.replace("data", "arrays", 1))
+    started = time.monotonic()
+    stations = rows = 0
+    for station_id, count in ingest_directory(args.directory, output, args.workers):
+        stations += 1
+        rows += count
+    print(f"Wrote {rows} rows for {stations} stations to {output} "
+          f"in {time.monotonic() - started:.1f} s")
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+"""
+Persistent index of fetched files.
+
+Every saved file gets one row keyed by (station, year, product, datum,
+interval) with its path, byte size, row count and SHA-256 content hash.
+Planning a crawl is one indexed query per product/datum instead of a
+directory glob per station-year, and a file whose size on disk no longer
+matches its row (e.g. truncated mid-write) is reported as missing.
+"""
+
+MANIFEST_PATH = "manifest.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetches (
+    station TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    product TEXT NOT NULL,
+    datum TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (station, year, product, datum, interval)
+)
+"""
+
+
+def count_rows(text):
+    """Number of data rows in CSV text, excluding the header."""
+    lines = text.count("\n") + (0 if text.endswith("\n") or not text else 1)
+    return max(lines - 1, 0)
+
+
+class Manifest:
+    """SQLite-backed index of fetched files, safe to share between threads."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            SQLite database file, created if missing
+        """
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, station, year, product, datum, interval, path):
+        """
+        Add or replace the entry for a file that has just been written.
+
+        Size and hash are those of the file's bytes on disk, so they match
+        `os.path.getsize` whatever newlines it was written with.
+
+        Parameters
+        ----------
+        station : str
+            NOAA station ID
+        year : int
+            The 4-digit year
+        product, datum, interval : str
+            API parameters of the fetch
+        path : str
+            Where the file was written
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        row = (str(station), int(year), product, datum, interval, path, len(data),
+               count_rows(data.decode()), hashlib.sha256(data).hexdigest(), time.time())
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fetches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self.conn.commit()
+
+    def completed(self, product, datum):
+        """
+        Keys of every intact file for a product and datum.
+
+        Parameters
+        ----------
+        product, datum : str
+            API parameters of the fetch
+
+        Returns
+        -------
+        set[tuple[str, int, str]]
+            (station, year, interval) for each entry whose file still exists
+            with the recorded size
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT station, year, interval, path, size FROM fetches "
+                "WHERE product = ? AND datum = ?", (product, datum)).fetchall()
+        done = set()
+        for station, year, interval, path, size in rows:
+            try:
+                intact = os.path.getsize(path) == size
+            except OSError:
+                intact = False
+            if intact:
+                done.add((station, year, interval))
+        return done
+
+    def entries(self, product=None, datum=None):
+        """
+        All manifest rows, optionally filtered.
+
+        Returns
+        -------
+        list[dict]
+            One dict per row, keyed by column name
+        """
+        query = "SELECT * FROM fetches"
+        clauses, params = [], []
+        if product is not None:
+            clauses.append("product = ?")
+            params.append(product)
+        if datum is not None:
+            clauses.append("datum = ?")
+            params.append(datum)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def rebuild(manifest, data_dir="data", product="predictions", datum="MLLW"):
+    """
+    Index files saved before the manifest existed.
+
+    Station IDs and years are parsed from `scrape.py` filenames
+    ("{year} {name} {id} Tidal Data.csv"), and the interval from the
+    station's type in its region's stations.json.
+
+    Parameters
+    ----------
+    manifest : Manifest
+        Manifest to add entries to
+    data_dir : str, optional
+        Directory with one folder per region
+    product, datum : str, optional
+        API parameters the files were fetched with
+
+    Returns
+    -------
+    int
+        Number of files indexed
+    """
+    indexed = 0
+    for region in os.listdir(data_dir):
+        region_path = os.path.join(data_dir, region)
+        stations_file = os.path.join(region_path, "stations.json")
+        if not os.path.exists(stations_file):
+            continue
+        with open(stations_file, "r") as f:
+            types = {str(i["stationId"]): i["stationType"] for i in json.load(f)}
+        for filename in os.listdir(region_path):
+            parts = filename.split(" ")
+            if not filename.endswith(" Tidal Data.csv") or len(parts) < 5:
+                continue
+            station, year = parts[-3], parts[0]
+            if station not in types or not year.isdigit():
+                continue
+            path = os.path.join(region_path, filename)
+            interval = "hilo" if types[station] == "S" else "6"
+            manifest.record(station, int(year), product, datum, interval, path)
+            indexed += 1
+    return indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Manifest",
+                    description="Indexes already downloaded tide prediction files")
+    parser.add_argument("directory", nargs="?", default="data")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    args = parser.parse_args()
+    manifest = Manifest(args.manifest)
+    print(f"Indexed {rebuild(manifest, args.directory)} files")
+    manifest.close()
@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark import FIRST_YEAR, REPO_DIR, synthetic_archive
+from noaa_scrape.noaa_scrape import profiling
+
+"""
+Micro-benchmarks of the local data-processing paths, with a history of
+results and regression flags.
+
+`benchmark.synthetic_archive` writes an archive of regions x stations x
+years prediction files (no server needed, and reused between runs of the
+same size), and each benchmark times one in-process pass over it:
+
+* `read_csv`: `consolidate_tide_predictions.read_prediction_csv` of every file
+* `parse`: `ingest.parse_response` of every file (already in memory)
+* `validate_scan`: `validate.plan_checks`, the directory scan
+* `validate_check`: `validate.check_file` of every file
+* `manifest_scan`: `manifest.rebuild`, the scan behind `scrape.skip`
+* `skip`: `scrape.skip` of every station-year against the manifest
+* `spider_stations`: a spider's `parse_stations` of a station list as long
+  as the archive's
+
+Each benchmark runs `--repeat` times; its median is appended to
+`microbench-history.json` and compared with the median of the last
+`--baseline` runs of the same archive size. Anything slower than that by
+more than `--threshold` is flagged as a regression:
+
+    python microbench.py --stations-per-region 20 --years 2
+    python microbench.py read_csv parse --repeat 9 --fail-on-regression
+
+`--profile` adds the per-stage summary of `profiling.py`; profiled runs are
+compared but not added to the history.
+"""
+
+HISTORY_PATH = "microbench-history.json"
+WORK_DIR = "microbench-work"
+THRESHOLD = 0.2
+BASELINE_RUNS = 5
+
+
+def archive_files(data_dir):
+    """(path, year, interval, station ID) of every prediction file, sorted."""
+    import validate
+
+    checks, tasks, _ = validate.plan_checks(data_dir, range(FIRST_YEAR, FIRST_YEAR + 100))
+    return sorted((path, year, interval, tasks[path]["stationId"])
+                  for path, year, interval in checks)
+
+
+# Each benchmark prepares its inputs and returns (run, units, unit); only
+# `run()` is timed
+
+def bench_read_csv(data_dir, work_dir):
+    import consolidate_tide_predictions as consolidate
+
+    files = archive_files(data_dir)
+
+    def run():
+        for path, _, _, station_id in files:
+            consolidate.read_prediction_csv(path, station_id)
+
+    return run, len(files), "files"
+
+
+def bench_parse(data_dir, work_dir):
+    from noaa_scrape.noaa_scrape.ingest import parse_response
+
+    bodies = []
+    for path, _, _, _ in archive_files(data_dir):
+        with open(path, "rb") as f:
+            bodies.append(f.read())
+
+    def run():
+        for body in bodies:
+            parse_response(body)
+
+    return run, len(bodies), "files"
+
+
+def bench_validate_scan(data_dir, work_dir):
+    import validate
+
+    years = range(FIRST_YEAR, FIRST_YEAR + 100)
+    return (lambda: validate.plan_checks(data_dir, years)), len(archive_files(data_dir)), "files"
+
+
+def bench_validate_check(data_dir, work_dir):
+    import validate
+
+    files = archive_files(data_dir)
+
+    def run():
+        for path, year, interval, _ in files:
+            validate.check_file(path, year, interval)
+
+    return run, len(files), "files"
+
+
+def bench_manifest_scan(data_dir, work_dir):
+    from manifest import Manifest, rebuild
+
+    path = os.path.join(work_dir, "manifest-scan.sqlite")
+
+    def run():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        manifest = Manifest(path)
+        rebuild(manifest, data_dir)
+        manifest.close()
+
+    return run, len(archive_files(data_dir)), "files"
+
+
+def bench_skip(data_dir, work_dir):
+    from manifest import Manifest, rebuild
+    import scrape
+
+    path = os.path.join(work_dir, "manifest-skip.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    manifest = Manifest(path)
+    rebuild(manifest, data_dir)
+    done = manifest.completed(scrape.PRODUCT, scrape.DATUM)
+    manifest.close()
+    stations = list(scrape.load_region_stations(data_dir).values())
+    years = range(FIRST_YEAR, FIRST_YEAR + 5)
+
+    def run():
+        for stn in stations:
+            for year in years:
+                scrape.skip(stn, year, done)
+
+    return run, len(stations) * len(years), "station-years"
+
+
+def bench_spider_stations(data_dir, work_dir):
+    from scrapy.http import TextResponse
+
+    import fake_api
+    from noaa_scrape.noaa_scrape.spiders.water_levels_spiders import HarmonicConstituentsSpider
+    import scrape
+
+    count = len(scrape.load_region_stations(data_dir))
+    config = fake_api.Config(stations=count)
+    body = json.dumps(fake_api.station_list(config, {"expand": "details"})).encode()
+    os.chdir(work_dir)
+    spider = HarmonicConstituentsSpider()
+    response = TextResponse(spider.stations_url, body=body, encoding="utf-8")
+    return (lambda: list(spider.parse_stations(response))), count, "stations"
+
+
+BENCHMARKS = {
+    "read_csv": bench_read_csv,
+    "parse": bench_parse,
+    "validate_scan": bench_validate_scan,
+    "validate_check": bench_validate_check,
+    "manifest_scan": bench_manifest_scan,
+    "skip": bench_skip,
+    "spider_stations": bench_spider_stations,
+}
+
+
+def run_benchmark(name, data_dir, work_dir, repeat):
+    """
+    Time one benchmark.
+
+    Returns
+    -------
+    dict
+        "median_s", "min_s", "units", "unit" and "units_per_s"
+    """
+    cwd = os.getcwd()
+    try:
+        run, units, unit = BENCHMARKS[name](data_dir, work_dir)
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+    finally:
+        os.chdir(cwd)
+    median = statistics.median(times)
+    return dict(median_s=round(median, 6), min_s=round(min(times), 6), units=units, unit=unit,
+                units_per_s=round(units / median, 1) if median > 0 else None)
+
+
+def load_history(path=HISTORY_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_history(history, path=HISTORY_PATH):
+    with open(path + ".part", "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(path + ".part", path)
+
+
+def compare(results, history, size, baseline_runs=BASELINE_RUNS, threshold=THRESHOLD):
+    """
+    Compare results with earlier runs of the same archive size.
+
+    Parameters
+    ----------
+    results : dict[str, dict]
+        Output of `run_benchmark` by benchmark name
+    history : list[dict]
+        Earlier runs, oldest first
+    size : dict
+        Archive size the results were measured at
+    baseline_runs : int, optional
+        How many of the latest matching runs the baseline is the median of
+    threshold : float, optional
+        Fraction the median may exceed the baseline by before it is flagged
+
+    Returns
+    -------
+    dict[str, dict]
+        Per benchmark: "baseline_s" (None without earlier runs), "change"
+        (fraction, None without a baseline) and "regression" (bool)
+    """
+    comparison = {}
+    for name, result in results.items():
+        earlier = [run["results"][name]["median_s"] for run in history
+                   if run.get("size") == size and name in run.get("results", {})]
+        earlier = earlier[-baseline_runs:]
+        baseline = statistics.median(earlier) if earlier else None
+        change = result["median_s"] / baseline - 1 if baseline else None
+        comparison[name] = dict(baseline_s=baseline, change=change,
+                                regression=change is not None and change > threshold)
+    return comparison
+
+
+def git_commit():
+    """Short hash of the checked out commit, or None outside a git checkout."""
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def format_table(results, comparison):
+    columns = ["name", "median_s", "min_s", "units", "unit", "units_per_s", "baseline_s",
+               "change", ""]
+    rows = []
+    for name, result in results.items():
+        compared = comparison[name]
+        change = compared["change"]
+        rows.append([name, f"{result['median_s']:.4f}", f"{result['min_s']:.4f}",
+                     str(result["units"]), result["unit"], str(result["units_per_s"]),
+                     f"{compared['baseline_s']:.4f}" if compared["baseline_s"] else "-",
+                     f"{change:+.1%}" if change is not None else "-",
+                     "REGRESSION" if compared["regression"] else ""])
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in rows]
+    return "\n".join(lines)
+
+
+def main(options):
+    names = options.benchmarks or list(BENCHMARKS)
+    size = dict(regions=options.regions, stations_per_region=options.stations_per_region,
+                years=options.years)
+    work_dir = os.path.abspath(options.work_dir)
+    archive = os.path.join(work_dir, "archive-{regions}x{stations_per_region}x{years}".format(**size))
+    data_dir = os.path.join(archive, "data")
+    if not os.path.isdir(data_dir):
+        started = time.monotonic()
+        written = synthetic_archive(archive + ".part", **size)
+        os.replace(archive + ".part", archive)
+        print(f"Wrote a synthetic archive of {written} files in {time.monotonic() - started:.1f} s")
+    results = {}
+    for name in names:
+        results[name] = run_benchmark(name, data_dir, work_dir, options.repeat)
+        print(f"{name}: {results[name]['median_s']:.4f} s")
+    history = load_history(options.history)
+    comparison = compare(results, history, size, options.baseline, options.threshold)
+    # Profiling slows everything down, so those runs are not kept as baselines
+    if not profiling.get_profiler().enabled:
+        history.append({"time": time.time(), "commit": git_commit(),
+                        "python": platform.python_version(), "size": size,
+                        "repeat": options.repeat, "results": results})
+        save_history(history, options.history)
+    print(format_table(results, comparison))
+    regressions = [name for name, compared in comparison.items() if compared["regression"]]
+    if regressions:
+        print(f"Slower than the last {options.baseline} runs by more than "
+              f"{options.threshold:.0%}: {', '.join(regressions)}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Microbenchmark",
+                    description="Times the local data-processing paths over a synthetic archive and tracks regressions")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run, by default all of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--regions", type=int, default=2)
+    parser.add_argument("--stations-per-region", type=int, default=8)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--baseline", type=int, default=BASELINE_RUNS,
+                        help="number of earlier runs the baseline is the median of")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown over the baseline flagged as a regression, e.g. 0.2")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--work-dir", default=WORK_DIR,
+                        help="where synthetic archives are written and reused")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 when anything regressed")
+    parser.add_argument("--profile", nargs="?", const="time", metavar="MODES",
+                        help="also print the per-stage profile, see profiling.py")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if args.profile:
+        profiling.enable(args.profile)
+    regressions = main(args)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,100 @@
+# Define here the extensions for your spiders
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from .metrics import Metrics, Reporter, serve_prometheus
+
+
+class NoaaMetricsExtension:
+    """
+    Crawl metrics for the spiders, see `metrics.py`.
+
+    Records per-endpoint latency (Scrapy's download_latency), bytes, status
+    codes and retries of every download, including those the retry middleware
+    swallows, counts cache hits from the response cache middleware, and
+    takes queue depth from the scheduler stats. Every METRICS_INTERVAL
+    seconds it writes METRICS_JSON and prints a progress line; with
+    METRICS_PORT set it also serves Prometheus metrics on /metrics. Summary
+    values are copied into the Scrapy stats when the spider closes.
+    """
+
+    def __init__(self, crawler, json_path, interval, port, progress):
+        self.crawler = crawler
+        self.json_path = json_path
+        self.interval = interval
+        self.port = port
+        self.progress = progress
+        self.metrics = Metrics()
+        self.reporter = None
+        self.server = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED", True):
+            raise NotConfigured
+        ext = cls(crawler, settings.get("METRICS_JSON", "metrics-{spider}.json"),
+                  settings.getfloat("METRICS_INTERVAL", 10.0), settings.getint("METRICS_PORT", 0),
+                  settings.getbool("METRICS_PROGRESS", True))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        self.reporter = Reporter(self.metrics, self.json_path.format(spider=spider.name),
+                                 self.progress)
+        if self.port:
+            self.server = serve_prometheus(self.metrics, self.port)
+        self.task = task.LoopingCall(self.tick)
+        self.task.start(self.interval, now=False)
+
+    def response_downloaded(self, response, request, spider):
+        self.metrics.observe(request.url, response.status,
+                             request.meta.get("download_latency"), len(response.body))
+        if request.meta.get("retry_times"):
+            self.metrics.retried(request.url)
+
+    def response_received(self, response, request, spider):
+        if "cached" in response.flags:
+            self.metrics.cache_hit(request.url)
+
+    def item_scraped(self, item, spider):
+        self.metrics.task_done()
+
+    def update_queue(self):
+        stats = self.crawler.stats
+        pending = (stats.get_value("scheduler/enqueued", 0)
+                   - stats.get_value("scheduler/dequeued", 0))
+        engine = self.crawler.engine
+        downloader = getattr(engine, "downloader", None)
+        in_flight = len(getattr(downloader, "active", ()))
+        self.metrics.set_queue(pending, in_flight)
+
+    def tick(self):
+        self.update_queue()
+        self.reporter.tick()
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.update_queue()
+        self.reporter.close()
+        if self.server is not None:
+            self.server.shutdown()
+        snapshot = self.metrics.snapshot()
+        stats = self.crawler.stats
+        stats.set_value("metrics/latency_p50", snapshot["latency_p50"])
+        stats.set_value("metrics/latency_p99", snapshot["latency_p99"])
+        stats.set_value("metrics/tasks_per_s", snapshot["tasks"]["per_s"])
+        for name, endpoint in snapshot["endpoints"].items():
+            stats.set_value(f"metrics/{name}/requests", endpoint["requests"])
+            stats.set_value(f"metrics/{name}/retries", endpoint["retries"])
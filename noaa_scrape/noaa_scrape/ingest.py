@@ -0,0 +1,495 @@
+import json
+import os
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from .shards import SHARD_SUFFIX, iter_records
+
+"""
+Parse datagetter responses straight into typed NumPy arrays.
+
+`json.loads` on a month of 6-minute data builds ~7,000 dicts of strings
+that then have to be converted again. This module instead scans the raw
+bytes with vectorized NumPy: it finds the field keys and the quotes around
+their values, reads the fixed-width "YYYY-MM-DD HH:MM" timestamps as digits
+and does the same for the numeric values. Nothing per row runs in Python.
+Anything unexpected (escaped quotes, exponents, ragged flags) falls back to
+`json.loads` or `pandas.read_csv` for that response only.
+
+A parsed series is three arrays:
+
+* time: int32 minutes since 1970-01-01, in the time zone of the request
+  (the spiders ask for GMT)
+* value: float32, NaN where NOAA left the value empty
+* flags: uint8 with bit i set when the i-th quality flag is 1, in NOAA's
+  order (e.g. O, F, R, L for water levels; X, N, R for temperatures)
+
+Station series are stored as flat files of `RECORD`s, `<station_id>.rec`,
+readable with `numpy.fromfile` or `numpy.memmap`. Monthly mean responses
+have many values per row and go to `<station_id>.monthly.npz` instead.
+"""
+
+RECORD = np.dtype([("time", "<i4"), ("value", "<f4"), ("flags", "u1")])
+RECORD_SUFFIX = ".rec"
+# CSV columns after the value that are not quality flags
+CSV_NON_FLAGS = ("Sigma", "Quality", "Type")
+
+
+class Series(NamedTuple):
+    time: np.ndarray
+    value: np.ndarray
+    flags: np.ndarray
+
+
+class Table(NamedTuple):
+    time: np.ndarray
+    columns: dict
+
+
+def epoch_minutes(year, month, day, hour=0, minute=0):
+    """int32 minutes since 1970-01-01 from integer date and time arrays."""
+    months = (np.asarray(year, dtype=np.int64) - 1970) * 12 + np.asarray(month) - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    return ((days + np.asarray(day) - 1) * 1440 + np.asarray(hour) * 60
+            + np.asarray(minute)).astype(np.int32)
+
+
+def _find(buf, char):
+    """Offsets of every occurrence of a one-byte `char` in `buf`."""
+    return np.flatnonzero(buf == ord(char))
+
+
+def _column(buf, begin, end, offset):
+    """Byte `offset` of each string buf[begin:end], and whether it exists."""
+    index = begin + offset
+    return buf[np.minimum(index, len(buf) - 1)], index < end
+
+
+def parse_times(buf, begin, end):
+    """
+    Epoch minutes of the "YYYY-MM-DD HH:MM" strings buf[begin:end].
+
+    Returns None when the strings are not in that format.
+    """
+    if not len(begin):
+        return np.array([], dtype=np.int32)
+    if ((end - begin) != 16).any():
+        return None
+    fields = []
+    for offset, width in ((0, 4), (5, 2), (8, 2), (11, 2), (14, 2)):
+        number = np.zeros(len(begin), dtype=np.int32)
+        for i in range(offset, offset + width):
+            digit = buf[begin + i].astype(np.int32) - ord("0")
+            if ((digit < 0) | (digit > 9)).any():
+                return None
+            number = number * 10 + digit
+        fields.append(number)
+    return epoch_minutes(*fields)
+
+
+def parse_numbers(buf, begin, end):
+    """
+    float32 values of the plain decimal strings buf[begin:end], e.g. "-1.234".
+
+    Spaces are ignored and blank strings become NaN. Returns None when a
+    string holds anything else (exponents, "nan", thousands separators).
+    """
+    mantissa = np.zeros(len(begin), dtype=np.int64)
+    decimals = np.zeros(len(begin), dtype=np.int64)
+    seen_digit = np.zeros(len(begin), dtype=bool)
+    after_point = np.zeros(len(begin), dtype=bool)
+    negative = np.zeros(len(begin), dtype=bool)
+    width = int((end - begin).max()) if len(begin) else 0
+    if width > 18:
+        return None
+    for offset in range(width):
+        char, inside = _column(buf, begin, end, offset)
+        digit = inside & (char >= ord("0")) & (char <= ord("9"))
+        point = inside & (char == ord("."))
+        minus = inside & (char == ord("-"))
+        if (inside & ~(digit | point | minus | (char == ord(" ")))).any():
+            return None
+        if (point & after_point).any():
+            return None
+        mantissa = np.where(digit, mantissa * 10 + char - ord("0"), mantissa)
+        decimals += digit & after_point
+        seen_digit |= digit
+        after_point |= point
+        negative |= minus
+    values = mantissa / 10.0 ** decimals
+    values[negative] *= -1
+    values[~seen_digit] = np.nan
+    return values.astype(np.float32)
+
+
+def parse_flags(buf, begin, end):
+    """
+    Bit-packed flags of the "0,1,0"-style strings buf[begin:end]; None when
+    they are not all the same width.
+    """
+    if not len(begin):
+        return np.array([], dtype=np.uint8)
+    width = end - begin
+    if (width != width[0]).any() or width[0] % 2 != 1:
+        return None
+    flags = np.zeros(len(begin), dtype=np.uint8)
+    for bit in range(min((int(width[0]) + 1) // 2, 8)):
+        flags |= (buf[begin + 2 * bit] == ord("1")).astype(np.uint8) << bit
+    return flags
+
+
+def _json_strings(buf, quotes):
+    """
+    Pair up the quotes of a JSON text without escapes.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Begin and end offsets of every string's contents, and whether each
+        string is a key (followed by a colon)
+    """
+    begin, end = quotes[0:len(quotes) - 1:2] + 1, quotes[1::2]
+    return begin, end, buf[np.minimum(end + 1, len(buf) - 1)] == ord(":")
+
+
+def _values_of(buf, strings, key):
+    """Begin and end offsets of the string value of every `"key":`."""
+    begin, end, is_key = strings
+    match = is_key[:-1] & (end[:-1] - begin[:-1] == len(key))
+    for i, char in enumerate(key):
+        match &= buf[begin[:-1] + i] == char
+    found = np.flatnonzero(match) + 1
+    return begin[found], end[found]
+
+
+def _data_start(body):
+    for key in ("data", "predictions"):
+        found = body.find(f'"{key}"'.encode())
+        if found >= 0:
+            return found, key
+    return None, None
+
+
+def parse_json(body):
+    """
+    Parse a datagetter JSON response.
+
+    Parameters
+    ----------
+    body : bytes or str
+        Response text, with the rows under "data" or "predictions"
+
+    Returns
+    -------
+    Series or None
+        The parsed series, or None for an error response or a response
+        without rows
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    start, key = _data_start(body)
+    if start is None:
+        return None
+    if body.find(b"\\", start) >= 0:
+        return _parse_json_slow(body, key)
+    buf = np.frombuffer(body, dtype=np.uint8)
+    strings = _json_strings(buf, _find(buf[start:], '"') + start)
+    time_begin, time_end = _values_of(buf, strings, b"t")
+    if not len(time_begin):
+        return None
+    value_begin, value_end = _values_of(buf, strings, b"v")
+    flag_begin, flag_end = _values_of(buf, strings, b"f")
+    if len(value_begin) != len(time_begin) or len(flag_begin) not in (0, len(time_begin)):
+        return _parse_json_slow(body, key)
+    times = parse_times(buf, time_begin, time_end)
+    values = parse_numbers(buf, value_begin, value_end)
+    flags = (np.zeros(len(time_begin), dtype=np.uint8) if not len(flag_begin)
+             else parse_flags(buf, flag_begin, flag_end))
+    if times is None or values is None or flags is None:
+        return _parse_json_slow(body, key)
+    return Series(times, values, flags)
+
+
+def _parse_json_slow(body, key):
+    rows = json.loads(body)[key]
+    if not rows:
+        return None
+    times = np.array([r["t"] for r in rows], dtype="datetime64[m]")
+    values = np.array([float(r["v"]) if r.get("v") not in (None, "") else np.nan
+                       for r in rows], dtype=np.float32)
+    flags = np.zeros(len(rows), dtype=np.uint8)
+    for i, r in enumerate(rows):
+        for bit, flag in enumerate(str(r.get("f", "")).split(",")[:8]):
+            if flag.strip() == "1":
+                flags[i] |= 1 << bit
+    minutes = (times - np.datetime64("1970-01-01T00:00", "m")).astype(np.int64)
+    return Series(minutes.astype(np.int32), values, flags)
+
+
+def parse_csv(body):
+    """
+    Parse a datagetter CSV response.
+
+    The first column is the time and the second the value; later columns
+    other than `CSV_NON_FLAGS` are packed into the flags.
+
+    Returns
+    -------
+    Series or None
+        The parsed series, or None for an error response or a response
+        without rows
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    header, _, rest = body.partition(b"\n")
+    names = [i.strip().decode() for i in header.split(b",")]
+    if len(names) < 2 or names[0] != "Date Time":
+        return None
+    rest = rest.rstrip(b"\n")
+    if not rest:
+        return None
+    buf = np.frombuffer(rest, dtype=np.uint8)
+    line_ends = np.r_[_find(buf, "\n"), len(buf)]
+    line_starts = np.r_[0, line_ends[:-1] + 1]
+    commas = _find(buf, ",")
+    if len(commas) != len(line_starts) * (len(names) - 1):
+        return _parse_csv_slow(body, names)
+    commas = commas.reshape(len(line_starts), len(names) - 1)
+    if (commas[:, -1] > line_ends).any():
+        return _parse_csv_slow(body, names)
+    field_starts = np.c_[line_starts, commas + 1]
+    field_ends = np.c_[commas, line_ends]
+    times = parse_times(buf, field_starts[:, 0], field_ends[:, 0])
+    values = parse_numbers(buf, field_starts[:, 1], field_ends[:, 1])
+    flags = np.zeros(len(line_starts), dtype=np.uint8)
+    flag_columns = [i for i, name in enumerate(names) if i > 1 and name not in CSV_NON_FLAGS]
+    for bit, column in enumerate(flag_columns[:8]):
+        flag = parse_numbers(buf, field_starts[:, column], field_ends[:, column])
+        if flag is None:
+            return _parse_csv_slow(body, names)
+        flags |= (flag == 1).astype(np.uint8) << bit
+    if times is None or values is None:
+        return _parse_csv_slow(body, names)
+    return Series(times, values, flags)
+
+
+def _parse_csv_slow(body, names):
+    import io
+
+    import pandas as pd
+
+    data = pd.read_csv(io.BytesIO(body), skipinitialspace=True, header=0, names=names)
+    times = pd.to_datetime(data["Date Time"]).to_numpy().astype("datetime64[m]")
+    minutes = (times - np.datetime64("1970-01-01T00:00", "m")).astype(np.int64)
+    values = pd.to_numeric(data[names[1]], errors="coerce").to_numpy(dtype=np.float32)
+    flags = np.zeros(len(data), dtype=np.uint8)
+    flag_columns = [name for i, name in enumerate(names) if i > 1 and name not in CSV_NON_FLAGS]
+    for bit, name in enumerate(flag_columns[:8]):
+        flags |= (pd.to_numeric(data[name], errors="coerce").to_numpy() == 1).astype(np.uint8) << bit
+    return Series(minutes.astype(np.int32), values, flags)
+
+
+def parse_response(body):
+    """
+    Parse a datagetter response in either format, see `parse_json` and
+    `parse_csv`.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    if body.lstrip()[:1] == b"{":
+        return parse_json(body)
+    return parse_csv(body)
+
+
+def parse_monthly_mean(body):
+    """
+    Parse a monthly_mean JSON response into one float32 column per field.
+
+    Returns
+    -------
+    Table or None
+        Month start times (epoch minutes) and a dict of columns, e.g.
+        "MSL", "MHHW", "highest"; None for an error response
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    start, key = _data_start(body)
+    if start is None:
+        return None
+    rows = json.loads(body)[key]
+    if not rows:
+        return None
+    buf = np.frombuffer(body, dtype=np.uint8)
+    strings = _json_strings(buf, _find(buf[start:], '"') + start)
+    columns = {}
+    for name in rows[0]:
+        begin, end = _values_of(buf, strings, name.encode())
+        values = parse_numbers(buf, begin, end) if len(begin) == len(rows) else None
+        if values is None:
+            values = np.array([float(r.get(name) or "nan") for r in rows], dtype=np.float32)
+        columns[name] = values
+    years, months = columns.pop("year"), columns.pop("month")
+    return Table(epoch_minutes(years.astype(np.int64), months.astype(np.int64), 1), columns)
+
+
+def to_records(series):
+    """A `Series` as a `RECORD` array."""
+    records = np.empty(len(series.time), dtype=RECORD)
+    records["time"], records["value"], records["flags"] = series
+    return records
+
+
+def sort_records(records):
+    """
+    Sort `RECORD`s by time and drop repeated times, keeping the value
+    written last.
+    """
+    records = records[::-1]
+    records = records[np.argsort(records["time"], kind="stable")]
+    return records[np.r_[True, records["time"][1:] != records["time"][:-1]]]
+
+
+def read_records(path):
+    """A station's `.rec` file as a sorted, deduplicated `Series`."""
+    records = sort_records(np.fromfile(path, dtype=RECORD))
+    return Series(records["time"], records["value"], records["flags"])
+
+
+def station_sources(directory):
+    """
+    Response sources in a spider output directory, by station.
+
+    Both the shards (`<station_id>.jsonl.zst`) and loose response files from
+    before them (`{begin}-{end}-{station_id}.json` or `.csv`) are found.
+
+    Returns
+    -------
+    dict[str, list[str]]
+        Station ID mapped to its shard and file paths
+    """
+    sources = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(SHARD_SUFFIX):
+            station_id = filename[:-len(SHARD_SUFFIX)]
+        elif filename.endswith((".json", ".csv")):
+            station_id = os.path.splitext(filename)[0].split("-")[-1]
+        else:
+            continue
+        sources.setdefault(station_id, []).append(os.path.join(directory, filename))
+    return sources
+
+
+def _bodies(path):
+    if path.endswith(SHARD_SUFFIX):
+        for record in iter_records(path):
+            if record.get("status", 200) == 200:
+                yield record["body"].encode()
+    else:
+        with open(path, "rb") as f:
+            yield f.read()
+
+
+def ingest_station(station_id, paths, output_dir):
+    """
+    Parse every response of one station and write its arrays.
+
+    Responses are parsed one at a time as they are streamed from the shard,
+    so only the arrays are held in memory.
+
+    Returns
+    -------
+    tuple[str, int]
+        Station ID and the number of rows written
+    """
+    series, tables = [], []
+    for path in paths:
+        for body in _bodies(path):
+            parsed = parse_response(body)
+            if parsed is not None:
+                series.append(to_records(parsed))
+            elif b'"month"' in body[:4096]:
+                table = parse_monthly_mean(body)
+                if table is not None:
+                    tables.append(table)
+    rows = 0
+    if series:
+        records = sort_records(np.concatenate(series))
+        path = os.path.join(output_dir, station_id + RECORD_SUFFIX)
+        records.tofile(path + ".part")
+        os.replace(path + ".part", path)
+        rows += len(records)
+    if tables:
+        time = np.concatenate([t.time for t in tables])
+        columns = {name: np.concatenate([t.columns.get(name, np.full(len(t.time), np.nan,
+                                                                     dtype=np.float32))
+                                         for t in tables])
+                   for name in tables[0].columns}
+        np.savez(os.path.join(output_dir, f"{station_id}.monthly.npz"), time=time, **columns)
+        rows += len(time)
+    return station_id, rows
+
+
+def ingest_directory(directory, output_dir, workers=None):
+    """
+    Parse a whole spider output directory into arrays, one station per core.
+
+    Yields
+    ------
+    tuple[str, int]
+        Station ID and rows written, as each station finishes
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(output_dir, exist_ok=True)
+    sources = station_sources(directory)
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(ingest_station, list(sources), list(sources.values()),
+                                [output_dir] * len(sources))
+
+
+class ArrayWriter:
+    """
+    Parses responses in a process pool and appends them to per-station
+    `.rec` files.
+
+    `put` only submits the body to the pool, so the Scrapy reactor thread
+    never parses or writes. Parsed series are appended from the pool's
+    callback thread, one at a time.
+    """
+
+    def __init__(self, directory, workers=2):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"))
+        self.lock = threading.Lock()
+        self.error = None
+
+    def put(self, station_id, body):
+        """Queue a response body for parsing and appending."""
+        if self.error is not None:
+            raise self.error
+        future = self.executor.submit(parse_response, body)
+        future.add_done_callback(lambda f: self._append(str(station_id), f))
+
+    def _append(self, station_id, future):
+        try:
+            series = future.result()
+            if series is None or not len(series.time):
+                return
+            with self.lock, open(os.path.join(self.directory, station_id + RECORD_SUFFIX),
+                                 "ab") as f:
+                to_records(series).tofile(f)
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """Wait for every queued body and stop the pool."""
+        self.executor.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
@@ -6,7 +6,11 @@
 import scrapy
 
 
-class NoaaScrapeItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+class NoaaResponseItem(scrapy.Item):
+    # one raw API response; key is the file stem the response used to be
+    # saved under, e.g. "9414290" or "20240101-20240131-9414290"
+    station_id = scrapy.Field()
+    key = scrapy.Field()
+    url = scrapy.Field()
+    status = scrapy.Field()
+    body = scrapy.Field()
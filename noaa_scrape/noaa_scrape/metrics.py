@@ -0,0 +1,393 @@
+import bisect
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+"""
+Crawl metrics shared by `scrape.py` and the Scrapy project.
+
+`Metrics` collects, per endpoint (e.g. "datagetter:predictions",
+"mdapi:harcon"), a request latency histogram, bytes received and status
+code counts, plus retries, cache hits, queue depth and completed tasks.
+`Reporter.tick` writes a JSON snapshot and prints a one-line progress
+summary with an ETA; `serve_prometheus` exposes the same numbers in the
+Prometheus text format on `/metrics`.
+"""
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+# Progress samples kept for the recent-rate estimate, one per tick
+RATE_SAMPLES = 12
+
+
+def endpoint(url):
+    """
+    Short name of the API endpoint a URL belongs to.
+
+    Returns
+    -------
+    str
+        "datagetter:<product>", "mdapi:<resource>", "dpapi:<product>" or the
+        URL path for anything else
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    if path.endswith("/datagetter"):
+        return "datagetter:" + dict(parse_qsl(parts.query)).get("product", "")
+    name = path.rsplit("/", 1)[-1].split(".", 1)[0]
+    if "/mdapi/" in path:
+        if "/geogroups/" in path:
+            return "mdapi:geogroups"
+        return "mdapi:" + name
+    if "/dpapi/" in path:
+        return "dpapi:" + name
+    return path
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile, or None when empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes = 0
+        self.statuses = collections.Counter()
+        self.retries = 0
+        self.cache_hits = 0
+
+
+class Metrics:
+    """Thread-safe crawl metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = collections.defaultdict(EndpointStats)
+        self.tasks_done = 0
+        self.tasks_failed = 0
+        self.tasks_total = None
+        self.queue_pending = 0
+        self.queue_in_flight = 0
+        self.samples = collections.deque(maxlen=RATE_SAMPLES)
+
+    def observe(self, url, status, seconds, nbytes=0):
+        """
+        Record one completed request.
+
+        Parameters
+        ----------
+        url : str
+            Requested URL
+        status : int
+            HTTP status, 0 for a connection error or timeout
+        seconds : float or None
+            Time from sending the request to reading the whole body
+        nbytes : int, optional
+            Body size
+        """
+        with self.lock:
+            stats = self.endpoints[endpoint(url)]
+            if seconds is not None:
+                stats.latency.observe(seconds)
+            stats.bytes += nbytes
+            stats.statuses[int(status)] += 1
+
+    def cache_hit(self, url):
+        """Record a request answered from the response cache."""
+        with self.lock:
+            self.endpoints[endpoint(url)].cache_hits += 1
+
+    def retried(self, url, count=1):
+        """Record a request that is being sent again after a failure."""
+        with self.lock:
+            self.endpoints[endpoint(url)].retries += count
+
+    def task_done(self, ok=True):
+        """Record a finished task: a file saved, an item scraped."""
+        with self.lock:
+            if ok:
+                self.tasks_done += 1
+            else:
+                self.tasks_failed += 1
+
+    def set_queue(self, pending, in_flight=0, total=None):
+        """
+        Update the queue depth gauges.
+
+        Parameters
+        ----------
+        pending : int
+            Tasks waiting to run
+        in_flight : int, optional
+            Tasks running now
+        total : int, optional
+            All tasks of the run, for the ETA; by default done + failed +
+            pending + in flight
+        """
+        with self.lock:
+            self.queue_pending = pending
+            self.queue_in_flight = in_flight
+            self.tasks_total = total
+
+    def _totals(self):
+        requests = sum(sum(s.statuses.values()) for s in self.endpoints.values())
+        nbytes = sum(s.bytes for s in self.endpoints.values())
+        statuses = collections.Counter()
+        latency = Histogram()
+        for stats in self.endpoints.values():
+            statuses.update(stats.statuses)
+            latency.counts = [a + b for a, b in zip(latency.counts, stats.latency.counts)]
+            latency.count += stats.latency.count
+            latency.sum += stats.latency.sum
+        return requests, nbytes, statuses, latency
+
+    def sample(self, now=None):
+        """Remember the current counts, for recent rates."""
+        now = now or time.time()
+        with self.lock:
+            requests, nbytes, _, _ = self._totals()
+            self.samples.append((now, self.tasks_done + self.tasks_failed, requests, nbytes))
+
+    def rates(self):
+        """
+        Recent tasks/sec, requests/sec and bytes/sec, over the kept samples.
+
+        Returns
+        -------
+        tuple[float, float, float]
+        """
+        with self.lock:
+            if len(self.samples) < 2:
+                elapsed = time.time() - self.started
+                requests, nbytes, _, _ = self._totals()
+                tasks = self.tasks_done + self.tasks_failed
+                if elapsed <= 0:
+                    return 0.0, 0.0, 0.0
+                return tasks / elapsed, requests / elapsed, nbytes / elapsed
+            (t0, tasks0, requests0, bytes0), (t1, tasks1, requests1, bytes1) = (
+                self.samples[0], self.samples[-1])
+        elapsed = max(t1 - t0, 1e-9)
+        return ((tasks1 - tasks0) / elapsed, (requests1 - requests0) / elapsed,
+                (bytes1 - bytes0) / elapsed)
+
+    def remaining(self):
+        """Tasks still to do, or None when unknown."""
+        with self.lock:
+            if self.tasks_total is not None:
+                return max(self.tasks_total - self.tasks_done - self.tasks_failed, 0)
+            return self.queue_pending + self.queue_in_flight
+
+    def snapshot(self):
+        """
+        Everything as a JSON-serializable dict.
+
+        Returns
+        -------
+        dict
+            Totals, rates, queue gauges and one entry per endpoint with its
+            latency histogram, p50/p99, bytes, status codes, retries and
+            cache hits
+        """
+        tasks_per_s, requests_per_s, bytes_per_s = self.rates()
+        remaining = self.remaining()
+        with self.lock:
+            requests, nbytes, statuses, latency = self._totals()
+            endpoints = {
+                name: {
+                    "requests": sum(s.statuses.values()), "bytes": s.bytes,
+                    "statuses": {str(k): v for k, v in sorted(s.statuses.items())},
+                    "retries": s.retries, "cache_hits": s.cache_hits,
+                    "latency": {
+                        "buckets": dict(zip(map(str, s.latency.buckets), s.latency.counts)),
+                        "sum": s.latency.sum, "count": s.latency.count,
+                        "p50": s.latency.quantile(0.5), "p99": s.latency.quantile(0.99),
+                    },
+                }
+                for name, s in sorted(self.endpoints.items())
+            }
+            return {
+                "time": time.time(), "elapsed": time.time() - self.started,
+                "tasks": {"done": self.tasks_done, "failed": self.tasks_failed,
+                          "total": self.tasks_done + self.tasks_failed + remaining,
+                          "remaining": remaining,
+                          "per_s": tasks_per_s},
+                "queue": {"pending": self.queue_pending, "in_flight": self.queue_in_flight},
+                "requests": requests, "requests_per_s": requests_per_s,
+                "bytes": nbytes, "bytes_per_s": bytes_per_s,
+                "statuses": {str(k): v for k, v in sorted(statuses.items())},
+                "latency_p50": latency.quantile(0.5), "latency_p99": latency.quantile(0.99),
+                "endpoints": endpoints,
+            }
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE noaa_requests_total counter",
+            "# TYPE noaa_response_bytes_total counter",
+            "# TYPE noaa_retries_total counter",
+            "# TYPE noaa_cache_hits_total counter",
+            "# TYPE noaa_request_seconds histogram",
+        ]
+        for name, stats in snapshot["endpoints"].items():
+            label = f'endpoint="{name}"'
+            for status, count in stats["statuses"].items():
+                lines.append(f'noaa_requests_total{{{label},status="{status}"}} {count}')
+            lines.append(f"noaa_response_bytes_total{{{label}}} {stats['bytes']}")
+            lines.append(f"noaa_retries_total{{{label}}} {stats['retries']}")
+            lines.append(f"noaa_cache_hits_total{{{label}}} {stats['cache_hits']}")
+            cumulative = 0
+            for bound, count in stats["latency"]["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'noaa_request_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"noaa_request_seconds_sum{{{label}}} {stats['latency']['sum']}")
+            lines.append(f"noaa_request_seconds_count{{{label}}} {stats['latency']['count']}")
+        tasks, queue = snapshot["tasks"], snapshot["queue"]
+        lines += [
+            "# TYPE noaa_tasks_done_total counter",
+            f"noaa_tasks_done_total {tasks['done']}",
+            "# TYPE noaa_tasks_failed_total counter",
+            f"noaa_tasks_failed_total {tasks['failed']}",
+            "# TYPE noaa_tasks_per_second gauge",
+            f"noaa_tasks_per_second {tasks['per_s']}",
+            "# TYPE noaa_queue_pending gauge",
+            f"noaa_queue_pending {queue['pending']}",
+            "# TYPE noaa_queue_in_flight gauge",
+            f"noaa_queue_in_flight {queue['in_flight']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def progress_line(self):
+        """
+        Compact one-line summary, e.g.
+
+            1200/5000 tasks 11.8/s | 12.0 req/s 24.1 MB/s | p50 0.25s p99 2.5s | 429:3 503:1 retries 4 | queue 3790 | ETA 0:05:22
+        """
+        snapshot = self.snapshot()
+        tasks = snapshot["tasks"]
+        done = tasks["done"] + tasks["failed"]
+        line = f"{done}/{tasks['total']} tasks {tasks['per_s']:.1f}/s"
+        line += (f" | {snapshot['requests_per_s']:.1f} req/s "
+                 f"{snapshot['bytes_per_s'] / 1e6:.1f} MB/s")
+        if snapshot["latency_p50"] is not None:
+            line += f" | p50 {snapshot['latency_p50']}s p99 {snapshot['latency_p99']}s"
+        errors = [f"{status}:{count}" for status, count in snapshot["statuses"].items()
+                  if status not in ("200", "304")]
+        retries = sum(e["retries"] for e in snapshot["endpoints"].values())
+        if retries:
+            errors.append(f"retries {retries}")
+        if errors:
+            line += " | " + " ".join(errors)
+        line += f" | queue {snapshot['queue']['pending']}"
+        remaining = tasks["remaining"]
+        if remaining and tasks["per_s"] > 0:
+            eta = int(remaining / tasks["per_s"])
+            line += f" | ETA {eta // 3600}:{eta // 60 % 60:02d}:{eta % 60:02d}"
+        return line
+
+
+class Reporter:
+    """Periodic JSON snapshot and progress line for a `Metrics`."""
+
+    def __init__(self, metrics, json_path=None, progress=True, stream=None):
+        """
+        Parameters
+        ----------
+        metrics : Metrics
+            Metrics to report
+        json_path : str, optional
+            File to write snapshots to (replaced atomically on every tick)
+        progress : bool, optional
+            Whether to print the progress line on every tick
+        stream : file, optional
+            Where to print, by default stderr; on a terminal the line is
+            redrawn in place
+        """
+        self.metrics = metrics
+        self.json_path = json_path
+        self.progress = progress
+        self.stream = stream or sys.stderr
+        self.in_place = self.stream.isatty()
+
+    def tick(self):
+        """Take a rate sample, write the JSON snapshot and print progress."""
+        self.metrics.sample()
+        if self.json_path:
+            tmp_path = self.json_path + ".part"
+            with open(tmp_path, "w") as f:
+                json.dump(self.metrics.snapshot(), f, indent=1)
+            os.replace(tmp_path, self.json_path)
+        if self.progress:
+            line = self.metrics.progress_line()
+            if self.in_place:
+                self.stream.write("\r\x1b[K" + line)
+            else:
+                self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def close(self):
+        """Report one last time."""
+        self.tick()
+        if self.progress and self.in_place:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def serve_prometheus(metrics, port, host="127.0.0.1"):
+    """
+    Serve `metrics.prometheus()` on http://host:port/metrics from a daemon thread.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        The server; call `shutdown()` to stop it
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -4,10 +4,13 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.http import TextResponse
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from .response_cache import ResponseCache
+
 
 class NoaaScrapeSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +104,66 @@ class NoaaScrapeDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class NoaaResponseCacheMiddleware:
+    """
+    Serves requests from the shared on-disk response cache.
+
+    Fresh entries are returned without touching the network; stale ones are
+    revalidated with If-None-Match/If-Modified-Since, and a 304 is answered
+    from the cache. Successful responses are stored once decompressed, so
+    the middleware must sit below HttpCompressionMiddleware (590); bodies
+    that still carry a Content-Encoding are not stored.
+    """
+
+    def __init__(self, cache, stats):
+        self.cache = cache
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        cache = ResponseCache(settings.get("RESPONSE_CACHE_DIR", "../.httpcache"),
+                              settings.getint("RESPONSE_CACHE_MAX_BYTES", 20 * 1024**3))
+        s = cls(cache, crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if request.meta.get("response_cache_skip"):
+            return None
+        cached = self.cache.lookup(request.url)
+        if cached is None:
+            return None
+        if cached.fresh:
+            self.stats.inc_value("response_cache/hit")
+            return self._response(request, cached)
+        request.meta["response_cache_stale"] = cached
+        for name, value in cached.conditional_headers().items():
+            request.headers.setdefault(name, value)
+        return None
+
+    def process_response(self, request, response, spider):
+        cached = request.meta.pop("response_cache_stale", None)
+        if "cached" in response.flags:
+            return response
+        if response.status == 304 and cached is not None:
+            self.stats.inc_value("response_cache/revalidated")
+            self.cache.revalidated(request.url)
+            return self._response(request, cached)
+        self.stats.inc_value("response_cache/miss")
+        if response.headers.get("Content-Encoding"):
+            return response
+        headers = {k.decode(): response.headers.get(k).decode() for k in response.headers}
+        self.cache.store(request.url, response.status, response.body, headers)
+        return response
+
+    def _response(self, request, cached):
+        headers = {"Content-Type": cached.content_type} if cached.content_type else {}
+        return TextResponse(url=request.url, status=cached.status, body=cached.body,
+                            headers=headers, encoding="utf-8", request=request,
+                            flags=["cached"])
+
+    def spider_closed(self, spider):
+        self.cache.close()
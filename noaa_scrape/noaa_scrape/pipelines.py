@@ -6,8 +6,86 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet import threads
+
+
+from .ingest import ArrayWriter
+from .shards import ShardWriter
 
 
 class NoaaScrapePipeline:
+    """
+    Batches response items into compressed per-station shards in the
+    spider's save_dir, written from a background thread.
+
+    When the writer falls behind, the item waits for room in a worker
+    thread instead of on the reactor; Scrapy limits the items in progress,
+    so downloads slow down rather than stall.
+    """
+
+    def __init__(self, batch_size, flush_interval, level):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            batch_size=settings.getint("SHARD_BATCH_SIZE", 256),
+            flush_interval=settings.getfloat("SHARD_FLUSH_INTERVAL", 5.0),
+            level=settings.getint("SHARD_COMPRESSION_LEVEL", 10),
+        )
+
+    def open_spider(self, spider):
+        self.writer = ShardWriter(spider.save_dir, self.batch_size,
+                                  self.flush_interval, self.level)
+
+    def close_spider(self, spider):
+        self.writer.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        station_id, record = adapter["station_id"], adapter.asdict()
+        if self.writer.offer(station_id, record):
+            return item
+        deferred = threads.deferToThread(self.writer.put, station_id, record)
+        deferred.addCallback(lambda _: item)
+        return deferred
+
+
+class NoaaArrayPipeline:
+    """
+    Parses each successful response into typed arrays as it arrives and
+    appends them to `<station_id>.rec` in ARRAYS_DIR, see `ingest.py`.
+    Off unless ARRAYS_ENABLED is set.
+    """
+
+    def __init__(self, directory, workers):
+        self.directory = directory
+        self.workers = workers
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ARRAYS_ENABLED", False):
+            raise NotConfigured
+        return cls(
+            directory=settings.get("ARRAYS_DIR", "arrays-{spider}"),
+            workers=settings.getint("ARRAY_WORKERS", 2),
+        )
+
+    def open_spider(self, spider):
+        self.writer = ArrayWriter(self.directory.format(spider=spider.name), self.workers)
+
+    def close_spider(self, spider):
+        self.writer.close()
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if adapter.get("status", 200) == 200:
+            self.writer.put(adapter["station_id"], adapter["body"])
         return item
@@ -0,0 +1,275 @@
+import contextlib
+import cProfile
+import glob
+import io
+import json
+import multiprocessing.util
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+"""
+Opt-in profiling of the local data-processing stages, shared by the
+top-level scripts and the Scrapy project.
+
+Code marks a stage with
+
+    with profiling.stage("consolidate.read_csv", units=1):
+        ...
+
+which costs nothing unless profiling is on. Turn it on for any entry point
+(including `scrapy crawl` and process pool workers, which inherit the
+environment) with
+
+    NOAA_PROFILE=time python consolidate_tide_predictions.py
+    NOAA_PROFILE=all scrapy crawl harmonicconstituents
+
+or with `--profile` on `scrape.py`, `validate.py` and
+`consolidate_tide_predictions.py`. The value picks what is measured, comma
+separated:
+
+* `time` (also `1`): calls, wall and CPU seconds and units per stage
+* `cprofile`: a cProfile of each outermost stage
+* `tracemalloc`: peak Python memory allocated within each stage
+* `all`: everything
+
+Each process writes `stages-<pid>.json` (and `<stage>-<pid>.prof` files for
+cProfile) to one run directory under `profiles/` when it exits; the process
+that started profiling prints the per-stage summary of every process.
+"""
+
+PROFILE_ENV = "NOAA_PROFILE"
+PROFILE_DIR_ENV = "NOAA_PROFILE_DIR"
+PROFILE_ROOT = "profiles"
+MODES = ("time", "cprofile", "tracemalloc")
+TOP_FUNCTIONS = 15
+
+
+def parse_modes(value):
+    """
+    Modes named by a `NOAA_PROFILE` value.
+
+    Raises
+    ------
+    ValueError
+        For an unknown mode
+    """
+    modes = set()
+    for mode in filter(None, (i.strip().lower() for i in (value or "").split(","))):
+        if mode in ("0", "off", "false"):
+            continue
+        if mode in ("1", "on", "true"):
+            mode = "time"
+        if mode == "all":
+            modes.update(MODES)
+        elif mode in MODES:
+            modes.add(mode)
+        else:
+            raise ValueError(f"unknown profiling mode {mode!r}, expected one of "
+                             f"{', '.join(MODES + ('all',))}")
+    if modes:
+        modes.add("time")
+    return modes
+
+
+class StageRecord:
+    """Handle a stage yields, to add units only known once it has run."""
+    __slots__ = ("units",)
+
+    def __init__(self, units=0):
+        self.units = units
+
+
+_DISABLED = contextlib.nullcontext(StageRecord())
+
+
+class Profiler:
+    """
+    Per-stage timers, cProfile and tracemalloc capture for one process.
+
+    Attributes
+    ----------
+    stats : dict[str, dict]
+        Stage name mapped to "calls", "wall_s", "cpu_s", "units" and
+        "peak_mb" (None without tracemalloc)
+    """
+
+    def __init__(self, modes=(), directory=None, report=False):
+        self.modes = set(modes)
+        self.enabled = bool(self.modes)
+        self.directory = directory
+        self.report = report
+        self.pid = os.getpid()
+        self.stats = {}
+        self.profiles = {}
+        self.stack = []
+        self.tracing = "tracemalloc" in self.modes
+        if self.tracing and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.enabled:
+            # Finalizers also run in multiprocessing children, which skip atexit
+            multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    def stage(self, name, units=0):
+        """Context manager timing one run of stage `name`, see the module docstring."""
+        if not self.enabled:
+            return _DISABLED
+        return self._stage(name, units)
+
+    @contextlib.contextmanager
+    def _stage(self, name, units):
+        record = StageRecord(units)
+        frame = {"peak": 0, "start": 0}
+        profile = None
+        if "cprofile" in self.modes and not self.stack:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["start"] = current
+        self.stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.stack.pop()
+            entry = self.stats.setdefault(
+                name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "units": 0, "peak_mb": None})
+            entry["calls"] += 1
+            entry["wall_s"] += wall
+            entry["cpu_s"] += cpu
+            entry["units"] += record.units
+            if self.tracing:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if self.stack:
+                    self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+                entry["peak_mb"] = max(entry["peak_mb"] or 0.0, (peak - frame["start"]) / 1024**2)
+
+    def close(self):
+        """Write this process's stages and profiles, and print the run's summary."""
+        if os.getpid() != self.pid or not self.directory:
+            return
+        if self.stats:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"stages-{self.pid}.json"), "w") as f:
+                json.dump(self.stats, f, indent=1)
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.directory, f"{name}-{self.pid}.prof"))
+        if self.report and os.path.isdir(self.directory):
+            print(f"Profile of {self.directory}:", file=sys.stderr)
+            print(format_summary(load_summaries(self.directory)), file=sys.stderr)
+            if "cprofile" in self.modes:
+                for name in sorted(load_summaries(self.directory)):
+                    print(f"{name}:\n{top_functions(self.directory, name)}", file=sys.stderr)
+        self.stats, self.profiles = {}, {}
+
+
+_profiler = None
+
+
+def enable(modes="time", directory=None):
+    """
+    Turn profiling on for this process and the processes it starts.
+
+    Parameters
+    ----------
+    modes : str, optional
+        As for `NOAA_PROFILE`
+    directory : str, optional
+        Run directory; by default a new one under `PROFILE_ROOT`
+
+    Returns
+    -------
+    Profiler
+    """
+    global _profiler
+    if not parse_modes(modes):
+        return get_profiler()
+    directory = directory or os.path.join(
+        PROFILE_ROOT, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+    os.environ[PROFILE_ENV] = modes
+    os.environ[PROFILE_DIR_ENV] = os.path.abspath(directory)
+    _profiler = Profiler(parse_modes(modes), os.path.abspath(directory), report=True)
+    return _profiler
+
+
+def get_profiler():
+    """
+    This process's profiler, created from the environment on first use (and
+    again in a forked child, so it does not inherit its parent's numbers).
+    """
+    global _profiler
+    if _profiler is None or _profiler.pid != os.getpid():
+        modes = parse_modes(os.environ.get(PROFILE_ENV))
+        directory = os.environ.get(PROFILE_DIR_ENV)
+        if modes and not directory:
+            return enable(os.environ[PROFILE_ENV])
+        _profiler = Profiler(modes, directory)
+    return _profiler
+
+
+def stage(name, units=0):
+    """`Profiler.stage` of this process's profiler."""
+    return get_profiler().stage(name, units)
+
+
+def load_summaries(directory):
+    """
+    Stage statistics of every process of one run, merged by stage.
+
+    Returns
+    -------
+    dict[str, dict]
+        As `Profiler.stats`, plus "processes" per stage
+    """
+    merged = {}
+    for path in sorted(glob.glob(os.path.join(directory, "stages-*.json"))):
+        with open(path) as f:
+            stats = json.load(f)
+        for name, entry in stats.items():
+            total = merged.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "units": 0,
+                                             "peak_mb": None, "processes": 0})
+            for key in ("calls", "wall_s", "cpu_s", "units"):
+                total[key] += entry[key]
+            if entry.get("peak_mb") is not None:
+                total["peak_mb"] = max(total["peak_mb"] or 0.0, entry["peak_mb"])
+            total["processes"] += 1
+    return merged
+
+
+def format_summary(stats):
+    """Table of stage statistics, slowest stage first."""
+    columns = ["stage", "calls", "processes", "wall_s", "cpu_s", "units", "units_per_s",
+               "peak_mb"]
+    rows = []
+    for name, entry in sorted(stats.items(), key=lambda item: -item[1]["wall_s"]):
+        rate = entry["units"] / entry["wall_s"] if entry["units"] and entry["wall_s"] else None
+        values = [name, entry["calls"], entry.get("processes", 1), f"{entry['wall_s']:.3f}",
+                  f"{entry['cpu_s']:.3f}", entry["units"] or "-",
+                  f"{rate:.1f}" if rate else "-",
+                  f"{entry['peak_mb']:.1f}" if entry.get("peak_mb") is not None else "-"]
+        rows.append([str(i) for i in values])
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def top_functions(directory, name, limit=TOP_FUNCTIONS):
+    """The functions with the most cumulative time in one stage's cProfiles."""
+    paths = sorted(glob.glob(os.path.join(directory, f"{glob.escape(name)}-*.prof")))
+    if not paths:
+        return ""
+    out = io.StringIO()
+    stats = pstats.Stats(*paths, stream=out)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
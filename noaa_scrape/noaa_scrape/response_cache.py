@@ -0,0 +1,315 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+"""
+On-disk HTTP response cache shared by the Scrapy project and the plain
+`requests`/aiohttp scripts.
+
+Entries are keyed by the normalized URL (lower-case host, sorted query) and
+point at content-addressed bodies, so identical payloads (e.g. repeated API
+error messages) are stored once. Each entry keeps the response's ETag and
+Last-Modified headers: once its TTL expires it is revalidated with a
+conditional request, and a 304 refreshes it without downloading the body
+again. TTLs are per endpoint, see `TTL_RULES`. API errors, which NOAA sends
+as 200 responses, are never cached (`is_error_payload`). When the cache grows past its
+size limit, the least recently used entries are evicted.
+"""
+
+CACHE_DIR = ".httpcache"
+MAX_BYTES = 20 * 1024**3
+DAY = 24 * 3600
+
+# (URL pattern, TTL in seconds); the first match wins. None never expires.
+TTL_RULES = [
+    (re.compile(r"/mdapi/.*/stations\.json"), DAY),
+    (re.compile(r"/mdapi/.*/geogroups/"), DAY),
+    (re.compile(r"/mdapi/.*/stations/[^/]+/"), 7 * DAY),
+    (re.compile(r"/dpapi/"), 7 * DAY),
+]
+DEFAULT_TTL = 3600
+# Size checks scan the index, so only run one every this many stores
+EVICT_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_type TEXT,
+    body_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS entries_body ON entries (body_hash);
+"""
+
+
+def normalize_url(url):
+    """Canonical form of a URL: lower-case scheme and host, sorted query."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=False)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
+def ttl_for(url):
+    """
+    Seconds a cached response for `url` stays fresh.
+
+    Data requests whose end date is in the past never change, so they never
+    expire; everything else follows `TTL_RULES`.
+
+    Returns
+    -------
+    float or None
+        The TTL, or None for entries that never expire
+    """
+    parts = urlsplit(url)
+    if parts.path.endswith("/datagetter"):
+        query = dict(parse_qsl(parts.query))
+        end_date = query.get("end_date", "")
+        if len(end_date) >= 8 and end_date[:8].isdigit():
+            if end_date[:8] < date.today().strftime("%Y%m%d"):
+                return None
+        return DAY
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(parts.path):
+            return ttl
+    return DEFAULT_TTL
+
+
+def is_error_payload(body):
+    """
+    Whether a 200 response body is an API error message, either a CSV
+    "Error: ..." line or a JSON {"error": ...} object.
+    """
+    head = body[:200].lstrip()
+    if head.startswith(b"Error"):
+        return True
+    return head.startswith(b"{") and b'"error"' in head
+
+
+class CachedResponse:
+    """A cached response and whether it can be used without revalidation."""
+
+    def __init__(self, url, status, body, content_type, etag, last_modified, fresh):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def conditional_headers(self):
+        """Headers that ask the server for a 304 if this response is current."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Content-addressed, LRU size-bounded response cache on disk."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        """
+        Parameters
+        ----------
+        directory : str, optional
+            Cache directory, created if missing
+        max_bytes : int, optional
+            Total body size above which least recently used entries are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "bodies"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, "index.sqlite"),
+                                    timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.stores = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, "bodies", body_hash[:2], body_hash)
+
+    def lookup(self, url):
+        """
+        Find a cached response for a URL.
+
+        Returns
+        -------
+        CachedResponse or None
+            The cached response (fresh or stale), or None on a miss; error
+            payloads cached by older versions count as misses
+        """
+        key = normalize_url(url)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, etag, last_modified, content_type, body_hash, stored_at "
+                "FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                              (time.time(), key))
+            self.conn.commit()
+        status, etag, last_modified, content_type, body_hash, stored_at = row
+        try:
+            with open(self._body_path(body_hash), "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        if is_error_payload(body):
+            return None
+        ttl = ttl_for(url)
+        fresh = ttl is None or time.time() - stored_at < ttl
+        return CachedResponse(url, status, body, content_type, etag, last_modified, fresh)
+
+    def store(self, url, status, body, headers):
+        """
+        Save a successful response.
+
+        Parameters
+        ----------
+        url : str
+            Requested URL
+        status : int
+            HTTP status; only 200 responses that are not error payloads are
+            cached
+        body : bytes
+            Response body
+        headers : Mapping[str, str]
+            Response headers (ETag, Last-Modified and Content-Type are kept)
+        """
+        if status != 200 or is_error_payload(body):
+            return
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        headers = {k.lower(): v for k, v in headers.items()}
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), url, status, headers.get("etag"),
+                 headers.get("last-modified"), headers.get("content-type"),
+                 body_hash, len(body), now, now))
+            self.conn.commit()
+        self.stores += 1
+        if self.stores % EVICT_EVERY == 0:
+            self.evict()
+
+    def revalidated(self, url):
+        """Mark a cached response as confirmed current by a 304."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                              (now, now, normalize_url(url)))
+            self.conn.commit()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits its size limit."""
+        with self.lock:
+            (total,) = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT DISTINCT body_hash, size FROM entries)").fetchone()
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute(
+                "SELECT key, body_hash, size FROM entries ORDER BY accessed_at").fetchall()
+            for key, body_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                shared = self.conn.execute(
+                    "SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1", (body_hash,)).fetchone()
+                if shared is None:
+                    total -= size
+                    try:
+                        os.remove(self._body_path(body_hash))
+                    except OSError:
+                        pass
+            self.conn.commit()
+
+
+_default_cache = None
+
+
+def default_cache():
+    """Process-wide cache in `CACHE_DIR`, opened on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache(os.environ.get("NOAA_CACHE_DIR", CACHE_DIR))
+    return _default_cache
+
+
+def cached_get(url, cache=None, session=None, **kwargs):
+    """
+    Drop-in replacement for `requests.get` that goes through the cache.
+
+    Parameters
+    ----------
+    url : str
+        URL to fetch
+    cache : ResponseCache, optional
+        Cache to use, by default `default_cache()`
+    session : requests.Session, optional
+        Session to send requests with
+    **kwargs
+        Passed on to `requests.get`
+
+    Returns
+    -------
+    requests.Response
+        The live response, or one rebuilt from the cache on a hit or 304
+    """
+    import requests
+
+    cache = cache or default_cache()
+    cached = cache.lookup(url)
+    if cached is not None and cached.fresh:
+        return _as_requests_response(cached)
+    headers = dict(kwargs.pop("headers", None) or {})
+    if cached is not None:
+        headers.update(cached.conditional_headers())
+    response = (session or requests).get(url, headers=headers, **kwargs)
+    if response.status_code == 304 and cached is not None:
+        cache.revalidated(url)
+        return _as_requests_response(cached)
+    cache.store(url, response.status_code, response.content, response.headers)
+    return response
+
+
+def _as_requests_response(cached):
+    import requests
+
+    response = requests.models.Response()
+    response.status_code = cached.status
+    response.url = cached.url
+    response._content = cached.body
+    response.encoding = "utf-8"
+    if cached.content_type:
+        response.headers["Content-Type"] = cached.content_type
+    response.headers["X-Cache"] = "HIT"
+    return response
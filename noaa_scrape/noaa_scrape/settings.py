@@ -50,21 +50,48 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "noaa_scrape.middlewares.NoaaScrapeDownloaderMiddleware": 543,
-#}
+# The response cache sits below HttpCompressionMiddleware (590), so it stores
+# and serves decompressed bodies
+DOWNLOADER_MIDDLEWARES = {
+    "noaa_scrape.middlewares.NoaaResponseCacheMiddleware": 580,
+}
+
+# Shared with the scripts at the repository root, which use .httpcache there
+RESPONSE_CACHE_DIR = "../.httpcache"
+RESPONSE_CACHE_MAX_BYTES = 20 * 1024**3
+
+# Written by catalog.py at the repository root; while it is fresh the
+# spiders take their station lists from it instead of requesting them
+STATION_CATALOG = "../station-catalog.npz"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "noaa_scrape.extensions.NoaaMetricsExtension": 500,
+}
+
+# Crawl metrics: a JSON snapshot and a progress line every METRICS_INTERVAL
+# seconds, and Prometheus metrics on METRICS_PORT (0 disables the endpoint)
+METRICS_JSON = "metrics-{spider}.json"
+METRICS_INTERVAL = 10.0
+METRICS_PORT = 0
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "noaa_scrape.pipelines.NoaaScrapePipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "noaa_scrape.pipelines.NoaaScrapePipeline": 300,
+    "noaa_scrape.pipelines.NoaaArrayPipeline": 400,
+}
+
+# Responses are batched into zstd-compressed JSONL shards, one per station
+SHARD_BATCH_SIZE = 256
+SHARD_FLUSH_INTERVAL = 5.0
+SHARD_COMPRESSION_LEVEL = 10
+
+# Also parse responses into typed arrays in arrays-<spider>/ (see ingest.py)
+ARRAYS_ENABLED = False
+ARRAYS_DIR = "arrays-{spider}"
+ARRAY_WORKERS = 2
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -0,0 +1,237 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import zstandard
+
+"""
+Append-only, zstd-compressed JSONL shards with a sidecar offset index.
+
+Each station gets one shard, `{station_id}.jsonl.zst`, made of independent
+zstd frames; every frame holds one batch of JSON lines for that station.
+The sidecar `{station_id}.idx` has one tab-separated line per record:
+
+    key <TAB> frame offset <TAB> frame length <TAB> line number
+
+so any single record can be read back by decompressing only its frame. A
+shard is also a valid zstd stream as a whole, e.g. `zstdcat 9414290.jsonl.zst`.
+"""
+
+SHARD_SUFFIX = ".jsonl.zst"
+INDEX_SUFFIX = ".idx"
+
+
+def write_batch(directory, station_id, records, compressor):
+    """
+    Append one frame of records to a station's shard and index.
+
+    Parameters
+    ----------
+    directory : str
+        Shard directory
+    station_id : str
+        Station the records belong to
+    records : list[dict]
+        Records to write; each must have a "key"
+    compressor : zstandard.ZstdCompressor
+        Compressor to use (not shared between threads)
+    """
+    lines = "".join(json.dumps(r) + "\n" for r in records).encode()
+    frame = compressor.compress(lines)
+    shard_path = os.path.join(directory, f"{station_id}{SHARD_SUFFIX}")
+    with open(shard_path, "ab") as f:
+        offset = f.tell()
+        f.write(frame)
+    with open(os.path.join(directory, f"{station_id}{INDEX_SUFFIX}"), "a") as f:
+        for line_number, record in enumerate(records):
+            f.write(f"{record['key']}\t{offset}\t{len(frame)}\t{line_number}\n")
+
+
+def read_index(directory, station_id):
+    """
+    Load a station's sidecar index.
+
+    Returns
+    -------
+    dict[str, tuple[int, int, int]]
+        Record key mapped to (frame offset, frame length, line number); a key
+        written more than once maps to its latest record
+    """
+    index = {}
+    with open(os.path.join(directory, f"{station_id}{INDEX_SUFFIX}"), "r") as f:
+        for line in f:
+            key, offset, length, line_number = line.rstrip("\n").split("\t")
+            index[key] = (int(offset), int(length), int(line_number))
+    return index
+
+
+def read_record(directory, station_id, key, index=None):
+    """
+    Fetch one original response from a shard.
+
+    Parameters
+    ----------
+    directory : str
+        Shard directory
+    station_id : str
+        NOAA station ID
+    key : str
+        Record key, e.g. "20240101-20240131-9414290"
+    index : dict, optional
+        Output of `read_index`, to avoid reloading it for every record
+
+    Returns
+    -------
+    dict
+        The stored record, with the response text under "body"
+
+    Raises
+    ------
+    KeyError
+        When the key is not in the shard
+    """
+    if index is None:
+        index = read_index(directory, station_id)
+    offset, length, line_number = index[key]
+    with open(os.path.join(directory, f"{station_id}{SHARD_SUFFIX}"), "rb") as f:
+        f.seek(offset)
+        frame = f.read(length)
+    lines = zstandard.ZstdDecompressor().decompress(frame).splitlines()
+    return json.loads(lines[line_number])
+
+
+def iter_records(path):
+    """
+    Stream every record of a shard in write order.
+
+    Parameters
+    ----------
+    path : str
+        Path to a `.jsonl.zst` shard
+
+    Yields
+    ------
+    dict
+        Each stored record
+    """
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        buffered = b""
+        while True:
+            chunk = reader.read(1 << 20)
+            if not chunk:
+                break
+            buffered += chunk
+            *lines, buffered = buffered.split(b"\n")
+            for line in lines:
+                yield json.loads(line)
+        if buffered.strip():
+            yield json.loads(buffered)
+
+
+def latest_body(directory, station_id):
+    """
+    Text of the last successful response in a station's shard, for spiders
+    that fetch one document per station.
+
+    Returns
+    -------
+    str or None
+        The response text, or None when the station has no shard or no
+        stored response with status 200
+    """
+    path = os.path.join(directory, f"{station_id}{SHARD_SUFFIX}")
+    if not os.path.exists(path):
+        return None
+    body = None
+    for record in iter_records(path):
+        if record.get("status", 200) == 200:
+            body = record["body"]
+    return body
+
+
+class ShardWriter:
+    """
+    Background thread that batches records into station shards.
+
+    The queue is bounded. `offer` never blocks, so the Scrapy reactor thread
+    can use it and wait elsewhere when the writer falls behind; `put` blocks
+    until there is room. Records are grouped by station and flushed as one
+    frame per station every `batch_size` records or `flush_interval`
+    seconds.
+    """
+
+    def __init__(self, directory, batch_size=256, flush_interval=5.0, level=10):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self.queue = queue.Queue(maxsize=batch_size * 16)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="shard-writer", daemon=True)
+        self.thread.start()
+
+    def offer(self, station_id, record):
+        """
+        Queue a record for a station's shard if there is room.
+
+        Returns
+        -------
+        bool
+            False when the queue is full and the record was not queued
+        """
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait((str(station_id), record))
+        except queue.Full:
+            return False
+        return True
+
+    def put(self, station_id, record):
+        """Queue a record for a station's shard, waiting for room."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((str(station_id), record))
+
+    def close(self):
+        """Flush everything queued and stop the thread."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _flush(self, pending, compressor):
+        for station_id, records in pending.items():
+            write_batch(self.directory, station_id, records, compressor)
+        pending.clear()
+
+    def _run(self):
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        pending = {}
+        count = 0
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    entry = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    entry = False
+                if entry:
+                    station_id, record = entry
+                    pending.setdefault(station_id, []).append(record)
+                    count += 1
+                if (entry is None or count >= self.batch_size
+                        or time.monotonic() - last_flush >= self.flush_interval):
+                    self._flush(pending, compressor)
+                    count = 0
+                    last_flush = time.monotonic()
+                if entry is None:
+                    return
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers never block on a full queue.
+            while self.queue.get() is not None:
+                pass
@@ -1,10 +1,14 @@
 import calendar
-from datetime import date
-import itertools
+from datetime import date, datetime, timedelta
+import json
 import os
-import requests
+import time
 import scrapy
 
+from .. import profiling
+from ..items import NoaaResponseItem
+from ..station_catalog import CATALOG_MAX_AGE, get_catalog, station_list_type
+
 
 class BasicNOAASpider(scrapy.Spider):
     name  = "baseclass"
@@ -18,64 +22,145 @@ class BasicNOAASpider(scrapy.Spider):
     def save_dir(self):
         return f"data-{self.name}"
     
-    def get_stations(self):
-        response = requests.get(self.stations_url)
-        return response.json()["stations"]
-    
+    def select_stations(self, stations):
+        return stations
+
+    def get_stations(self, response):
+        return self.select_stations(response.json()["stations"])
+
+    def catalog_stations(self):
+        # This spider's station list from the station catalog while it is
+        # fresh; None when the catalog is missing, stale or lacks the list
+        path = self.settings.get("STATION_CATALOG") if hasattr(self, "settings") else None
+        catalog = get_catalog(path) if path else None
+        source = station_list_type(self.stations_url)
+        if (catalog is None or source not in catalog.source_names
+                or time.time() - catalog.built_at >= CATALOG_MAX_AGE):
+            return None
+        return self.select_stations(catalog.source_stations(source))
+
+    async def start(self):
+        # Scrapy 2.13+ entry point; older versions call start_requests
+        for request in self.start_requests():
+            yield request
+
     def start_requests(self):
-        stations = self.get_stations()
+        with profiling.stage("spider.catalog") as record:
+            stations = self.catalog_stations()
+            record.units = len(stations or [])
+        if stations is not None:
+            for station in stations:
+                yield from self.station_requests(station)
+            return
+        # Otherwise the station list goes through the downloader (and its
+        # response cache) instead of a blocking fetch on the reactor thread
+        yield scrapy.Request(url=self.stations_url, callback=self.parse_stations)
+
+    def parse_stations(self, response):
+        with profiling.stage("spider.stations") as record:
+            stations = self.get_stations(response)
+            record.units = len(stations)
         for station in stations:
-            station_id = station["id"]
-            args = dict(station_id=station_id)
-            url = self.url.format(**args)
-            yield scrapy.Request(url=url, 
-                                 callback=self.parse, cb_kwargs=args)
+            yield from self.station_requests(station)
+
+    def station_requests(self, station):
+        station_id = station["id"]
+        args = dict(station_id=station_id)
+        url = self.url.format(**args)
+        yield scrapy.Request(url=url,
+                             callback=self.parse, cb_kwargs=args)
             
     def parse(self, response, station_id):
-        save_path = os.path.join(
-            self.save_dir, f"{station_id}.json")
-        with open(save_path, "w") as f:
-            f.write(response.text)
+        yield NoaaResponseItem(station_id=station_id, key=str(station_id),
+                               url=response.url, status=response.status,
+                               body=response.text)
 
 class TimeSeriesNOAASpider(BasicNOAASpider):
-    TIME_DATA_MONTHLY = "monthly"
-    TIME_DATA_ANNUAL =  "annual"
+    # Longest window, in calendar months, that one request may span for each
+    # interval (NOAA caps: 6-minute data 1 month, hourly and hilo 1 year,
+    # daily means 10 years, monthly means 200 years)
+    MAX_WINDOW_MONTHS = {"6": 1, "h": 12, "hilo": 12, "d": 120, "monthly": 2400}
+    # Markers of the error for a window longer than the API allows; those
+    # windows are split in half and requested again. Other errors, e.g. no
+    # data or an invalid date range, are kept as they are
+    OVERSIZE_ERRORS = ("limit", "exceed")
     url = ""
     stations_url = ""
     start_year = 1990
-    time_type = TIME_DATA_MONTHLY
-    
-    def get_time_periods(self) -> tuple[date, date]:
+    end_date = None  # defaults to today
+    interval = "6"
+
+    @staticmethod
+    def parse_date(value):
+        # Station details use "YYYY-MM-DD HH:MM:SS.0"; empty when unknown
+        if not value:
+            return None
+        try:
+            return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return None
+
+    def active_range(self, station) -> tuple[date, date]:
+        details = station.get("details", {})
+        begin = date(int(self.start_year), 1, 1)
+        end = self.parse_date(self.end_date) or date.today()
+        established = self.parse_date(details.get("established"))
+        removed = self.parse_date(details.get("removed"))
+        if established is not None:
+            begin = max(begin, established)
+        if removed is not None:
+            end = min(end, removed)
+        return begin, end
+
+    def get_time_periods(self, station) -> list[tuple[date, date]]:
+        begin, end = self.active_range(station)
+        months = self.MAX_WINDOW_MONTHS[self.interval]
         time_periods = []
-        if self.time_type == self.TIME_DATA_MONTHLY:
-            years = range(self.start_year, 2025) # exclude 2025
-            months = (list(itertools.product(years, range(1, 13)))
-                            + [(2025, 1), (2025, 2)])
-            for year, month in months:
-                _, days = calendar.monthrange(year, month)
-                time_periods.append(
-                    (date(year, month, 1), date(year, month, days)))
-        else:
-            years = range(self.start_year, 2026)
-            time_periods = [(date(year, 1, 1), date(year, 12, 31))
-                            for year in years]
+        # Align windows to calendar months/years so keys stay stable
+        index = (begin.year * 12 + begin.month - 1) // months * months
+        while True:
+            year, month = divmod(index, 12)
+            window_begin = date(year, month + 1, 1)
+            if window_begin > end:
+                break
+            year, month = divmod(index + months - 1, 12)
+            _, days = calendar.monthrange(year, month + 1)
+            window_end = date(year, month + 1, days)
+            time_periods.append((max(window_begin, begin), min(window_end, end)))
+            index += months
         return time_periods
 
-    def start_requests(self):
-        stations = self.get_stations()
-        time_periods = self.get_time_periods()
-        for station in stations:
-            station_id = station["details"]["id"]
-            for time_period in time_periods:
-                begin = time_period[0].strftime("%Y%m%d")
-                end = time_period[1].strftime("%Y%m%d")
-                args = dict(begin=begin, end=end, station_id=station_id)
-                url = self.url.format(**args)
-                yield scrapy.Request(url=url, 
-                                     callback=self.parse, cb_kwargs=args)
+    def make_request(self, station_id, begin, end):
+        args = dict(begin=begin.strftime("%Y%m%d"), end=end.strftime("%Y%m%d"),
+                    station_id=station_id)
+        url = self.url.format(**args)
+        if self.interval != "6":
+            url += f"&interval={self.interval}"
+        return scrapy.Request(url=url, callback=self.parse, cb_kwargs=args)
+
+    def station_requests(self, station):
+        station_id = station["details"]["id"]
+        for begin, end in self.get_time_periods(station):
+            yield self.make_request(station_id, begin, end)
+
+    def oversize_error(self, response):
+        if b'"error"' not in response.body[:200]:
+            return False
+        with profiling.stage("spider.error_json"):
+            try:
+                message = json.loads(response.text)["error"]["message"].lower()
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return False
+        return any(i in message for i in self.OVERSIZE_ERRORS)
 
     def parse(self, response, begin, end, station_id):
-        save_path = os.path.join(
-            self.save_dir, f"{begin}-{end}-{station_id}.json")
-        with open(save_path, "w") as f:
-            f.write(response.text)
\ No newline at end of file
+        begin_date = datetime.strptime(begin, "%Y%m%d").date()
+        end_date = datetime.strptime(end, "%Y%m%d").date()
+        if end_date > begin_date and self.oversize_error(response):
+            middle = begin_date + (end_date - begin_date) // 2
+            yield self.make_request(station_id, begin_date, middle)
+            yield self.make_request(station_id, middle + timedelta(days=1), end_date)
+            return
+        yield NoaaResponseItem(station_id=station_id, key=f"{begin}-{end}-{station_id}",
+                               url=response.url, status=response.status,
+                               body=response.text)
@@ -24,3 +24,17 @@ class MonthlyMeanWaterLevelSpider(BasicNOAASpider):
         "type=historicwl&units=english"
     )
 
+class TidePredictionOffsetsSpider(BasicNOAASpider):
+    name = "tidepredoffsets"
+    url = (
+        "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/"
+        "stations/{station_id}/tidepredoffsets.json"
+    )
+    stations_url = (
+        "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations.json?"
+        "type=tidepredictions"
+    )
+
+    def select_stations(self, stations):
+        # Only subordinate stations publish offsets
+        return [i for i in stations if i.get("type") == "S"]
@@ -14,5 +14,5 @@ class WaterTempSpider(TimeSeriesNOAASpider):
         "type=watertemp&expand=details&units=english"
     )
     start_year = 1990
-    time_type = TimeSeriesNOAASpider.TIME_DATA_MONTHLY
+    interval = "6"  # or "h" (crawl with -a interval=h) for 1-year windows
         
\ No newline at end of file
@@ -0,0 +1,570 @@
+import collections
+import hashlib
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+"""
+Reader of the station catalog written by the top-level `catalog.py`, with
+its spatial index for nearest-station and bounding-box lookups.
+
+The catalog has one row per station ID. `regions` and `sources` record which
+lists a station appears in: the per-region geogroup lists `scrape.py`
+crawls ("regions") and the spiders' station lists, by list type (e.g.
+"harcon"). Each station keeps its raw entry from every one of those lists.
+It lives in the package so that the spiders can read their station lists
+from it as well as the scripts at the repository root.
+
+Nearest-neighbour queries use a KD-tree over unit vectors on the sphere.
+Straight-line (chord) distance between unit vectors orders points exactly
+like great-circle distance, so results match haversine distances, with no
+special cases at the antimeridian or the poles. Queries are batched: a
+million positions are answered in one call, a chunk of queries at a time.
+
+    catalog = StationCatalog.load()
+    rows, km = catalog.nearest(vessel_lat, vessel_lon, k=1)
+    reference = catalog.station_id[rows[:, 0]]
+
+The catalog and its tree are saved together in `station-catalog.npz`, which
+loads in milliseconds, with a version hash of its contents and the time it
+was built. `get_catalog` loads it once per process; the ID index and the
+raw entries are only built on first use.
+"""
+
+CATALOG_PATH = "station-catalog.npz"
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 32
+QUERY_CHUNK = 8192
+COLUMNS = ["station_id", "name", "lat", "lon", "state", "type", "ref_station_id", "regions",
+           "sources"]
+# Columns joining the names of every list a station appears in
+LIST_COLUMNS = ["regions", "sources"]
+# Station lists rarely change; the response cache keeps them for a day too
+CATALOG_MAX_AGE = 24 * 3600
+
+
+def unit_vectors(lat, lon):
+    """(n, 3) unit vectors for latitudes and longitudes in degrees."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    """Great-circle distance in km for a chord length between unit vectors."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points in degrees."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _bounds(n, depth):
+    """Start offsets of the 2**depth nodes at `depth`, plus n."""
+    return np.arange(2 ** depth + 1) * n // 2 ** depth
+
+
+class SphereTree:
+    """
+    Balanced KD-tree over unit vectors, stored as flat arrays.
+
+    Points are reordered so that every node covers a contiguous slice of
+    `order`; node j at depth d covers `_bounds(n, d)[j:j + 2]`, so only the
+    split of each inner node and the bounding box of each node need storing.
+    Nodes are numbered heap-style: the children of node i are 2i + 1 and
+    2i + 2.
+    """
+
+    def __init__(self, order, split_dim, split_value, box_lo, box_hi, points):
+        self.order = order
+        self.split_dim = split_dim
+        self.split_value = split_value
+        self.box_lo = box_lo
+        self.box_hi = box_hi
+        self.points = points
+        self.coords = np.ascontiguousarray(points.T)
+        self.lo_coords = np.ascontiguousarray(box_lo.T)
+        self.hi_coords = np.ascontiguousarray(box_hi.T)
+        self.n = len(order)
+        self.depth = int(np.log2(len(box_lo) + 1)) - 1
+        self.leaf_bounds = _bounds(self.n, self.depth)
+
+    @classmethod
+    def build(cls, points, leaf_size=LEAF_SIZE):
+        """
+        Build a tree over (n, 3) unit vectors, splitting every node at the
+        median of its widest dimension.
+        """
+        n = len(points)
+        if n == 0:
+            raise ValueError("cannot index an empty catalog")
+        depth = max(int(np.ceil(np.log2(n / leaf_size))), 0)
+        order = np.arange(n)
+        split_dim = np.zeros(2 ** depth - 1, dtype=np.int8)
+        split_value = np.zeros(2 ** depth - 1)
+        for d in range(depth):
+            bounds, children = _bounds(n, d), _bounds(n, d + 1)
+            for j in range(2 ** d):
+                lo, mid, hi = bounds[j], children[2 * j + 1], bounds[j + 1]
+                idx = order[lo:hi]
+                node = points[idx]
+                dim = int(np.argmax(node.max(axis=0) - node.min(axis=0)))
+                order[lo:hi] = idx[np.argpartition(node[:, dim], mid - lo)]
+                split_dim[2 ** d - 1 + j] = dim
+                split_value[2 ** d - 1 + j] = points[order[mid], dim]
+        ordered = points[order]
+        starts = _bounds(n, depth)[:-1]
+        box_lo = [np.minimum.reduceat(ordered, starts)]
+        box_hi = [np.maximum.reduceat(ordered, starts)]
+        for d in range(depth):
+            box_lo.insert(0, np.minimum(box_lo[0][0::2], box_lo[0][1::2]))
+            box_hi.insert(0, np.maximum(box_hi[0][0::2], box_hi[0][1::2]))
+        return cls(order, split_dim, split_value, np.concatenate(box_lo),
+                   np.concatenate(box_hi), ordered)
+
+    def _leaves(self, queries):
+        """Leaf each query descends to."""
+        node = np.zeros(len(queries), dtype=np.int64)
+        rows = np.arange(len(queries))
+        for d in range(self.depth):
+            right = queries[rows, self.split_dim[node]] >= self.split_value[node]
+            node = 2 * node + 1 + right
+        return node - (2 ** self.depth - 1)
+
+    def _distance2(self, positions, queries):
+        """Squared chord distances from points at `positions` to `queries`."""
+        d2 = np.zeros(positions.shape)
+        for dim in range(3):
+            diff = self.coords[dim][positions] - queries[dim]
+            d2 += diff * diff
+        return d2
+
+    def _initial_radius(self, queries, k):
+        """
+        Squared distance to the k-th nearest point in the smallest node of at
+        least k points on each query's path; an upper bound on the true one.
+        """
+        if self.n < k:
+            return np.full(len(queries), np.inf)
+        d = self.depth
+        while d > 0 and self.n // 2 ** d < k:
+            d -= 1
+        bounds = _bounds(self.n, d)
+        node = self._leaves(queries) >> (self.depth - d)
+        start, stop = bounds[node], bounds[node + 1]
+        positions = start[:, None] + np.arange(int((stop - start).max()))
+        valid = positions < stop[:, None]
+        positions = np.minimum(positions, self.n - 1)
+        d2 = self._distance2(positions, queries.T[:, :, None])
+        d2[~valid] = np.inf
+        return np.partition(d2, k - 1, axis=1)[:, k - 1]
+
+    def query(self, queries, k=1):
+        """
+        The k nearest points to each query.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            (m, 3) unit vectors
+        k : int, optional
+            Neighbours per query
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            (m, k) point indices, nearest first, and chord distances; -1 and
+            inf where the tree has fewer than k points
+        """
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        chords = np.full((len(queries), k), np.inf)
+        for lo in range(0, len(queries), QUERY_CHUNK):
+            chunk = queries[lo:lo + QUERY_CHUNK]
+            indices[lo:lo + len(chunk)], chords[lo:lo + len(chunk)] = self._query_chunk(chunk, k)
+        return indices, chords
+
+    def _query_chunk(self, queries, k):
+        m = len(queries)
+        radius2 = self._initial_radius(queries, k) * (1 + 1e-9) + 1e-15
+        # Descend with every (query, node) pair whose box reaches within the
+        # query's radius; pairs stay grouped by query throughout
+        columns = np.ascontiguousarray(queries.T)
+        rows = np.arange(m)
+        node = np.zeros(m, dtype=np.int64)
+        for d in range(self.depth):
+            rows = np.repeat(rows, 2)
+            node = np.repeat(2 * node + 1, 2)
+            node[1::2] += 1
+            box_d2 = np.zeros(len(node))
+            for dim in range(3):
+                q = columns[dim][rows]
+                gap = np.maximum(self.lo_coords[dim][node] - q, 0)
+                gap += np.maximum(q - self.hi_coords[dim][node], 0)
+                box_d2 += gap * gap
+            near = box_d2 <= radius2[rows]
+            rows, node = rows[near], node[near]
+        leaf = node - (2 ** self.depth - 1)
+        starts, stops = self.leaf_bounds[leaf], self.leaf_bounds[leaf + 1]
+        counts = stops - starts
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + np.arange(counts.sum()) - offsets
+        rows = np.repeat(rows, counts)
+        d2 = self._distance2(positions, columns[:, rows])
+        near = d2 <= radius2[rows]
+        rows, positions, d2 = rows[near], positions[near], d2[near]
+        # Every query keeps at least min(k, n) candidates; take the nearest
+        # k of each group by repeatedly removing the group minimum
+        group_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        group = np.cumsum(np.r_[False, rows[1:] != rows[:-1]])
+        group_rows = rows[group_starts]
+        indices = np.full((m, k), -1, dtype=np.int64)
+        chords = np.full((m, k), np.inf)
+        for rank in range(min(k, self.n)):
+            minimum = np.minimum.reduceat(d2, group_starts)
+            hits = np.flatnonzero(d2 == minimum[group])
+            first = hits[np.r_[True, group[hits[1:]] != group[hits[:-1]]]]
+            found = np.isfinite(d2[first])
+            first = first[found]
+            indices[group_rows[found], rank] = self.order[positions[first]]
+            chords[group_rows[found], rank] = np.sqrt(d2[first])
+            d2[first] = np.inf
+        return indices, chords
+
+
+def _coordinate(value):
+    """A latitude or longitude as a float, NaN when missing or unparseable."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class StationCatalog:
+    """
+    Station table as column arrays, plus a `SphereTree` over its positions.
+
+    Stations whose lists give no position have NaN `lat` and `lon`; they are
+    left out of the spatial queries but not of the lists.
+
+    Example
+    -------
+        catalog = StationCatalog.load()
+        rows, km = catalog.nearest([37.8, 21.3], [-122.5, -157.9], k=3)
+        catalog.station_id[rows]
+        catalog.within(37, -123, 38.5, -121.5)
+    """
+
+    def __init__(self, columns, tree=None, entries=None, version="", built_at=0.0,
+                 region_names=(), source_names=()):
+        """
+        Parameters
+        ----------
+        columns : dict[str, array_like]
+            One array per entry of `COLUMNS`
+        tree : SphereTree, optional
+            Index over the rows with a position; built when not given
+        entries : list[dict[str, dict]] or bytes, optional
+            Raw entry of each row by list name ("regions" or a spider list
+            type), or their JSON to parse on first use
+        version : str, optional
+            Hash of the contents, see `catalog_version`
+        built_at : float, optional
+            `time.time()` when the lists were fetched
+        region_names : iterable[str], optional
+            Region folders whose lists went into the catalog
+        source_names : iterable[str], optional
+            Spider station list types that went into the catalog
+        """
+        for name in COLUMNS:
+            setattr(self, name, np.asarray(columns[name]))
+        self.positioned = np.flatnonzero(np.isfinite(self.lat) & np.isfinite(self.lon))
+        if tree is None:
+            tree = SphereTree.build(unit_vectors(self.lat[self.positioned],
+                                                 self.lon[self.positioned]))
+        self.tree = tree
+        self.lat_order = self.positioned[np.argsort(self.lat[self.positioned], kind="stable")]
+        self.sorted_lat = self.lat[self.lat_order]
+        self._entries = entries
+        self._legacy_details = False
+        self.version = version
+        self.built_at = built_at
+        self.region_names = [str(i) for i in region_names]
+        self.source_names = [str(i) for i in source_names]
+        self._index = None
+        self._region_rows = None
+
+    def __len__(self):
+        return len(self.station_id)
+
+    def __contains__(self, station_id):
+        return str(station_id) in self.index
+
+    @classmethod
+    def from_stations(cls, stations, region_names=(), source_names=()):
+        """
+        Build a catalog from station dicts with the keys in `COLUMNS` and,
+        optionally, "entries" (see `__init__`).
+
+        Every station is kept; one without a usable position gets NaN `lat`
+        and `lon`.
+        """
+        stations = list(stations)
+        columns = {name: [s.get(name) or "" for s in stations] for name in COLUMNS}
+        columns["lat"] = np.array([_coordinate(s.get("lat")) for s in stations])
+        columns["lon"] = np.array([_coordinate(s.get("lon")) for s in stations])
+        for name in COLUMNS:
+            if name not in ("lat", "lon"):
+                columns[name] = np.array(columns[name], dtype=str)
+        return cls(columns, entries=[s.get("entries") or {} for s in stations],
+                   version=catalog_version(stations), built_at=time.time(),
+                   region_names=region_names, source_names=source_names)
+
+    def save(self, path=CATALOG_PATH):
+        """Write the columns, the raw entries and the tree to one `.npz` file."""
+        tree = self.tree
+        entries = self._raw_entries() if self._legacy_details else self._entries
+        if entries is None:
+            entries = [{}] * len(self)
+        if not isinstance(entries, bytes):
+            entries = json.dumps(entries, separators=(",", ":")).encode()
+        tmp_path = path + ".part.npz"
+        np.savez(tmp_path, **{name: getattr(self, name) for name in COLUMNS},
+                 entries=np.frombuffer(entries, dtype=np.uint8), version=np.array(self.version),
+                 built_at=np.array(self.built_at), region_names=np.array(self.region_names, dtype=str),
+                 source_names=np.array(self.source_names, dtype=str),
+                 tree_order=tree.order, tree_split_dim=tree.split_dim,
+                 tree_split_value=tree.split_value, tree_box_lo=tree.box_lo,
+                 tree_box_hi=tree.box_hi, tree_points=tree.points)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        """
+        Load a catalog written by `save`, without rebuilding the tree or
+        parsing the raw entries.
+        """
+        with np.load(path) as data:
+            n = len(data["station_id"])
+            columns = {name: data[name] if name in data.files else np.full(n, "")
+                       for name in COLUMNS}
+            tree = SphereTree(data["tree_order"], data["tree_split_dim"],
+                              data["tree_split_value"], data["tree_box_lo"],
+                              data["tree_box_hi"], data["tree_points"])
+            # Older catalogs kept one raw entry per row, as "details", or none
+            legacy = "entries" not in data.files and "details" in data.files
+            entries = (data["entries"].tobytes() if "entries" in data.files
+                       else data["details"].tobytes() if legacy else None)
+            version = str(data["version"]) if "version" in data.files else ""
+            built_at = float(data["built_at"]) if "built_at" in data.files else 0.0
+            region_names = data["region_names"] if "region_names" in data.files else ()
+            source_names = data["source_names"] if "source_names" in data.files else ()
+        catalog = cls(columns, tree, entries, version, built_at, region_names, source_names)
+        catalog._legacy_details = legacy
+        return catalog
+
+    def _raw_entries(self):
+        if isinstance(self._entries, bytes):
+            self._entries = json.loads(self._entries)
+        if self._legacy_details:
+            # A lone raw entry came from the first list the station was in
+            self._entries = [{sources.split(",")[0]: details} if details else {}
+                             for sources, details in zip(self.sources.tolist(), self._entries)]
+            self._legacy_details = False
+        return self._entries
+
+    @property
+    def index(self):
+        """Station ID mapped to its row, built on first use."""
+        if self._index is None:
+            self._index = {i: row for row, i in enumerate(self.station_id.tolist())}
+        return self._index
+
+    def subset(self, mask):
+        """A new catalog of the rows where `mask` is true, e.g. one source."""
+        rows = np.flatnonzero(mask)
+        entries = self._raw_entries()
+        return StationCatalog({name: getattr(self, name)[rows] for name in COLUMNS},
+                              entries=None if entries is None else [entries[i] for i in rows])
+
+    def row(self, i):
+        """One station as a dict."""
+        return {name: getattr(self, name)[i].item() for name in COLUMNS}
+
+    def station(self, station_id):
+        """
+        One station as a dict, with its raw entry by list name under
+        "entries" and the first of them under "details".
+
+        Raises
+        ------
+        KeyError
+            When the station is not in the catalog
+        """
+        row = self.index.get(str(station_id))
+        if row is None:
+            raise KeyError(f"station {station_id} is not in the catalog")
+        stn = self.row(row)
+        entries = self._raw_entries()
+        stn["entries"] = entries[row] if entries is not None else {}
+        stn["details"] = next(iter(stn["entries"].values()), {})
+        return stn
+
+    def region_stations(self, region):
+        """
+        Stations of one region folder, as `scrape.py` writes them to the
+        region's stations.json.
+        """
+        if self._region_rows is None:
+            self._region_rows = collections.defaultdict(list)
+            for row, regions in enumerate(self.regions.tolist()):
+                for name in filter(None, regions.split(",")):
+                    self._region_rows[name].append(row)
+        entries = self._raw_entries() or [{}] * len(self)
+        return [dict(entries[row].get("regions") or next(iter(entries[row].values()), {}),
+                     state=region)
+                for row in self._region_rows.get(region, [])]
+
+    def source_stations(self, source):
+        """
+        Raw entries of one spider station list, as its "stations" array.
+
+        Parameters
+        ----------
+        source : str
+            List type, one of `source_names` (e.g. "harcon")
+        """
+        entries = self._raw_entries() or [{}] * len(self)
+        return [entries[row][source] for row, sources in enumerate(self.sources.tolist())
+                if source in sources.split(",") and source in entries[row]]
+
+    def nearest(self, lat, lon, k=1):
+        """
+        The k nearest stations to each position.
+
+        Parameters
+        ----------
+        lat, lon : float or array_like
+            Positions in degrees
+        k : int, optional
+            Stations per position
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            (m, k) catalog rows, nearest first, and great-circle distances in
+            km; -1 and inf where the catalog has fewer than k stations with
+            a position
+        """
+        queries = unit_vectors(np.atleast_1d(np.asarray(lat, dtype=float)),
+                               np.atleast_1d(np.asarray(lon, dtype=float)))
+        rows, chords = self.tree.query(queries, k)
+        km = chord_to_km(chords)
+        km[rows < 0] = np.inf
+        return np.where(rows >= 0, self.positioned[rows], -1), km
+
+    def within_boxes(self, south, west, north, east):
+        """
+        Stations inside each of a batch of latitude/longitude boxes.
+
+        A box with west > east crosses the antimeridian.
+
+        Parameters
+        ----------
+        south, west, north, east : float or array_like
+            Box edges in degrees, inclusive
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            Box index and catalog row of every match, grouped by box
+        """
+        south, west, north, east = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(i, dtype=float)) for i in (south, west, north, east)))
+        lo = np.searchsorted(self.sorted_lat, south, side="left")
+        hi = np.searchsorted(self.sorted_lat, north, side="right")
+        counts = np.maximum(hi - lo, 0)
+        boxes = np.repeat(np.arange(len(lo)), counts)
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self.lat_order[np.repeat(lo, counts) + np.arange(counts.sum()) - offsets]
+        lon, box_west, box_east = self.lon[rows], west[boxes], east[boxes]
+        inside = np.where(box_west <= box_east,
+                          (lon >= box_west) & (lon <= box_east),
+                          (lon >= box_west) | (lon <= box_east))
+        return boxes[inside], rows[inside]
+
+    def within(self, south, west, north, east):
+        """Catalog rows of the stations inside one box, see `within_boxes`."""
+        return self.within_boxes(south, west, north, east)[1]
+
+def station_list_type(url):
+    """List type of an mdapi station list URL, e.g. "harcon"."""
+    return parse_qs(urlsplit(url).query)["type"][0]
+
+
+def catalog_version(stations):
+    """SHA-256 of station dicts, independent of their order."""
+    records = sorted(json.dumps(s, sort_keys=True, default=str) for s in stations)
+    return hashlib.sha256("\n".join(records).encode()).hexdigest()
+
+
+_loaded = {}
+
+
+def get_catalog(path=CATALOG_PATH):
+    """
+    The catalog at `path`, loaded once per process and again only when the
+    file changes.
+
+    Returns
+    -------
+    StationCatalog or None
+        None when there is no catalog yet
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if path not in _loaded or _loaded[path][0] != mtime:
+        _loaded[path] = (mtime, StationCatalog.load(path))
+    return _loaded[path][1]
+
+
+
+def region_station_lists(data_dir="data", path=CATALOG_PATH):
+    """
+    Station list of every region, from the saved catalog when it has region
+    lists and otherwise from the stations.json files under `data_dir`.
+
+    Parameters
+    ----------
+    data_dir : str, optional
+        Directory with one stations.json per region, as `scrape.py` writes
+    path : str, optional
+        Saved catalog; None or "" only reads `data_dir`
+
+    Returns
+    -------
+    dict[str, list[dict]]
+        Region folder mapped to its stations, each with "state" set to it
+    """
+    catalog = get_catalog(path) if path else None
+    if catalog is not None and catalog.region_names:
+        return {region: catalog.region_stations(region) for region in sorted(catalog.region_names)}
+    lists = {}
+    if not os.path.isdir(data_dir):
+        return lists
+    for region in sorted(os.listdir(data_dir)):
+        stations_file = os.path.join(data_dir, region, "stations.json")
+        if not os.path.exists(stations_file):
+            continue
+        with open(stations_file, "r") as f:
+            lists[region] = [dict(stn, state=stn.get("state", region)) for stn in json.load(f)]
+    return lists
@@ -0,0 +1,309 @@
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import hashlib
+import json
+import os
+import time
+
+import zstandard
+
+"""
+Package the scraped archive for upload to DataLumos.
+
+Every file under `data/`, `data-<name>/`, `noaa_scrape/data-<spider>/` and
+`sl-data/` is hashed (SHA-256), and each distinct payload is stored once:
+NOAA error responses and unchanged re-fetches are written a single time no
+matter how many files hold them. New payloads are concatenated into chunks
+of about `CHUNK_BYTES` that are compressed with zstd on a thread pool
+(zstandard releases the GIL, so chunks compress on every core while the
+main thread keeps reading). The output directory holds:
+
+    chunks/<sha256 of the compressed chunk>.zst
+    manifest.json
+
+The manifest maps every file to its payload hash, size and mtime, every
+payload to (chunk, offset, length) within the decompressed chunk, and every
+chunk to its compressed size. Packaging again into the same directory only
+reads files whose size or mtime changed and only writes chunks for payloads
+not already packaged, so an upload after a re-crawl only ships the chunks
+that `python package_archive.py diff` lists. Chunks are never rewritten.
+"""
+
+OUTPUT_DIR = "datalumos"
+MANIFEST_NAME = "manifest.json"
+CHUNK_BYTES = 64 * 1024**2
+COMPRESSION_LEVEL = 10
+# Top-level directories (relative to the repository root) that hold data
+SOURCE_PATTERNS = ["data", "data-*", "noaa_scrape/data-*", "sl-data"]
+
+
+def source_files(root=".", patterns=SOURCE_PATTERNS):
+    """
+    Every file under the source directories.
+
+    Returns
+    -------
+    list[tuple[str, int, int]]
+        Path relative to `root` (with "/" separators), size and mtime in
+        nanoseconds, sorted by path
+    """
+    files = []
+    for pattern in patterns:
+        for top in sorted(glob.glob(os.path.join(root, pattern))):
+            if not os.path.isdir(top):
+                continue
+            for folder_path, folder_names, file_names in os.walk(top):
+                folder_names.sort()
+                for file_name in file_names:
+                    if file_name.endswith(".part"):
+                        continue
+                    path = os.path.join(folder_path, file_name)
+                    st = os.stat(path)
+                    rel = os.path.relpath(path, root).replace(os.sep, "/")
+                    files.append((rel, st.st_size, st.st_mtime_ns))
+    return sorted(set(files))
+
+
+def load_manifest(output_dir=OUTPUT_DIR):
+    """The manifest in `output_dir`, or an empty one."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": 1, "chunks": {}, "payloads": {}, "files": {}}
+
+
+def write_manifest(manifest, output_dir=OUTPUT_DIR):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".part", "w") as f:
+        json.dump(manifest, f, separators=(",", ":"), sort_keys=True)
+    os.replace(path + ".part", path)
+
+
+def read_and_hash(path):
+    """Contents and SHA-256 hex digest of a file."""
+    with open(path, "rb") as f:
+        body = f.read()
+    return body, hashlib.sha256(body).hexdigest()
+
+
+def compress_chunk(chunk, output_dir, level=COMPRESSION_LEVEL):
+    """
+    Compress and write one chunk.
+
+    Returns
+    -------
+    tuple[str, int]
+        Chunk name (SHA-256 of the compressed bytes) and compressed size
+    """
+    data = zstandard.ZstdCompressor(level=level).compress(chunk)
+    name = hashlib.sha256(data).hexdigest()
+    path = os.path.join(output_dir, "chunks", name + ".zst")
+    if not os.path.exists(path):
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+    return name, len(data)
+
+
+def _bounded_map(executor, fn, items, window):
+    """`executor.map` that keeps at most `window` calls in flight, in order."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ChunkPacker:
+    """
+    Collects new payloads into chunks and compresses full chunks on a pool.
+
+    At most `workers` chunks are compressing at once, so memory stays
+    around `(workers + 1) * chunk_bytes`.
+    """
+
+    def __init__(self, manifest, output_dir, executor, workers, chunk_bytes, level):
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.executor = executor
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.level = level
+        self.buffer = bytearray()
+        self.members = []
+        self.in_flight = collections.deque()
+        self.new_chunks = []
+
+    def add(self, payload_hash, body):
+        """Queue a payload that is not in the manifest yet."""
+        self.members.append((payload_hash, len(self.buffer), len(body)))
+        self.buffer += body
+        if len(self.buffer) >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.members:
+            return
+        future = self.executor.submit(compress_chunk, bytes(self.buffer), self.output_dir,
+                                      self.level)
+        self.in_flight.append((future, self.members))
+        self.buffer, self.members = bytearray(), []
+        while len(self.in_flight) > self.workers:
+            self._finish(*self.in_flight.popleft())
+
+    def _finish(self, future, members):
+        name, size = future.result()
+        self.manifest["chunks"][name] = {"size": size, "payloads": len(members)}
+        for payload_hash, offset, length in members:
+            self.manifest["payloads"][payload_hash] = [name, offset, length]
+        self.new_chunks.append(name)
+
+    def close(self):
+        """Compress the last partial chunk and wait for every chunk."""
+        self.flush()
+        while self.in_flight:
+            self._finish(*self.in_flight.popleft())
+        return self.new_chunks
+
+
+def package(root=".", output_dir=OUTPUT_DIR, workers=None, chunk_bytes=CHUNK_BYTES,
+            level=COMPRESSION_LEVEL, patterns=SOURCE_PATTERNS):
+    """
+    Package the source directories under `root` into `output_dir`.
+
+    Files whose size and mtime match the previous manifest are not read
+    again. Files that disappeared are dropped from the manifest, but their
+    chunks are kept, since they may already be uploaded.
+
+    Returns
+    -------
+    dict
+        Counts of "files", "read" (files hashed this run), "payloads",
+        "duplicates" (files whose payload was already stored), "bytes" (total
+        file size), "new_chunks" and "new_bytes" (compressed)
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(os.path.join(output_dir, "chunks"), exist_ok=True)
+    manifest = load_manifest(output_dir)
+    previous = manifest["files"]
+    files = source_files(root, patterns)
+    unchanged = [f for f in files if previous.get(f[0], {}).get("size") == f[1]
+                 and previous[f[0]].get("mtime_ns") == f[2]
+                 and previous[f[0]].get("sha256") in manifest["payloads"]]
+    changed = sorted(set(files) - set(unchanged))
+    stats = dict(files=len(files), read=len(changed), payloads=0, duplicates=0,
+                 bytes=sum(f[1] for f in files), new_chunks=0, new_bytes=0)
+    entries = {rel: previous[rel] for rel, _, _ in unchanged}
+    # Reading and hashing (I/O and hashlib, both GIL-free) and compression
+    # share one pool; the main thread only copies bytes into chunks
+    with ThreadPoolExecutor(max(workers, 4)) as executor:
+        packer = ChunkPacker(manifest, output_dir, executor, workers, chunk_bytes, level)
+        queued = set()
+        paths = (os.path.join(root, rel) for rel, _, _ in changed)
+        results = _bounded_map(executor, read_and_hash, paths, 4 * max(workers, 4))
+        for (rel, size, mtime_ns), (body, payload_hash) in zip(changed, results):
+            entries[rel] = {"sha256": payload_hash, "size": size, "mtime_ns": mtime_ns}
+            if payload_hash in manifest["payloads"] or payload_hash in queued:
+                continue
+            queued.add(payload_hash)
+            packer.add(payload_hash, body)
+        new_chunks = packer.close()
+    manifest["files"] = entries
+    write_manifest(manifest, output_dir)
+    hashes = collections.Counter(entry["sha256"] for entry in entries.values())
+    stats["payloads"] = len(hashes)
+    stats["duplicates"] = len(entries) - len(hashes)
+    stats["new_chunks"] = len(new_chunks)
+    stats["new_bytes"] = sum(manifest["chunks"][name]["size"] for name in new_chunks)
+    return stats
+
+
+def diff(old_manifest, new_manifest):
+    """Names of the chunks in `new_manifest` that are not in `old_manifest`."""
+    return sorted(set(new_manifest["chunks"]) - set(old_manifest["chunks"]))
+
+
+def extract(output_dir=OUTPUT_DIR, destination=".", prefix=""):
+    """
+    Restore the packaged files whose paths start with `prefix`.
+
+    Each chunk is read and checked against its hash once.
+
+    Returns
+    -------
+    int
+        Number of files written
+
+    Raises
+    ------
+    ValueError
+        When a chunk or payload does not match its checksum
+    """
+    manifest = load_manifest(output_dir)
+    by_chunk = collections.defaultdict(list)
+    for rel, entry in manifest["files"].items():
+        if rel.startswith(prefix):
+            chunk, offset, length = manifest["payloads"][entry["sha256"]]
+            by_chunk[chunk].append((rel, entry["sha256"], offset, length))
+    decompressor = zstandard.ZstdDecompressor()
+    written = 0
+    for chunk, members in sorted(by_chunk.items()):
+        with open(os.path.join(output_dir, "chunks", chunk + ".zst"), "rb") as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != chunk:
+            raise ValueError(f"chunk {chunk} is corrupt")
+        data = decompressor.decompress(data)
+        for rel, payload_hash, offset, length in members:
+            body = data[offset:offset + length]
+            if hashlib.sha256(body).hexdigest() != payload_hash:
+                raise ValueError(f"{rel} does not match its checksum")
+            path = os.path.join(destination, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(body)
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="PackageArchive",
+                    description="Packages the scraped data into deduplicated zstd chunks for DataLumos")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="package new and changed files")
+    build_parser.add_argument("--root", default=".", help="repository root to package from")
+    build_parser.add_argument("--output", default=OUTPUT_DIR)
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    build_parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024**2)
+    build_parser.add_argument("--level", type=int, default=COMPRESSION_LEVEL)
+    diff_parser = subparsers.add_parser(
+        "diff", help="list chunks added since an earlier manifest, i.e. what to upload")
+    diff_parser.add_argument("old_manifest", help="copy of manifest.json from the last upload")
+    diff_parser.add_argument("--output", default=OUTPUT_DIR)
+    extract_parser = subparsers.add_parser("extract", help="restore files from the chunks")
+    extract_parser.add_argument("destination")
+    extract_parser.add_argument("--output", default=OUTPUT_DIR)
+    extract_parser.add_argument("--prefix", default="", help="only files under this path")
+    args = parser.parse_args()
+    if args.command == "build":
+        started = time.monotonic()
+        stats = package(args.root, args.output, args.workers, int(args.chunk_mb * 1024**2),
+                        args.level)
+        elapsed = time.monotonic() - started
+        print(f"{stats['files']} files ({stats['bytes'] / 1024**2:.1f} MB), "
+              f"{stats['read']} read, {stats['payloads']} distinct payloads, "
+              f"{stats['duplicates']} duplicates")
+        print(f"{stats['new_chunks']} new chunks ({stats['new_bytes'] / 1024**2:.1f} MB) "
+              f"in {elapsed:.1f} s")
+    elif args.command == "diff":
+        with open(args.old_manifest) as f:
+            old = json.load(f)
+        for name in diff(old, load_manifest(args.output)):
+            print(os.path.join(args.output, "chunks", name + ".zst"))
+    else:
+        print(f"Restored {extract(args.output, args.destination, args.prefix)} files")
@@ -0,0 +1,270 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from datums import DATUMS_PATH, DatumTable
+from noaa_scrape.noaa_scrape.station_catalog import CATALOG_PATH
+from rollups import bin_starts
+from scrape import DATUM, load_region_stations, year_data_interval
+from store import STORE_PATH, SeriesStore
+from timezones import local_to_utc, station_zone
+
+"""
+Prediction accuracy of every station, from the archived predictions and
+the observed monthly means.
+
+The archive's observations are NOAA's monthly means (the
+`monthlymeanwaterlevel` spider, parsed to `arrays-monthlymeanwaterlevel/
+<station_id>.monthly.npz` by `python ingest.py`). Each station's 6-minute
+predictions are reduced to the same quantities on the same time base,
+calendar months in GMT:
+
+* MSL: mean of all heights
+* MHHW / MLLW: mean of each day's highest / lowest height
+* highest / lowest: extremes of the month
+
+Observed values are converted from the station datum (STND) to the
+predictions' MLLW with `datums.DatumTable`, the predictions' local times
+are converted to GMT in each station's zone (`timezones.py`), and the
+residuals (observed - predicted) of every matched month are summarized per
+quantity: bias, RMSE, 5th/50th/95th percentiles and the bias in each
+season. Only days with at least 90% of their samples and months with at
+least 90% of their days are compared.
+
+Subordinate stations only have high/low predictions (interval "hilo"). The
+mean of those extrema is not MSL, so their MSL is left empty, and a day
+counts when it has at least a high and a low.
+
+Stations are processed in parallel, one at a time per worker: a worker maps
+one station's predictions from the series store, reduces them and returns a
+single row, so memory does not grow with the archive.
+"""
+
+ARRAYS_DIR = "noaa_scrape/arrays-monthlymeanwaterlevel"
+OUTPUT_PATH = "residuals.csv"
+QUANTITIES = ["MSL", "MHHW", "MLLW", "highest", "lowest"]
+SEASONS = {"djf": (12, 1, 2), "mam": (3, 4, 5), "jja": (6, 7, 8), "son": (9, 10, 11)}
+MIN_COVERAGE = 0.9
+# Extrema a day of high/low predictions needs to count
+MIN_HILO_PER_DAY = 2
+MONTHLY_SUFFIX = ".monthly.npz"
+
+
+def monthly_predicted(times, heights, zone="UTC", interval="6"):
+    """
+    Monthly MSL, MHHW, MLLW, highest and lowest of a prediction series.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Sorted epoch minutes in the station's local time
+    heights : numpy.ndarray
+        Heights at `times`
+    zone : str, optional
+        IANA zone of `times`, see `timezones.local_to_utc`
+    interval : str, optional
+        "6" for 6-minute heights, "hilo" for highs and lows only
+
+    Returns
+    -------
+    tuple[numpy.ndarray, dict[str, numpy.ndarray]]
+        Epoch minutes of each month start (GMT) and one float64 array per
+        entry of `QUANTITIES`; months without enough data are left out, and
+        MSL is NaN for a hilo series
+    """
+    times = local_to_utc(times, zone)
+    order = np.argsort(times, kind="stable")
+    times, heights = times[order], np.asarray(heights, dtype=np.float64)[order]
+    present = ~np.isnan(heights)
+    times, heights = times[present], heights[present]
+    if len(times) < 2:
+        return np.array([], dtype=np.int64), {q: np.array([]) for q in QUANTITIES}
+    days = times // 1440
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    day_counts = np.diff(np.r_[day_starts, len(times)])
+    if interval == "hilo":
+        full = day_counts >= MIN_HILO_PER_DAY
+    else:
+        step = float(np.median(np.diff(times)))
+        full = day_counts * step >= 1440 * MIN_COVERAGE
+    day_times = days[day_starts][full] * 1440
+    day_max = np.maximum.reduceat(heights, day_starts)[full]
+    day_min = np.minimum.reduceat(heights, day_starts)[full]
+    day_sum = np.add.reduceat(heights, day_starts)[full]
+    day_counts = day_counts[full]
+    if not len(day_times):
+        return np.array([], dtype=np.int64), {q: np.array([]) for q in QUANTITIES}
+    months = bin_starts(day_times, "month")
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    month_days = np.diff(np.r_[starts, len(months)])
+    month_times = months[starts]
+    days_in_month = (bin_starts(month_times + 31 * 1440, "month") - month_times) // 1440
+    keep = month_days >= days_in_month * MIN_COVERAGE
+    msl = np.add.reduceat(day_sum, starts) / np.add.reduceat(day_counts, starts)
+    values = {
+        "MSL": np.full(len(starts), np.nan) if interval == "hilo" else msl,
+        "MHHW": np.add.reduceat(day_max, starts) / month_days,
+        "MLLW": np.add.reduceat(day_min, starts) / month_days,
+        "highest": np.maximum.reduceat(day_max, starts),
+        "lowest": np.minimum.reduceat(day_min, starts),
+    }
+    return month_times[keep], {q: v[keep] for q, v in values.items()}
+
+
+def load_observed(path):
+    """
+    Monthly means written by `ingest.py`, one row per month.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, dict[str, numpy.ndarray]]
+        Sorted epoch minutes of each month start and the `QUANTITIES` columns
+        (float64, NaN where missing); a month that appears more than once
+        keeps the value written last
+    """
+    with np.load(path) as data:
+        times = data["time"].astype(np.int64)
+        columns = {q: data[q].astype(np.float64) if q in data.files
+                   else np.full(len(times), np.nan) for q in QUANTITIES}
+    # Reverse first so the stable sort puts the latest duplicate first
+    order = len(times) - 1 - np.argsort(times[::-1], kind="stable")
+    times = times[order]
+    keep = np.r_[True, times[1:] != times[:-1]]
+    return times[keep], {q: v[order][keep] for q, v in columns.items()}
+
+
+def residual_stats(times, residuals):
+    """
+    Summary statistics of one quantity's residuals.
+
+    Returns
+    -------
+    dict[str, float]
+        "n", "bias", "rmse", "p05", "p50", "p95" and "bias_<season>" for
+        every season in `SEASONS`; NaN when there is nothing to summarize
+    """
+    present = ~np.isnan(residuals)
+    times, residuals = times[present], residuals[present]
+    stats = {"n": int(len(residuals))}
+    if not len(residuals):
+        stats.update(bias=np.nan, rmse=np.nan, p05=np.nan, p50=np.nan, p95=np.nan)
+        stats.update({f"bias_{season}": np.nan for season in SEASONS})
+        return stats
+    stats["bias"] = float(residuals.mean())
+    stats["rmse"] = float(np.sqrt((residuals ** 2).mean()))
+    stats["p05"], stats["p50"], stats["p95"] = (float(p) for p in
+                                                np.percentile(residuals, [5, 50, 95]))
+    month = times.astype("datetime64[m]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+    for season, months in SEASONS.items():
+        in_season = np.isin(month, months)
+        stats[f"bias_{season}"] = (float(residuals[in_season].mean()) if in_season.any()
+                                   else np.nan)
+    return stats
+
+
+_stores = {}
+
+
+def station_residuals(station_id, store_path, observed_path, datum_shift, zone, interval="6"):
+    """
+    Residual statistics of one station, see `residual_stats`.
+
+    Parameters
+    ----------
+    station_id : str
+        NOAA station ID
+    store_path : str
+        Series store with the station's predictions (MLLW, feet)
+    observed_path : str
+        The station's `.monthly.npz`
+    datum_shift : float
+        Feet to add to the observed (STND) values to reference them to MLLW
+    zone : str
+        IANA zone of the predictions' local times
+    interval : str, optional
+        Interval of the predictions, "hilo" for subordinate stations
+
+    Returns
+    -------
+    dict
+        "station_id", "months" (matched months) and "<quantity>_<statistic>"
+        for every quantity and statistic
+    """
+    if store_path not in _stores:
+        _stores[store_path] = SeriesStore(store_path)
+    times, heights = _stores[store_path].query(station_id)
+    predicted_times, predicted = monthly_predicted(times, heights, zone, interval)
+    observed_times, observed = load_observed(observed_path)
+    matched, i, j = np.intersect1d(predicted_times, observed_times, return_indices=True)
+    row = {"station_id": station_id, "months": int(len(matched))}
+    for quantity in QUANTITIES:
+        residuals = observed[quantity][j] + datum_shift - predicted[quantity][i]
+        for name, value in residual_stats(matched, residuals).items():
+            row[f"{quantity}_{name}"] = value
+    return row
+
+
+def run(store_path=STORE_PATH, arrays_dir=ARRAYS_DIR, datums_path=DATUMS_PATH,
+        data_dir="data", workers=None, catalog_path=CATALOG_PATH):
+    """
+    Residual statistics of every station with both predictions and observations.
+
+    Returns
+    -------
+    tuple[pandas.DataFrame, list[str]]
+        One row per station (see `station_residuals`), and the stations
+        skipped because their datums are unknown
+    """
+    predicted = set(SeriesStore(store_path).stations())
+    observed = {filename[:-len(MONTHLY_SUFFIX)] for filename in os.listdir(arrays_dir)
+                if filename.endswith(MONTHLY_SUFFIX)}
+    table = DatumTable.load(datums_path)
+    known = set(table.station_ids.tolist())
+    station_ids = sorted(predicted & observed)
+    shifts = {i: float(table.shift(i, "STND", DATUM)) for i in station_ids if i in known}
+    skipped = [i for i in station_ids if np.isnan(shifts.get(i, np.nan))]
+    station_ids = [i for i in station_ids if i not in skipped]
+    definitions = load_region_stations(data_dir, catalog_path)
+    zones = [station_zone(definitions[i]) if i in definitions else "UTC" for i in station_ids]
+    intervals = [year_data_interval(definitions[i]) if i in definitions else "6"
+                 for i in station_ids]
+    with ProcessPoolExecutor(workers) as executor:
+        rows = list(executor.map(
+            station_residuals, station_ids, [store_path] * len(station_ids),
+            [os.path.join(arrays_dir, i + MONTHLY_SUFFIX) for i in station_ids],
+            [shifts[i] for i in station_ids], zones, intervals, chunksize=8))
+    columns = ["station_id", "months"] + [f"{q}_{name}" for q in QUANTITIES for name in
+                                          ["n", "bias", "rmse", "p05", "p50", "p95"]
+                                          + [f"bias_{season}" for season in SEASONS]]
+    return pd.DataFrame(rows, columns=columns), sorted(skipped)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Residuals",
+                    description="Compares archived predictions with observed monthly means for every station")
+    parser.add_argument("--store", default=STORE_PATH, help="series store of the predictions")
+    parser.add_argument("--arrays-dir", default=ARRAYS_DIR,
+                        help="monthly means parsed by ingest.py")
+    parser.add_argument("--datums", default=DATUMS_PATH, help="table written by datums.py fetch")
+    parser.add_argument("--data-dir", default="data",
+                        help="directory with one stations.json per region, for time zones")
+    parser.add_argument("--catalog", default=CATALOG_PATH,
+                        help="station catalog read instead of --data-dir when it has the region lists")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args()
+    started = time.monotonic()
+    results, skipped = run(args.store, args.arrays_dir, args.datums, args.data_dir, args.workers,
+                           args.catalog)
+    results.to_csv(args.output, index=False, float_format="%.4f")
+    print(f"Wrote {len(results)} stations to {args.output} in {time.monotonic() - started:.1f} s")
+    if skipped:
+        print(f"{len(skipped)} stations have no datums: {' '.join(skipped[:20])}")
+    if len(results):
+        print(results[["station_id", "months", "MSL_bias", "MSL_rmse", "MHHW_rmse",
+                       "MLLW_rmse"]].describe().round(3).to_string())
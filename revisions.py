@@ -0,0 +1,393 @@
+import argparse
+import difflib
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import zstandard
+
+"""
+Revision history of re-fetched prediction files.
+
+NOAA predictions reflect "the latest information available as of the date
+of your request", so future years are fetched again on a schedule (see
+`scrape.py --refresh`). The file in `data/` always holds the latest version.
+Whenever a refetch differs from it, the older version is kept as a reverse
+delta: the line edits that turn the new file back into the old one, stored
+zstd-compressed in `revisions.sqlite`. Any earlier version is rebuilt by
+applying the deltas from the latest version backwards.
+
+Each stored revision also records how much the predictions moved (rows
+changed, largest and mean absolute height change), which `report` turns
+into a per-station change report.
+"""
+
+REVISIONS_PATH = "revisions.sqlite"
+REPORT_PATH = "changes-report.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    station TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    previous_sha256 TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    changed_rows INTEGER NOT NULL,
+    added_rows INTEGER NOT NULL,
+    removed_rows INTEGER NOT NULL,
+    max_abs_change REAL,
+    mean_abs_change REAL,
+    delta BLOB NOT NULL,
+    PRIMARY KEY (station, year, interval, version)
+);
+CREATE TABLE IF NOT EXISTS checks (
+    station TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (station, year, interval)
+);
+"""
+
+
+def make_delta(new_text, old_text, level=10):
+    """
+    Reverse delta that rebuilds `old_text` from `new_text`.
+
+    Lines are aligned on their first field (the timestamp), which is fast
+    even when every height changed; lines with the same timestamp are then
+    compared directly.
+
+    Parameters
+    ----------
+    new_text, old_text : str
+        The latest and the previous version of a file
+    level : int, optional
+        zstd compression level
+
+    Returns
+    -------
+    bytes
+        Compressed JSON list of [start, end, lines] edits: replace lines
+        `start:end` of the new text with `lines`
+    """
+    new_lines = new_text.splitlines(keepends=True)
+    old_lines = old_text.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(
+        None, [line.split(",", 1)[0] for line in new_lines],
+        [line.split(",", 1)[0] for line in old_lines], autojunk=False)
+    edits = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append([i1, i2, old_lines[j1:j2]])
+            continue
+        start = None
+        for k in range(i2 - i1 + 1):
+            differs = k < i2 - i1 and new_lines[i1 + k] != old_lines[j1 + k]
+            if differs and start is None:
+                start = k
+            elif not differs and start is not None:
+                edits.append([i1 + start, i1 + k, old_lines[j1 + start:j1 + k]])
+                start = None
+    return zstandard.ZstdCompressor(level=level).compress(json.dumps(edits).encode())
+
+
+def apply_delta(new_text, delta):
+    """Rebuild the previous version of a file from its latest text and a delta."""
+    lines = new_text.splitlines(keepends=True)
+    edits = json.loads(zstandard.ZstdDecompressor().decompress(delta))
+    # Later edits first, so earlier line numbers stay valid
+    for start, end, replacement in reversed(edits):
+        lines[start:end] = replacement
+    return "".join(lines)
+
+
+def parse_predictions(text):
+    """
+    Timestamps and heights of prediction CSV text.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray] or None
+        datetime64[m] timestamps and float heights, or None when the text is
+        not prediction data (e.g. a saved API error)
+    """
+    header, _, body = text.partition("\n")
+    if not header.startswith("Date Time"):
+        return None
+    lines = body.splitlines()
+    try:
+        times = np.array([line[:16] for line in lines], dtype="datetime64[m]")
+        heights = np.array([line.split(",")[1] for line in lines], dtype=float)
+    except (ValueError, IndexError):
+        return None
+    return times, heights
+
+
+def compare(old_text, new_text):
+    """
+    Measure how much a prediction file changed between two versions.
+
+    Rows are matched on timestamp, so added and removed rows are counted
+    separately from rows whose height changed.
+
+    Returns
+    -------
+    dict
+        rows, changed_rows, added_rows, removed_rows, max_abs_change and
+        mean_abs_change (heights in the file's units; None when no rows
+        changed or either version is not prediction data)
+    """
+    old, new = parse_predictions(old_text), parse_predictions(new_text)
+    if old is None or new is None:
+        rows = len(new[0]) if new is not None else 0
+        return dict(rows=rows, changed_rows=rows, added_rows=0, removed_rows=0,
+                    max_abs_change=None, mean_abs_change=None)
+    (old_times, old_heights), (new_times, new_heights) = old, new
+    if len(old_times) == len(new_times) and (old_times == new_times).all():
+        old_matched, new_matched = old_heights, new_heights
+        common = len(new_times)
+    else:
+        common_times, old_idx, new_idx = np.intersect1d(
+            old_times, new_times, assume_unique=False, return_indices=True)
+        old_matched, new_matched = old_heights[old_idx], new_heights[new_idx]
+        common = len(common_times)
+    change = np.abs(new_matched - old_matched)
+    changed = change[change > 0]
+    return dict(rows=len(new_times), changed_rows=int(len(changed)),
+                added_rows=int(len(new_times) - common),
+                removed_rows=int(len(old_times) - common),
+                max_abs_change=round(float(changed.max()), 6) if len(changed) else None,
+                mean_abs_change=round(float(changed.mean()), 6) if len(changed) else None)
+
+
+class Revisions:
+    """SQLite store of reverse deltas and refetch times, safe to share between threads."""
+
+    def __init__(self, path=REVISIONS_PATH):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            SQLite database file, created if missing
+        """
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def checked(self, station, year, interval, when=None):
+        """Record that a station-year was refetched, changed or not."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?)",
+                (str(station), int(year), interval, when or time.time()))
+            self.conn.commit()
+
+    def last_checked(self):
+        """
+        Time of the latest refetch of every station-year that has one.
+
+        Returns
+        -------
+        dict[tuple[str, int, str], float]
+            (station, year, interval) mapped to a `time.time()` value
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT station, year, interval, checked_at FROM checks").fetchall()
+        return {(station, year, interval): checked_at
+                for station, year, interval, checked_at in rows}
+
+    def latest_version(self, station, year, interval):
+        """Version number of the file on disk; 1 until it first changes."""
+        with self.lock:
+            (version,) = self.conn.execute(
+                "SELECT MAX(version) FROM revisions WHERE station = ? AND year = ? "
+                "AND interval = ?", (str(station), int(year), interval)).fetchone()
+        return version or 1
+
+    def record(self, station, year, interval, old_text, new_text):
+        """
+        Store the previous version of a file that has changed.
+
+        Call before the new text replaces the old file.
+
+        Parameters
+        ----------
+        station : str
+            NOAA station ID
+        year : int
+            The 4-digit year
+        interval : str
+            Interval key of the file, "6" or "hilo"
+        old_text, new_text : str
+            The file's current contents and the refetched contents
+
+        Returns
+        -------
+        dict
+            The new version number and the output of `compare`
+        """
+        stats = compare(old_text, new_text)
+        delta = make_delta(new_text, old_text)
+        version = self.latest_version(station, year, interval) + 1
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO revisions VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(station), int(year), interval, version,
+                 hashlib.sha256(new_text.encode()).hexdigest(),
+                 hashlib.sha256(old_text.encode()).hexdigest(), now,
+                 stats["rows"], stats["changed_rows"], stats["added_rows"],
+                 stats["removed_rows"], stats["max_abs_change"], stats["mean_abs_change"],
+                 delta))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?)",
+                (str(station), int(year), interval, now))
+            self.conn.commit()
+        return dict(stats, version=version)
+
+    def restore(self, station, year, interval, text, version):
+        """
+        Rebuild an earlier version of a file.
+
+        Parameters
+        ----------
+        station : str
+            NOAA station ID
+        year : int
+            The 4-digit year
+        interval : str
+            Interval key of the file
+        text : str
+            The latest version, i.e. the file on disk
+        version : int
+            Version to rebuild, from 1
+
+        Returns
+        -------
+        str
+            The file as it was at `version`
+
+        Raises
+        ------
+        ValueError
+            When `text` is not the latest version or a delta does not
+            reproduce its recorded hash
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, sha256, previous_sha256, delta FROM revisions "
+                "WHERE station = ? AND year = ? AND interval = ? AND version > ? "
+                "ORDER BY version DESC", (str(station), int(year), interval, version)
+            ).fetchall()
+        for row_version, sha256, previous_sha256, delta in rows:
+            if hashlib.sha256(text.encode()).hexdigest() != sha256:
+                raise ValueError(f"{station} {year}: text does not match version {row_version}")
+            text = apply_delta(text, delta)
+            if hashlib.sha256(text.encode()).hexdigest() != previous_sha256:
+                raise ValueError(f"{station} {year}: delta for version {row_version} is corrupt")
+        return text
+
+    def changes(self, since=0.0):
+        """
+        Every revision stored since a given time.
+
+        Returns
+        -------
+        list[dict]
+            One dict per revision, without the delta, newest first
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT station, year, interval, version, fetched_at, rows, changed_rows, "
+                "added_rows, removed_rows, max_abs_change, mean_abs_change, LENGTH(delta) "
+                "AS delta_bytes FROM revisions WHERE fetched_at >= ? "
+                "ORDER BY fetched_at DESC", (since,))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def report(revisions, since=0.0, checked=0, path=REPORT_PATH):
+    """
+    Write a JSON change report of the revisions stored since a given time.
+
+    Stations are listed by their largest height change, biggest first.
+
+    Parameters
+    ----------
+    revisions : Revisions
+        Revision store
+    since : float, optional
+        `time.time()` of the start of the refresh run
+    checked : int, optional
+        Number of station-years refetched, for the summary
+    path : str, optional
+        Output file
+
+    Returns
+    -------
+    dict
+        The report that was written
+    """
+    changes = revisions.changes(since)
+    stations = {}
+    for change in changes:
+        entry = stations.setdefault(change["station"], {
+            "station": change["station"], "years": [], "changed_rows": 0,
+            "max_abs_change": None})
+        entry["years"].append(change)
+        entry["changed_rows"] += change["changed_rows"]
+        if change["max_abs_change"] is not None:
+            entry["max_abs_change"] = max(entry["max_abs_change"] or 0.0,
+                                          change["max_abs_change"])
+    ordered = sorted(stations.values(), key=lambda s: -(s["max_abs_change"] or 0.0))
+    result = {"since": since, "checked": checked, "changed_files": len(changes),
+              "changed_stations": len(ordered), "stations": ordered}
+    with open(path, "w") as f:
+        json.dump(result, f, indent=1)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Revisions",
+                    description="Reports on and restores earlier versions of refetched files")
+    parser.add_argument("--revisions", default=REVISIONS_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="write a change report")
+    report_parser.add_argument("--days", type=float, default=30.0,
+                               help="include revisions stored in the last DAYS days")
+    report_parser.add_argument("--output", default=REPORT_PATH)
+    restore_parser = subparsers.add_parser("restore", help="rebuild an earlier version")
+    restore_parser.add_argument("path", help="latest version of the file, in data/")
+    restore_parser.add_argument("station")
+    restore_parser.add_argument("year", type=int)
+    restore_parser.add_argument("version", type=int)
+    restore_parser.add_argument("--interval", default="6", choices=["6", "hilo"])
+    restore_parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    revisions = Revisions(args.revisions)
+    if args.command == "report":
+        result = report(revisions, time.time() - args.days * 86400, path=args.output)
+        print(f"{result['changed_files']} changed files at "
+              f"{result['changed_stations']} stations, see {args.output}")
+    else:
+        with open(args.path, "r", newline="") as f:
+            text = f.read()
+        with open(args.output, "w", newline="") as f:
+            f.write(revisions.restore(args.station, args.year, args.interval, text,
+                                      args.version))
+    revisions.close()
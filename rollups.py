@@ -0,0 +1,331 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from noaa_scrape.noaa_scrape.ingest import parse_response
+from noaa_scrape.noaa_scrape.shards import SHARD_SUFFIX, iter_records
+from store import EPOCH
+
+"""
+Multi-resolution rollups of the water temperature archive.
+
+The build stage streams every station shard written by the watertemp spider
+(`data-watertemp/<station_id>.jsonl.zst`) once and reduces the 6-minute
+observations to hourly, daily and monthly min/max/mean/count. Each level is
+reduced from the one below it, so the raw data is only touched once. The
+result is one memory-mapped file laid out like `store.py`:
+
+    [arrays ...][JSON index][uint64 index offset][MAGIC]
+
+with five contiguous arrays per station and level: uint32 epoch minutes of
+the bin start, float32 min, max and mean, and uint32 count. Bins without
+data are not stored.
+
+`RollupStore.query` picks the finest level that fits a point budget over the
+requested range, so a 35-year plot reads a few hundred monthly bins:
+
+    store = RollupStore()
+    level, data = store.query("9414290", "1990-01-01", "2026-01-01", max_points=2000)
+    plt.fill_between(data["time"], data["min"], data["max"])
+"""
+
+MAGIC = b"NOAARU01"
+DATA_DIR = "noaa_scrape/data-watertemp"
+ROLLUP_PATH = "watertemp-rollups.tsdb"
+# Finest first; "month" bins are calendar months
+LEVELS = ["hour", "day", "month"]
+COLUMNS = {"time": "<u4", "min": "<f4", "max": "<f4", "mean": "<f4", "count": "<u4"}
+
+
+def _epoch_minute(when):
+    return int((np.datetime64(when, "m") - EPOCH).astype(np.int64))
+
+
+def record_series(record):
+    """
+    Observation times and values of one stored response.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray] or None
+        int64 epoch minutes and float64 values, without missing values, or
+        None when the response holds no data (e.g. a saved API error)
+    """
+    if record.get("status", 200) != 200:
+        return None
+    series = parse_response(record["body"])
+    if series is None or not len(series.time):
+        return None
+    present = ~np.isnan(series.value)
+    return (series.time[present].astype(np.int64),
+            series.value[present].astype(np.float64))
+
+
+def read_station(path):
+    """
+    All observations in one station shard, sorted and deduplicated.
+
+    A time that appears in more than one response keeps the value from the
+    response written last.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        int64 epoch minutes and float64 values
+    """
+    times, values = [], []
+    for record in iter_records(path):
+        series = record_series(record)
+        if series is not None:
+            times.append(series[0])
+            values.append(series[1])
+    if not times:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    times, values = np.concatenate(times), np.concatenate(values)
+    # Reverse first so the stable sort puts the latest duplicate first
+    times, values = times[::-1], values[::-1]
+    order = np.argsort(times, kind="stable")
+    times, values = times[order], values[order]
+    keep = np.r_[True, times[1:] != times[:-1]]
+    return times[keep], values[keep]
+
+
+def bin_starts(times, level):
+    """Epoch minute of the start of each time's bin at `level`."""
+    if level == "hour":
+        return times // 60 * 60
+    if level == "day":
+        return times // 1440 * 1440
+    months = times.astype("datetime64[m]").astype("datetime64[M]")
+    return months.astype("datetime64[m]").astype(np.int64)
+
+
+def reduce_bins(bins, mins, maxs, sums, counts):
+    """
+    Merge runs of equal, sorted bin starts.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, ...]
+        Bin starts, mins, maxs, sums and counts, one entry per distinct bin
+    """
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    return (bins[starts], np.minimum.reduceat(mins, starts),
+            np.maximum.reduceat(maxs, starts), np.add.reduceat(sums, starts),
+            np.add.reduceat(counts, starts))
+
+
+def station_rollups(path):
+    """
+    Every rollup level of one station shard.
+
+    Returns
+    -------
+    tuple[str, dict[str, dict[str, numpy.ndarray]]]
+        Station ID and, per level, the arrays in `COLUMNS`; empty when the
+        shard holds no observations
+    """
+    station_id = os.path.basename(path)[:-len(SHARD_SUFFIX)]
+    times, values = read_station(path)
+    if not len(times):
+        return station_id, {}
+    current = (times, values, values, values, np.ones(len(times), dtype=np.int64))
+    levels = {}
+    for level in LEVELS:
+        current = reduce_bins(bin_starts(current[0], level), *current[1:])
+        bins, mins, maxs, sums, counts = current
+        levels[level] = {"time": bins, "min": mins, "max": maxs,
+                         "mean": sums / counts, "count": counts}
+    return station_id, levels
+
+
+def write_rollups(path, stations):
+    """
+    Write a rollup file from (station ID, levels) pairs, one station at a time.
+
+    Parameters
+    ----------
+    path : str
+        Output file
+    stations : iterable[tuple[str, dict]]
+        Output of `station_rollups`
+
+    Returns
+    -------
+    dict[str, dict]
+        The index that was written
+    """
+    index = {}
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        for station_id, levels in stations:
+            if not levels:
+                continue
+            entry = {}
+            for level, arrays in levels.items():
+                entry[level] = {"length": len(arrays["time"])}
+                for column, dtype in COLUMNS.items():
+                    entry[level][column] = f.tell()
+                    f.write(np.ascontiguousarray(arrays[column], dtype=dtype).tobytes())
+            index[station_id] = entry
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.write(struct.pack("<Q", index_offset))
+        f.write(MAGIC)
+    os.replace(tmp_path, path)
+    return index
+
+
+def build(data_dir=DATA_DIR, path=ROLLUP_PATH, workers=None):
+    """
+    Build the rollup file from the watertemp shards, one station per core.
+
+    Returns
+    -------
+    int
+        Number of stations written
+    """
+    paths = sorted(os.path.join(data_dir, filename) for filename in os.listdir(data_dir)
+                   if filename.endswith(SHARD_SUFFIX))
+    with ProcessPoolExecutor(workers) as executor:
+        return len(write_rollups(path, executor.map(station_rollups, paths)))
+
+
+class RollupStore:
+    """
+    Read-only, memory-mapped view of a file written by `write_rollups`.
+
+    Example
+    -------
+        store = RollupStore("watertemp-rollups.tsdb")
+        level, data = store.query("9414290", "1990-01-01", "2026-01-01")
+    """
+
+    def __init__(self, path=ROLLUP_PATH):
+        with open(path, "rb") as f:
+            f.seek(-16, os.SEEK_END)
+            trailer = f.read(16)
+            if trailer[8:] != MAGIC:
+                raise ValueError(f"{path} is not a rollup file")
+            index_offset = struct.unpack("<Q", trailer[:8])[0]
+            f.seek(index_offset)
+            self.index = json.loads(f.read(os.path.getsize(path) - 16 - index_offset))
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def stations(self):
+        """IDs of every station in the file."""
+        return list(self.index)
+
+    def _column(self, entry, column):
+        offset = entry[column]
+        dtype = np.dtype(COLUMNS[column])
+        return self.data[offset:offset + dtype.itemsize * entry["length"]].view(dtype)
+
+    def _bounds(self, entry, start, end):
+        times = self._column(entry, "time")
+        lo, hi = 0, entry["length"]
+        if start is not None:
+            lo = int(np.searchsorted(times, min(max(_epoch_minute(start), 0), 2**32 - 1)))
+        if end is not None:
+            hi = int(np.searchsorted(times, min(max(_epoch_minute(end), 0), 2**32 - 1)))
+        return lo, hi
+
+    def level(self, station_id, level, start=None, end=None):
+        """
+        One level's bins for a station and time range, as views into the file.
+
+        Parameters
+        ----------
+        station_id : str
+            NOAA station ID
+        level : str
+            One of `LEVELS`
+        start : str or numpy.datetime64, optional
+            Bins starting at or after this time; defaults to the first bin
+        end : str or numpy.datetime64, optional
+            Bins starting before this time; defaults to the last bin
+
+        Returns
+        -------
+        dict[str, numpy.ndarray]
+            "time" (uint32 epoch minutes of the bin start), "min", "max",
+            "mean" (float32) and "count" (uint32)
+
+        Raises
+        ------
+        KeyError
+            When the station is not in the file
+        """
+        entry = self.index[str(station_id)][level]
+        lo, hi = self._bounds(entry, start, end)
+        return {column: self._column(entry, column)[lo:hi] for column in COLUMNS}
+
+    def choose_level(self, station_id, start=None, end=None, max_points=2000):
+        """
+        The finest level with at most `max_points` bins in the range.
+
+        Falls back to the coarsest level when none fits.
+        """
+        entries = self.index[str(station_id)]
+        for level in LEVELS:
+            lo, hi = self._bounds(entries[level], start, end)
+            if hi - lo <= max_points:
+                return level
+        return LEVELS[-1]
+
+    def query(self, station_id, start=None, end=None, max_points=2000):
+        """
+        Bins for a station and time range at the finest level that fits.
+
+        Parameters
+        ----------
+        station_id : str
+            NOAA station ID
+        start, end : str or numpy.datetime64, optional
+            Time range, see `level`
+        max_points : int, optional
+            Most bins wanted, e.g. the plot width in pixels
+
+        Returns
+        -------
+        tuple[str, dict[str, numpy.ndarray]]
+            The level chosen and its bins, see `level`
+        """
+        level = self.choose_level(station_id, start, end, max_points)
+        return level, self.level(station_id, level, start, end)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Rollups",
+                    description="Builds and queries hourly/daily/monthly water temperature rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build the rollup file from the shards")
+    build_parser.add_argument("--data-dir", default=DATA_DIR)
+    build_parser.add_argument("--output", default=ROLLUP_PATH)
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    query_parser = subparsers.add_parser("query", help="print the bins chosen for a range")
+    query_parser.add_argument("station_id")
+    query_parser.add_argument("--start")
+    query_parser.add_argument("--end")
+    query_parser.add_argument("--max-points", type=int, default=2000)
+    query_parser.add_argument("--path", default=ROLLUP_PATH)
+    args = parser.parse_args()
+    if args.command == "build":
+        started = time.monotonic()
+        count = build(args.data_dir, args.output, args.workers)
+        print(f"Wrote {count} stations to {args.output} in {time.monotonic() - started:.1f} s")
+    else:
+        started = time.perf_counter()
+        level, data = RollupStore(args.path).query(args.station_id, args.start, args.end,
+                                                   args.max_points)
+        elapsed = time.perf_counter() - started
+        print(f"{len(data['time'])} {level} bins in {elapsed * 1000:.2f} ms")
+        for i in range(len(data["time"])):
+            print(np.datetime64(int(data["time"][i]), "m"), data["min"][i], data["max"][i],
+                  f"{data['mean'][i]:.2f}", data["count"][i], sep="\t")
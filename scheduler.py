@@ -0,0 +1,432 @@
+import datetime
+import json
+import sqlite3
+import time
+
+"""
+Persistent crawl queue for `scrape.py`.
+
+Every station-year task is a row with a status (pending, in-flight, done or
+failed), an attempt count, the earliest time it may be retried and a
+priority. The queue lives in SQLite, so a crawl that runs out of time or
+crashes resumes exactly where it left off without re-planning: tasks left
+in-flight by a crash go back to pending on the next start.
+
+Failed fetches are retried with exponential backoff until `MAX_ATTEMPTS`,
+after which they stay failed until the crawl is re-planned.
+
+`SharedQueue` is the same queue for many processes on many hosts sharing
+one database file (see `shard_crawl.py`). Tasks are leased to a named
+worker for a limited time that the worker extends with heartbeats; leases
+of a worker that stops heartbeating expire and the tasks go back to
+pending. Every state change runs in a `BEGIN IMMEDIATE` transaction, so
+the database file lock serializes workers, and a result is committed
+together with the task's status: whichever worker commits a task first
+writes its output, later commits of the same task are discarded.
+"""
+
+SCHEDULE_PATH = "schedule.sqlite"
+SHARED_SCHEDULE_PATH = "shared-schedule.sqlite"
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30.0
+BACKOFF_MAX = 3600.0
+
+PENDING = "pending"
+IN_FLIGHT = "in-flight"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    station TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    stn TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    priority REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    UNIQUE (station, year)
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, priority, next_attempt);
+"""
+
+SHARED_COLUMNS = [
+    ("owner", "TEXT"),
+    ("lease_expires", "REAL"),
+    ("output", "TEXT"),
+    ("size", "INTEGER"),
+    ("sha256", "TEXT"),
+    ("finished_at", "REAL"),
+]
+LEASE_SECONDS = 120.0
+
+
+def nearest_year_priority(year, coverage):
+    """Fetch the years closest to the current one first."""
+    return abs(year - datetime.date.today().year)
+
+
+def least_coverage_priority(year, coverage):
+    """Fetch regions with the smallest fraction already downloaded first."""
+    return coverage
+
+
+def fifo_priority(year, coverage):
+    """Fetch in the order tasks were planned."""
+    return 0
+
+
+PRIORITY_POLICIES = {
+    "nearest-year": nearest_year_priority,
+    "least-coverage": least_coverage_priority,
+    "fifo": fifo_priority,
+}
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a task that has failed `attempts` times."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+class TaskTable:
+    """Queries of the task table shared by `Scheduler` and `SharedQueue`."""
+
+    def close(self):
+        self.conn.close()
+
+    def has_tasks(self):
+        """Whether a crawl has been planned into this queue."""
+        return self.conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is not None
+
+    def counts(self):
+        """Number of tasks in each status."""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"))
+
+    def failed(self):
+        """
+        Tasks that have used up their attempts.
+
+        Returns
+        -------
+        list[tuple[dict, int, str]]
+            Station definition, year and last error of each failed task
+        """
+        rows = self.conn.execute(
+            "SELECT stn, year, last_error FROM tasks WHERE status = ? ORDER BY id", (FAILED,))
+        return [(json.loads(stn), year, error) for stn, year, error in rows]
+
+
+class Scheduler(TaskTable):
+    """SQLite-backed task queue with retry and priority handling."""
+
+    def __init__(self, path=SCHEDULE_PATH, policy="nearest-year"):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            SQLite database file, created if missing
+        policy : str, optional
+            Key of `PRIORITY_POLICIES` used for newly planned tasks
+        """
+        self.priority = PRIORITY_POLICIES[policy]
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        # Anything in flight when the last run stopped never finished.
+        self.conn.execute("UPDATE tasks SET status = ? WHERE status = ?", (PENDING, IN_FLIGHT))
+        self.conn.commit()
+
+    def add(self, fetches, coverage=0.0):
+        """
+        Queue station-year tasks, resetting any that already exist.
+
+        Parameters
+        ----------
+        fetches : list[tuple[dict, int]]
+            (station definition, year) pairs still to be fetched
+        coverage : float, optional
+            Fraction of the tasks' region already downloaded, for the
+            "least-coverage" policy
+        """
+        rows = [(str(stn["stationId"]), year, json.dumps(stn), PENDING,
+                 self.priority(year, coverage)) for stn, year in fetches]
+        self.conn.executemany(
+            "INSERT INTO tasks (station, year, stn, status, priority) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (station, year) DO UPDATE SET stn = excluded.stn, "
+            "status = excluded.status, priority = excluded.priority, attempts = 0, "
+            "next_attempt = 0, last_error = NULL", rows)
+        self.conn.commit()
+
+    def lease(self):
+        """
+        Take the highest-priority task that is ready to run.
+
+        Returns
+        -------
+        tuple[int, dict, int] or None
+            Task ID, station definition and year, or None when no task is
+            ready right now
+        """
+        row = self.conn.execute(
+            "SELECT id, stn, year FROM tasks WHERE status = ? AND next_attempt <= ? "
+            "ORDER BY priority, id LIMIT 1", (PENDING, time.time())).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE tasks SET status = ? WHERE id = ?", (IN_FLIGHT, row[0]))
+        self.conn.commit()
+        return row[0], json.loads(row[1]), row[2]
+
+    def complete(self, task_id):
+        """Mark a task as done."""
+        self.conn.execute("UPDATE tasks SET status = ? WHERE id = ?", (DONE, task_id))
+        self.conn.commit()
+
+    def fail(self, task_id, error=None):
+        """
+        Record a failed attempt and schedule a retry, or give up.
+
+        Returns
+        -------
+        str
+            The task's new status, `PENDING` or `FAILED`
+        """
+        (attempts,) = self.conn.execute(
+            "SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        attempts += 1
+        status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+        self.conn.execute(
+            "UPDATE tasks SET status = ?, attempts = ?, next_attempt = ?, last_error = ? "
+            "WHERE id = ?",
+            (status, attempts, time.time() + backoff(attempts), error, task_id))
+        self.conn.commit()
+        return status
+
+    def next_ready_in(self):
+        """
+        Seconds until the next pending task becomes ready.
+
+        Returns
+        -------
+        float or None
+            0 when a task is ready now, None when nothing is pending
+        """
+        (next_attempt,) = self.conn.execute(
+            "SELECT MIN(next_attempt) FROM tasks WHERE status = ?", (PENDING,)).fetchone()
+        if next_attempt is None:
+            return None
+        return max(next_attempt - time.time(), 0.0)
+
+
+class SharedQueue(TaskTable):
+    """
+    Task queue shared by many worker processes, with leases and heartbeats.
+
+    It keeps the `Scheduler` table and retry rules, but tasks are leased to a
+    named worker and finished with `commit`, so it is not a drop-in
+    `Scheduler` for `scrape.crawl`; `scrape.plan_regions` only needs `add`.
+
+    The database file can live on a shared filesystem as long as it supports
+    POSIX file locks; it is opened in the default rollback-journal mode
+    because WAL does not work across hosts.
+    """
+
+    def __init__(self, path=SHARED_SCHEDULE_PATH, policy="nearest-year",
+                 lease_seconds=LEASE_SECONDS):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            SQLite database file, created if missing
+        policy : str, optional
+            Key of `PRIORITY_POLICIES` used for newly planned tasks
+        lease_seconds : float, optional
+            How long a lease lasts without a heartbeat
+        """
+        self.priority = PRIORITY_POLICIES[policy]
+        self.lease_seconds = lease_seconds
+        self.conn = sqlite3.connect(path, timeout=300)
+        self.conn.execute("PRAGMA busy_timeout = 300000")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+        for name, kind in SHARED_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE tasks ADD COLUMN {name} {kind}")
+        self.conn.commit()
+
+    def add(self, fetches, coverage=0.0):
+        """
+        Queue station-year tasks, see `Scheduler.add`. Tasks that are done or
+        leased are left alone, so planning again is safe while workers run.
+        """
+        rows = [(str(stn["stationId"]), year, json.dumps(stn), PENDING,
+                 self.priority(year, coverage)) for stn, year in fetches]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT INTO tasks (station, year, stn, status, priority) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (station, year) DO UPDATE SET stn = excluded.stn, "
+                "status = excluded.status, priority = excluded.priority, attempts = 0, "
+                "next_attempt = 0, last_error = NULL WHERE status NOT IN (?, ?)",
+                [row + (DONE, IN_FLIGHT) for row in rows])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+
+    def _expire(self, now):
+        self.conn.execute(
+            "UPDATE tasks SET status = ?, last_error = 'lease of ' || owner || ' expired', "
+            "owner = NULL, lease_expires = NULL WHERE status = ? AND lease_expires < ?",
+            (PENDING, IN_FLIGHT, now))
+
+    def lease(self, owner, count=1):
+        """
+        Take up to `count` of the highest-priority tasks that are ready to run.
+
+        Leases that have expired are returned to pending first.
+
+        Parameters
+        ----------
+        owner : str
+            Worker name, unique across hosts
+        count : int, optional
+            Most tasks to lease at once
+
+        Returns
+        -------
+        list[tuple[int, dict, int]]
+            Task ID, station definition and year of each leased task; empty
+            when no task is ready right now
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._expire(now)
+            rows = self.conn.execute(
+                "SELECT id, stn, year FROM tasks WHERE status = ? AND next_attempt <= ? "
+                "ORDER BY priority, id LIMIT ?", (PENDING, now, count)).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET status = ?, owner = ?, lease_expires = ? WHERE id = ?",
+                [(IN_FLIGHT, owner, now + self.lease_seconds, row[0]) for row in rows])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return [(task_id, json.loads(stn), year) for task_id, stn, year in rows]
+
+    def heartbeat(self, owner):
+        """
+        Extend every lease `owner` still holds.
+
+        Returns
+        -------
+        int
+            Number of leases extended
+        """
+        cursor = self.conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE owner = ? AND status = ?",
+            (time.time() + self.lease_seconds, owner, IN_FLIGHT))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def commit(self, task_id, owner, write):
+        """
+        Write a task's output and mark it done, unless it is done already.
+
+        Parameters
+        ----------
+        task_id : int
+            Task to complete
+        owner : str
+            Worker completing it; its lease may have expired meanwhile
+        write : callable
+            Writes the output, atomically, and returns (path, size, sha256);
+            called with the queue locked and only if no other worker has
+            committed the task
+
+        Returns
+        -------
+        bool
+            Whether this worker's output was kept
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            (status,) = self.conn.execute(
+                "SELECT status FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if status == DONE:
+                self.conn.rollback()
+                return False
+            path, size, sha256 = write()
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, owner = ?, lease_expires = NULL, output = ?, "
+                "size = ?, sha256 = ?, finished_at = ? WHERE id = ?",
+                (DONE, owner, path, size, sha256, time.time(), task_id))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return True
+
+    def fail(self, task_id, error=None, owner=None):
+        """
+        Record a failed attempt, if `owner` still holds the task's lease.
+
+        Returns
+        -------
+        str or None
+            The task's new status, `PENDING` or `FAILED`, or None when the
+            lease had already passed to another worker or the task was done
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT attempts FROM tasks WHERE id = ? AND status = ? AND owner IS ?",
+                (task_id, IN_FLIGHT, owner)).fetchone()
+            if row is None:
+                self.conn.rollback()
+                return None
+            attempts = row[0] + 1
+            status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, "
+                "owner = NULL, lease_expires = NULL WHERE id = ?",
+                (status, attempts, time.time() + backoff(attempts), error, task_id))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return status
+
+    def release(self, owner):
+        """Return every task `owner` holds to pending, e.g. on shutdown."""
+        self.conn.execute(
+            "UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL "
+            "WHERE owner = ? AND status = ?", (PENDING, owner, IN_FLIGHT))
+        self.conn.commit()
+
+    def next_ready_in(self):
+        """
+        Seconds until a task may become ready: the next retry of a pending
+        task or the expiry of another worker's lease.
+
+        Returns
+        -------
+        float or None
+            0 when a task is ready now, None when nothing is pending or
+            in flight
+        """
+        (next_attempt, lease_expires) = self.conn.execute(
+            "SELECT MIN(CASE WHEN status = ? THEN next_attempt END), "
+            "MIN(CASE WHEN status = ? THEN lease_expires END) FROM tasks",
+            (PENDING, IN_FLIGHT)).fetchone()
+        times = [t for t in (next_attempt, lease_expires) if t is not None]
+        if not times:
+            return None
+        return max(min(times) - time.time(), 0.0)
+
+    def owners(self):
+        """Workers holding leases, with their lease count and latest expiry."""
+        return {owner: (count, expires) for owner, count, expires in self.conn.execute(
+            "SELECT owner, COUNT(*), MAX(lease_expires) FROM tasks WHERE status = ? "
+            "GROUP BY owner", (IN_FLIGHT,))}
@@ -1,12 +1,21 @@
-import glob
+import argparse
+import asyncio
+import collections
 import itertools
 import json
-from multiprocessing import Pool
 import os
-import sys
-import requests
 import time
 
+from catalog import CATALOG_MAX_AGE, region_lists
+from fetch import API_ROOT, AsyncFetcher
+from manifest import MANIFEST_PATH, Manifest, rebuild
+from noaa_scrape.noaa_scrape import profiling
+from noaa_scrape.noaa_scrape.metrics import Metrics, Reporter, serve_prometheus
+from noaa_scrape.noaa_scrape.response_cache import ResponseCache, cached_get
+from noaa_scrape.noaa_scrape.station_catalog import region_station_lists
+from revisions import REVISIONS_PATH, Revisions, parse_predictions, report
+from scheduler import FAILED, IN_FLIGHT, PENDING, PRIORITY_POLICIES, SCHEDULE_PATH, Scheduler
+
 """
 Downloading .csv files with tide predictions has the format below. Default
 interval seems to be 6 minutes for harmonic stations. Have tested a
@@ -26,6 +35,12 @@ TIDE_PREDICTION_URL = ("https://api.tidesandcurrents.noaa.gov/api/prod/datagette
                   "product=predictions&datum=MLLW&time_zone=lst_ldt&"
                   "units=english&format=csv")
 
+PRODUCT = "predictions"
+DATUM = "MLLW"
+
+REGION_STATIONS_URL = ("https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/"
+                       "geogroups/{region_id}/children.json")
+
 SL_RISE_PROJECTION_URL = (
     "https://api.tidesandcurrents.noaa.gov/dpapi/prod/webapi/product/"
     "slr_projections.json?units=english&station={stnid}&report_year={year}"
@@ -94,10 +109,29 @@ def get_region_stations(region_id, station_type="harmonic"):
     list[dict]
         List of station definitions from the NOAA API
     """
-    response = requests.get(f"https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/geogroups/{region_id}/children.json")
+    response = cached_get(REGION_STATIONS_URL.format(region_id=region_id))
     if response.status_code != 200:
         raise Exception(f"Response code {response.status_code}")
-    data = response.json()["stationList"]
+    return filter_stations(response.json()["stationList"], station_type)
+
+
+def filter_stations(data, station_type="harmonic"):
+    """
+    Limit a region's station list to the requested station type.
+
+    Parameters
+    ----------
+    data : list[dict]
+        The `stationList` of a geogroup children.json response
+    station_type : {"harmonic", "subordinate", "both"}, optional
+        Whether to keep only harmonic stations, only subordinate stations, or
+        both. Defaults to "harmonic".
+
+    Returns
+    -------
+    list[dict]
+        The matching station definitions
+    """
     if station_type == "harmonic":
         data = [i for i in data if i["stationType"] == "R"]
     elif station_type == "subordinate":
@@ -107,7 +141,7 @@ def get_region_stations(region_id, station_type="harmonic"):
     return data
 
 
-def get_year_data(stn, year, progress=True):
+def get_year_data(stn, year, progress=True, manifest=None):
     """
     Fetch a single year of data for a single station.
 
@@ -119,6 +153,8 @@ def get_year_data(stn, year, progress=True):
         The 4-digit year
     progress : bool, optional
         Whether or not to print a statement describing the fetch, by default True
+    manifest : manifest.Manifest, optional
+        Index to record the saved file in
 
     Returns
     -------
@@ -130,87 +166,527 @@ def get_year_data(stn, year, progress=True):
     IndexError
         When the station name cannot be determined from the server response
     """
-    stn_id = stn["stationId"]
-    stn_name = stn["geoGroupName"]
-    filename = f"{year} {stn_name} {stn_id} Tidal Data.csv"
-    filename = filename.replace("/", "---")
+    filename = year_data_filename(stn, year)
     if progress:
-        print(f"Working on {stn_id} for {year}")
-    begin_date = f"{year}0101"
-    end_date = f"{year}1231"
-    url = TIDE_PREDICTION_URL.format(stnid=stn_id, begin_date=begin_date, end_date=end_date)
-    if stn["stationType"] == "S":
-        url += "&interval=hilo"
-    response = requests.get(url)
+        print(f"Working on {stn['stationId']} for {year}")
+    response = cached_get(year_data_url(stn, year))
     if response.status_code != 200:
         print(f"Response text {response.text}")
         return None, filename
-    folder_path = os.path.join("data", stn["state"])
-    path = os.path.join(folder_path, filename)
-    if not os.path.exists(path):
-        with open(path, "w") as f:
-            f.write(response.text)
+    save_year_data(stn, year, filename, response.text, manifest)
     return response.text, filename
 
 
-def skip(stn_id, state, year):
+def year_data_filename(stn, year):
+    """
+    Name of the file holding a single year of data for a single station.
+
+    Parameters
+    ----------
+    stn : dict
+        Station definition from the NOAA API
+    year : int
+        The 4-digit year
+
+    Returns
+    -------
+    str
+        The filename, relative to the station's region folder
+    """
+    filename = f"{year} {stn['geoGroupName']} {stn['stationId']} Tidal Data.csv"
+    return filename.replace("/", "---")
+
+
+def year_data_url(stn, year):
+    """
+    API URL for a single year of predictions for a single station.
+
+    Parameters
+    ----------
+    stn : dict
+        Station definition from the NOAA API
+    year : int
+        The 4-digit year
+
+    Returns
+    -------
+    str
+        The datagetter URL; subordinate stations request hilo data
+    """
+    url = TIDE_PREDICTION_URL.format(
+        stnid=stn["stationId"], begin_date=f"{year}0101", end_date=f"{year}1231")
+    if stn["stationType"] == "S":
+        url += "&interval=hilo"
+    return url
+
+
+def year_data_interval(stn):
+    """Interval key of a station's predictions: "hilo" for subordinates, else "6"."""
+    return "hilo" if stn["stationType"] == "S" else "6"
+
+
+def save_year_data(stn, year, filename, text, manifest=None):
+    """
+    Write fetched data into the station's region folder and record it.
+
+    The file is written under a temporary name and moved into place, so an
+    interrupted write never leaves a truncated file under the final name.
+
+    Parameters
+    ----------
+    stn : dict
+        Station definition from the NOAA API, including "state"
+    year : int
+        The 4-digit year
+    filename : str
+        Output of `year_data_filename`
+    text : str
+        The fetched data
+    manifest : manifest.Manifest, optional
+        Index to record the file in
+    """
+    path = os.path.join("data", stn["state"], filename)
+    tmp_path = path + ".part"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    if manifest is not None:
+        manifest.record(stn["stationId"], year, PRODUCT, DATUM,
+                        year_data_interval(stn), path)
+
+
+def skip(stn, year, done):
     """
     Determines whether a fetch can be skipped because data corresponding to the
-    given station, year, and month already exists.
+    given station and year already exists intact.
 
     Parameters
     ----------
-    stn_id : int
-        NOAA station ID
-    state : str
-        2-letter state abbreviation
+    stn : dict
+        Station definition from the NOAA API
     year : int
         The 4-digit year
+    done : set[tuple[str, int, str]]
+        Output of `Manifest.completed` for this product and datum
 
     Returns
     -------
     bool
         Whether the fetch can be skipped
     """
-    return len(
-        glob.glob(
-            os.path.join(
-                "data",
-                state,
-                f"{year}*{stn_id}*.csv"
-            )
-        )
-    ) > 0
+    return (str(stn["stationId"]), year, year_data_interval(stn)) in done
 
 
-if __name__ == "__main__":
-    t_end = None
-    if len(sys.argv) > 1:
-        t0 = time.time()
-        t_end = float(sys.argv[1])*3600 + t0
-    region_ids = TIDE_PREDICTION_REGION_IDS
-    failed = []
-    for region_id, state in region_ids:
-        folder_path = os.path.join("data", state)
-        if not os.path.exists(folder_path):
-            os.mkdir(folder_path)
-        stns = get_region_stations(region_id, station_type="both")
+def load_region_stations(data_dir="data", catalog_path=None):
+    """
+    Station definitions saved by earlier crawls, by station ID.
+
+    Parameters
+    ----------
+    data_dir : str, optional
+        Directory with one stations.json per region
+    catalog_path : str, optional
+        Saved station catalog to read the region lists from instead, when it
+        has them (see `station_catalog.region_station_lists`)
+
+    Returns
+    -------
+    dict[str, dict]
+        Station ID mapped to its definition from the region's stations.json,
+        including "state"
+    """
+    stations = {}
+    for stns in region_station_lists(data_dir, catalog_path).values():
         for stn in stns:
-            stn["state"] = state
-        with open(os.path.join(folder_path, "stations.json"), "w") as f:
-            f.write(json.dumps(stns))
+            stations[str(stn["stationId"])] = stn
+    return stations
+
+
+def due_for_refresh(manifest, revisions, stations, max_age, limit=None):
+    """
+    Station-years whose latest fetch or refetch is older than `max_age`.
+
+    Parameters
+    ----------
+    manifest : manifest.Manifest
+        Index of fetched files
+    revisions : revisions.Revisions
+        Refetch history
+    stations : dict[str, dict]
+        Output of `load_region_stations`
+    max_age : float
+        Seconds after which a file is fetched again
+    limit : int, optional
+        Maximum number of station-years to return
+
+    Returns
+    -------
+    list[tuple[dict, int, str]]
+        Station definition, year and file path, least recently checked first
+    """
+    checked = revisions.last_checked()
+    cutoff = time.time() - max_age
+    due = []
+    for entry in manifest.entries(PRODUCT, DATUM):
+        key = (entry["station"], entry["year"], entry["interval"])
+        last = checked.get(key, entry["fetched_at"])
+        if last < cutoff and entry["station"] in stations:
+            due.append((last, stations[entry["station"]], entry["year"], entry["path"]))
+    due.sort(key=lambda d: d[0])
+    return [(stn, year, path) for _, stn, year, path in due[:limit]]
+
+
+def _refresh_file(stn, year, path, text, revisions, manifest):
+    """Compare a refetch with the file on disk and keep the old version if it changed."""
+    interval = year_data_interval(stn)
+    try:
+        with open(path, "r", newline="") as f:
+            old_text = f.read()
+    except OSError:
+        old_text = None
+    if old_text == text:
+        revisions.checked(stn["stationId"], year, interval)
+        return None
+    change = None
+    if old_text is not None:
+        change = revisions.record(stn["stationId"], year, interval, old_text, text)
+    else:
+        revisions.checked(stn["stationId"], year, interval)
+    save_year_data(stn, year, year_data_filename(stn, year), text, manifest)
+    return change
+
+
+async def refresh(fetcher, manifest, revisions, due, t_end=None, progress=True):
+    """
+    Fetch station-years again and keep every version that changed.
+
+    Unchanged payloads only update the check time. Changed ones replace the
+    file in `data/`, and the previous version is stored as a reverse delta
+    in `revisions`.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher; its concurrency sets the number of workers
+    manifest : manifest.Manifest
+        Index that replaced files are recorded in
+    revisions : revisions.Revisions
+        Revision store
+    due : list[tuple[dict, int, str]]
+        Output of `due_for_refresh`
+    t_end : float, optional
+        `time.time()` after which no new fetches are started
+    progress : bool, optional
+        Whether or not to print a line per changed file, by default True
+
+    Returns
+    -------
+    tuple[int, list[str]]
+        Number of station-years refetched and the filenames that failed
+    """
+    queue = collections.deque(due)
+    checked, failed = 0, []
+
+    async def work():
+        nonlocal checked
+        while queue and (t_end is None or time.time() < t_end):
+            stn, year, path = queue.popleft()
+            status, text = await fetcher.get(year_data_url(stn, year), revalidate=True)
+            if status != 200 or parse_predictions(text) is None:
+                failed.append(year_data_filename(stn, year))
+                continue
+            change = await asyncio.to_thread(
+                _refresh_file, stn, year, path, text, revisions, manifest)
+            checked += 1
+            if change is not None and progress:
+                print(f"{stn['stationId']} {year} changed: {change['changed_rows']} rows, "
+                      f"max {change['max_abs_change']}")
+
+    await asyncio.gather(*(work() for _ in range(fetcher.concurrency)))
+    return checked, failed
+
+
+async def get_region_stations_async(fetcher, region_id, station_type="harmonic"):
+    """
+    Fetch a list of stations for a given region over a shared connection pool.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher
+    region_id : int
+        NOAA region ID
+    station_type : {"harmonic", "subordinate", "both"}, optional
+        Passed to `filter_stations`. Defaults to "harmonic".
+
+    Returns
+    -------
+    list[dict]
+        List of station definitions from the NOAA API
+    """
+    status, text = await fetcher.get(REGION_STATIONS_URL.format(region_id=region_id))
+    if status != 200:
+        raise Exception(f"Response code {status}")
+    return filter_stations(json.loads(text)["stationList"], station_type)
+
+
+async def get_year_data_async(fetcher, stn, year, progress=True, manifest=None):
+    """
+    Fetch a single year of data for a single station over a shared connection
+    pool. See `get_year_data`.
+
+    Returns
+    -------
+    tuple[str, str]
+        The text (data) of the fetch, or None on failure, and the filename
+    """
+    filename = year_data_filename(stn, year)
+    if progress:
+        print(f"Working on {stn['stationId']} for {year}")
+    status, text = await fetcher.get(year_data_url(stn, year))
+    if status != 200:
+        print(f"Response text {text}")
+        return None, filename
+    await asyncio.to_thread(save_year_data, stn, year, filename, text, manifest)
+    return text, filename
+
+
+def save_region_stations(state, stns, data_dir="data"):
+    """
+    Write a region's stations.json, unless it already holds `stns`.
+
+    Returns
+    -------
+    bool
+        Whether the file was written
+    """
+    folder_path = os.path.join(data_dir, state)
+    os.makedirs(folder_path, exist_ok=True)
+    path = os.path.join(folder_path, "stations.json")
+    text = json.dumps(stns)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if f.read() == text:
+                return False
+    with open(path, "w") as f:
+        f.write(text)
+    return True
+
+
+async def plan_regions(fetcher, region_ids, years, manifest, scheduler,
+                       max_age=CATALOG_MAX_AGE):
+    """
+    Queue every station-year of every region that is not already fetched.
+
+    Region station lists come from the station catalog (see
+    `catalog.region_lists`): a fresh catalog answers without any requests,
+    a stale one is replaced by fetching every list concurrently once.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher
+    region_ids : list[tuple[int, str]]
+        (NOAA region ID, folder name) pairs, see `TIDE_PREDICTION_REGION_IDS`
+    years : iterable[int]
+        The 4-digit years to fetch
+    manifest : manifest.Manifest
+        Index of already fetched files
+    scheduler : scheduler.Scheduler or scheduler.SharedQueue
+        Queue to add the tasks to
+    max_age : float, optional
+        Seconds a saved catalog is used for; 0 fetches the lists again
+    """
+    years = list(years)
+    with profiling.stage("scrape.manifest") as record:
+        done = manifest.completed(PRODUCT, DATUM)
+        record.units = len(done)
+    stations = await region_lists(fetcher, region_ids, max_age=max_age)
+    for _, state in region_ids:
+        stns = stations[state]
+        save_region_stations(state, stns)
+        fetches = list(itertools.product(stns, years))
+        with profiling.stage("scrape.skip", units=len(fetches)):
+            todo = [(stn, year) for stn, year in fetches if not skip(stn, year, done)]
+        coverage = 1 - len(todo) / len(fetches) if fetches else 1.0
+        scheduler.add(todo, coverage)
+
+
+async def crawl(fetcher, scheduler, manifest, planning=None, t_end=None, progress=True,
+                metrics=None):
+    """
+    Work through the scheduler's queue until it is empty or time runs out.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher; its concurrency sets the number of workers
+    scheduler : scheduler.Scheduler
+        Persistent task queue
+    manifest : manifest.Manifest
+        Index that new files are recorded in
+    planning : asyncio.Task, optional
+        Still-running `plan_regions`; workers wait for it before deciding
+        the queue is empty
+    t_end : float, optional
+        `time.time()` after which no new fetches are started
+    progress : bool, optional
+        Whether or not to print a statement per fetch, by default True
+    metrics : metrics.Metrics, optional
+        Where to record finished tasks and retries
+    """
+
+    def out_of_time():
+        return t_end is not None and time.time() >= t_end
+
+    async def work():
+        while not out_of_time():
+            task = scheduler.lease()
+            if task is None:
+                wait = scheduler.next_ready_in()
+                if wait is None and (planning is None or planning.done()):
+                    return
+                if t_end is not None:
+                    wait = min(wait if wait is not None else 1.0, t_end - time.time())
+                await asyncio.sleep(min(wait if wait is not None else 0.1, 5.0))
+                continue
+            task_id, stn, year = task
+            try:
+                data, filename = await get_year_data_async(
+                    fetcher, stn, year, progress, manifest)
+                error = None if data is not None else f"{filename} failed"
+            except Exception as e:
+                error = repr(e)
+            if error is None:
+                scheduler.complete(task_id)
+                if metrics is not None:
+                    metrics.task_done()
+                continue
+            status = scheduler.fail(task_id, error)
+            if metrics is None:
+                continue
+            if status == FAILED:
+                metrics.task_done(ok=False)
+            else:
+                metrics.retried(year_data_url(stn, year))
+
+    await asyncio.gather(*(work() for _ in range(fetcher.concurrency)))
+    if planning is not None:
+        await planning
+
+
+async def report_progress(scheduler, metrics, reporter, interval=10.0):
+    """Update the queue gauges from the scheduler and report, every `interval` seconds."""
+    while True:
+        counts = scheduler.counts()
+        metrics.set_queue(counts.get(PENDING, 0), counts.get(IN_FLIGHT, 0))
+        reporter.tick()
+        await asyncio.sleep(interval)
+
+
+async def main(args, t_end=None):
+    if not os.path.exists("data"):
+        os.mkdir("data")
+    new_manifest = not os.path.exists(MANIFEST_PATH)
+    manifest = Manifest(MANIFEST_PATH)
+    if new_manifest:
+        print(f"Indexed {rebuild(manifest)} existing files")
+    cache = None if args.no_cache else ResponseCache()
+    if args.refresh is not None:
+        return await main_refresh(args, manifest, cache, t_end)
+    scheduler = Scheduler(SCHEDULE_PATH, policy=args.policy)
+    metrics = Metrics()
+    reporter = Reporter(metrics, args.metrics, progress=not args.verbose)
+    prometheus = None
+    if args.metrics_port:
+        prometheus = serve_prometheus(metrics, args.metrics_port)
+    reporting = asyncio.create_task(
+        report_progress(scheduler, metrics, reporter, args.metrics_interval))
+    async with AsyncFetcher(concurrency=args.concurrency, rate=args.rate,
+                            api_root=args.api_root, cache=cache, metrics=metrics) as fetcher:
         start_year = 2025
         end_year = 2029 # inclusive
-        years = range(start_year, end_year + 1)
-        fetches = itertools.product(stns, years)
-        fetches = [(stn, year) for stn, year in fetches if not skip(
-            stn["stationId"], stn["state"], year)]
-        with Pool(4) as p:
-            results = p.starmap(get_year_data, fetches)
-        for data, filename in results:
-            if data is None:
-                failed.append(filename)
+        planning = None
+        if args.replan or not scheduler.has_tasks():
+            planning = asyncio.create_task(plan_regions(
+                fetcher, TIDE_PREDICTION_REGION_IDS, range(start_year, end_year + 1),
+                manifest, scheduler, max_age=0 if args.replan else CATALOG_MAX_AGE))
+        else:
+            print("Resuming planned crawl")
+        await crawl(fetcher, scheduler, manifest, planning, t_end, args.verbose, metrics)
+        reporting.cancel()
+        counts = scheduler.counts()
+        metrics.set_queue(counts.get(PENDING, 0), counts.get(IN_FLIGHT, 0))
+        reporter.close()
+        if prometheus is not None:
+            prometheus.shutdown()
+        print(fetcher.summary())
+    print(scheduler.counts())
+    failed = [year_data_filename(stn, year) for stn, year, _ in scheduler.failed()]
+    scheduler.close()
+    manifest.close()
+    return failed
+
+
+async def main_refresh(args, manifest, cache, t_end=None):
+    revisions = Revisions(REVISIONS_PATH)
+    due = due_for_refresh(manifest, revisions, load_region_stations(),
+                          args.refresh * 86400, args.refresh_limit)
+    print(f"Refetching {len(due)} station-years")
+    started = time.time()
+    async with AsyncFetcher(concurrency=args.concurrency, rate=args.rate,
+                            api_root=args.api_root, cache=cache) as fetcher:
+        checked, failed = await refresh(fetcher, manifest, revisions, due, t_end)
+        print(fetcher.summary())
+    result = report(revisions, since=started, checked=checked)
+    print(f"{result['changed_files']} of {checked} files changed, see changes-report.json")
+    revisions.close()
+    manifest.close()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Scrape",
+                    description="Fetches tide predictions for every station in every region")
+    parser.add_argument("hours", type=float, nargs="?",
+                        help="time budget in hours")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum in-flight requests per host")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="maximum requests per second (0 for unlimited)")
+    parser.add_argument("--api-root", default=API_ROOT,
+                        help="API scheme and host, e.g. a local stand-in server")
+    parser.add_argument("--policy", default="nearest-year", choices=PRIORITY_POLICIES,
+                        help="order in which newly planned tasks are fetched")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the shared on-disk response cache")
+    parser.add_argument("--replan", action="store_true",
+                        help="refresh the station lists and requeue unfetched tasks")
+    parser.add_argument("--refresh", type=float, metavar="DAYS",
+                        help="instead of fetching new files, fetch again those last "
+                             "checked more than DAYS days ago and keep changed versions")
+    parser.add_argument("--refresh-limit", type=int,
+                        help="maximum number of files to fetch again in this run")
+    parser.add_argument("--metrics", default="metrics.json",
+                        help="file the crawl metrics are written to periodically")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="seconds between metrics snapshots and progress lines")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print a line per fetch instead of the progress line")
+    parser.add_argument("--profile", nargs="?", const="time", metavar="MODES",
+                        help="profile the planning stages, see profiling.py")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(args.profile)
+    t_end = None
+    if args.hours is not None:
+        t0 = time.time()
+        t_end = args.hours*3600 + t0
+    failed = asyncio.run(main(args, t_end))
     print("DONE")
     print("The following fetches failed:")
     for i in failed:
-        print(i)
\ No newline at end of file
+        print(i)
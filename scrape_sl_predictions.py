@@ -1,26 +1,200 @@
+import argparse
+import asyncio
+import json
 import os
-import requests
+import re
+import time
 
+import pandas as pd
+
+from fetch import API_ROOT, AsyncFetcher
+from noaa_scrape.noaa_scrape.response_cache import ResponseCache
+
+"""
+Fetches NOAA's sea level rise projections for every station and grid point
+into one normalized table.
+
+Page 1 gives the page count; the remaining pages are then fetched
+concurrently over the shared connection pool, and failed pages are retried
+with backoff. Each page is turned into columns as soon as it arrives, so the
+page JSON is never kept around. The result is one row per location (station
+or grid point) x scenario x projection year, sorted in that order, in
+`sl-data/slr_projections.parquet`:
+
+    projections = load_projections()
+    projections.loc[("8518750", "Intermediate", 2050)]
+"""
 
 SL_RISE_PROJECTION_URL = (
     "https://api.tidesandcurrents.noaa.gov/dpapi/prod/webapi/"
     "product/slr_projections.json?units=english&report_year=2022&page={page}"
 ) # all projection years, all stations/grids, and all scenarios
 
+OUTPUT_DIR = "sl-data"
+OUTPUT_PATH = os.path.join(OUTPUT_DIR, "slr_projections.parquet")
+INDEX_COLUMNS = ["location", "scenario", "projection_year"]
+RETRIES = 5
+RETRY_DELAY = 2.0
+
+
+def snake_case(name):
+    """"projectionYear" -> "projection_year"."""
+    return re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", name).lower()
+
+
+def page_records(page):
+    """
+    The list of projection records in a page response.
+
+    The records are the page's only list of objects, whatever its key.
+    """
+    for value in page.values():
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            return value
+    return []
+
+
+def page_table(text):
+    """
+    Parse one page into columns.
+
+    Parameters
+    ----------
+    text : str
+        Page JSON
+
+    Returns
+    -------
+    tuple[int, pandas.DataFrame]
+        The total page count and the page's records, with snake_case column
+        names and a "location" column holding the station or grid ID
+    """
+    page = json.loads(text)
+    data = pd.DataFrame.from_records(page_records(page))
+    data.columns = [snake_case(c) for c in data.columns]
+    location = pd.Series(pd.NA, index=data.index, dtype="string")
+    for column in ("station_id", "grid_id", "id"):
+        if column in data.columns:
+            location = location.fillna(data[column].astype("string"))
+    data["location"] = location
+    return int(page["totalPages"]), data
+
+
+def normalize(frames):
+    """
+    Combine page tables into one sorted, compactly typed table.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per location x scenario x projection year
+    """
+    data = pd.concat(frames, ignore_index=True)
+    for column in data.columns:
+        if data[column].dtype == object or pd.api.types.is_string_dtype(data[column]):
+            if data[column].nunique() < len(data) / 2:
+                data[column] = data[column].astype("category")
+        elif pd.api.types.is_float_dtype(data[column]):
+            data[column] = data[column].astype("float32")
+    keys = [c for c in INDEX_COLUMNS if c in data.columns]
+    return data.sort_values(keys, kind="stable").reset_index(drop=True)
+
+
+async def get_page(fetcher, page):
+    """
+    Fetch and parse one page, retrying failures with exponential backoff.
+
+    Returns
+    -------
+    tuple[int, pandas.DataFrame] or None
+        Output of `page_table`, or None when every attempt failed
+    """
+    url = SL_RISE_PROJECTION_URL.format(page=page)
+    for attempt in range(RETRIES):
+        status, text = await fetcher.get(url, revalidate=attempt > 0)
+        if status == 200:
+            try:
+                return await asyncio.to_thread(page_table, text)
+            except (ValueError, KeyError):
+                pass
+        await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+    print(f"Page {page} failed.")
+    return None
+
+
+async def fetch_projections(fetcher):
+    """
+    Fetch every page, the first one alone and the rest concurrently.
+
+    Parameters
+    ----------
+    fetcher : fetch.AsyncFetcher
+        Open fetcher; its concurrency bounds the pages in flight
+
+    Returns
+    -------
+    tuple[list[pandas.DataFrame], list[int]]
+        One table per fetched page and the page numbers that failed
+    """
+    first = await get_page(fetcher, 1)
+    if first is None:
+        return [], [1]
+    total_pages, table = first
+    pages = range(2, total_pages + 1)
+    results = await asyncio.gather(*(get_page(fetcher, page) for page in pages))
+    frames = [table] + [r[1] for r in results if r is not None]
+    failed = [page for page, r in zip(pages, results) if r is None]
+    return frames, failed
+
+
+def load_projections(path=OUTPUT_PATH):
+    """
+    Load the projection table indexed by location, scenario and projection year.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The table written by this script, with a sorted MultiIndex
+    """
+    data = pd.read_parquet(path)
+    keys = [c for c in INDEX_COLUMNS if c in data.columns]
+    return data.set_index(keys).sort_index()
+
+
+async def main(args):
+    cache = None if args.no_cache else ResponseCache()
+    started = time.monotonic()
+    async with AsyncFetcher(concurrency=args.concurrency, rate=args.rate,
+                            api_root=args.api_root, cache=cache) as fetcher:
+        frames, failed = await fetch_projections(fetcher)
+        print(fetcher.summary())
+    if failed:
+        print(f"{len(failed)} pages failed, {args.output} not written")
+        return failed
+    data = normalize(frames)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    tmp_path = args.output + ".part"
+    data.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, args.output)
+    print(f"Wrote {len(data)} rows from {len(frames)} pages to {args.output} "
+          f"in {time.monotonic() - started:.1f} s")
+    return failed
+
+
 if __name__ == "__main__":
-    page = 1
-    total_pages = 99999
-    while page <= total_pages:
-        url = SL_RISE_PROJECTION_URL.format(page=page)
-        response = requests.get(url)
-        dir = "sl-data"
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        if response.status_code == 200:
-            filepath = os.path.join(dir, f"page-{page}.json")
-            with open(filepath, "w") as f:
-                f.write(response.text)
-            total_pages = response.json()["totalPages"]
-        else:
-            print(f"Page {page} failed.")
-        page += 1
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+                    prog="Scrape SLR",
+                    description="Fetches sea level rise projections into one table")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum in-flight requests")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="maximum requests per second (0 for unlimited)")
+    parser.add_argument("--api-root", default=API_ROOT,
+                        help="API scheme and host, e.g. a local stand-in server")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the shared on-disk response cache")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args()
+    failed = asyncio.run(main(args))
+    if failed:
+        raise SystemExit(1)
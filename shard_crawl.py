@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import os
+import socket
+import time
+
+from fetch import API_ROOT, AsyncFetcher
+from manifest import MANIFEST_PATH, Manifest
+from noaa_scrape.noaa_scrape.response_cache import ResponseCache
+from scheduler import (DONE, FAILED, IN_FLIGHT, LEASE_SECONDS, PENDING, PRIORITY_POLICIES,
+                       SHARED_SCHEDULE_PATH, SharedQueue)
+from scrape import (TIDE_PREDICTION_REGION_IDS, plan_regions, save_year_data, year_data_filename,
+                    year_data_url)
+
+"""
+Sharded `scrape.py` crawl over many processes and hosts.
+
+NOAA throttles per IP, so a crawl scales with machines, not cores. One
+command plans every station-year into a `scheduler.SharedQueue` on a
+filesystem all hosts mount, next to the shared `data/`:
+
+    python shard_crawl.py plan
+    python shard_crawl.py work          # on each host, as many times as wanted
+    python shard_crawl.py status
+
+Workers lease tasks for `--lease` seconds and extend their leases with a
+heartbeat every third of that; a worker that dies simply stops
+heartbeating, its leases expire and other workers pick the tasks up. A
+fetched file is written and its task marked done in one locked queue
+transaction, so each output file is written exactly once even when an
+expired task was fetched twice. Planning again is safe while workers run:
+done and leased tasks are kept.
+
+Workers do not write the SQLite manifest or the shared response cache
+(their WAL mode does not work across hosts); give each host its own cache
+with `--cache-dir` on a local disk, and run `python manifest.py` after the
+crawl to index the new files.
+"""
+
+
+def worker_name():
+    """Name unique to this process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def write_output(stn, year, text):
+    """
+    Save one fetched station-year, see `scrape.save_year_data`.
+
+    Returns
+    -------
+    tuple[str, int, str]
+        Path, size and SHA-256 of the file
+    """
+    filename = year_data_filename(stn, year)
+    save_year_data(stn, year, filename, text)
+    data = text.encode()
+    path = os.path.join("data", stn["state"], filename)
+    return path, len(data), hashlib.sha256(data).hexdigest()
+
+
+async def plan(args):
+    manifest = Manifest(MANIFEST_PATH)
+    queue = SharedQueue(args.queue, policy=args.policy)
+    cache = None if args.no_cache else ResponseCache()
+    os.makedirs("data", exist_ok=True)
+    async with AsyncFetcher(concurrency=args.concurrency, rate=args.rate,
+                            api_root=args.api_root, cache=cache) as fetcher:
+        await plan_regions(fetcher, TIDE_PREDICTION_REGION_IDS,
+                           range(args.start_year, args.end_year + 1), manifest, queue)
+    print(queue.counts())
+    queue.close()
+    manifest.close()
+
+
+async def work(args, t_end=None):
+    """
+    Lease, fetch and commit tasks until the queue is drained or time runs out.
+
+    Returns
+    -------
+    dict[str, int]
+        Tasks "committed", "duplicates" (fetched but already committed by
+        another worker) and "failed" attempts
+    """
+    owner = args.worker or worker_name()
+    loop = asyncio.get_running_loop()
+    # One thread owns the SQLite connection, so lock waits never block the loop
+    db_thread = ThreadPoolExecutor(1)
+    queue = await loop.run_in_executor(
+        db_thread, functools.partial(SharedQueue, args.queue, lease_seconds=args.lease))
+
+    def db(fn, *fn_args):
+        return loop.run_in_executor(db_thread, fn, *fn_args)
+
+    counts = {"committed": 0, "duplicates": 0, "failed": 0}
+    stopping = asyncio.Event()
+
+    async def heartbeat():
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), args.lease / 3)
+            except asyncio.TimeoutError:
+                await db(queue.heartbeat, owner)
+
+    async def run():
+        while t_end is None or time.time() < t_end:
+            tasks = await db(queue.lease, owner, 1)
+            if not tasks:
+                wait = await db(queue.next_ready_in)
+                if wait is None:
+                    return
+                await asyncio.sleep(min(max(wait, 0.1), 5.0))
+                continue
+            task_id, stn, year = tasks[0]
+            if args.verbose:
+                print(f"{owner} working on {stn['stationId']} for {year}")
+            try:
+                status, text = await fetcher.get(year_data_url(stn, year))
+                error = None if status == 200 else f"HTTP {status}: {text[:200]}"
+            except Exception as e:
+                error = repr(e)
+            if error is not None:
+                await db(queue.fail, task_id, error, owner)
+                counts["failed"] += 1
+                continue
+            kept = await db(queue.commit, task_id, owner,
+                            functools.partial(write_output, stn, year, text))
+            counts["committed" if kept else "duplicates"] += 1
+
+    cache = ResponseCache(args.cache_dir) if args.cache_dir else None
+    beating = asyncio.create_task(heartbeat())
+    try:
+        async with AsyncFetcher(concurrency=args.concurrency, rate=args.rate,
+                                api_root=args.api_root, cache=cache) as fetcher:
+            await asyncio.gather(*(run() for _ in range(args.concurrency)))
+            print(f"{owner}: {fetcher.summary()}")
+    finally:
+        stopping.set()
+        await beating
+        await db(queue.release, owner)
+        await db(queue.close)
+        db_thread.shutdown()
+    return counts
+
+
+def status(args):
+    queue = SharedQueue(args.queue)
+    counts = queue.counts()
+    print(" ".join(f"{name} {counts.get(name, 0)}"
+                   for name in (PENDING, IN_FLIGHT, DONE, FAILED)))
+    now = time.time()
+    for owner, (leased, expires) in sorted(queue.owners().items()):
+        print(f"  {owner}: {leased} leased, expires in {expires - now:.0f} s")
+    failed = queue.failed()
+    if failed:
+        print("Failed:")
+        for stn, year, error in failed:
+            print(f"  {year_data_filename(stn, year)}: {error}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Shard crawl",
+                    description="Fetches tide predictions with workers on many hosts sharing one queue")
+    parser.add_argument("--queue", default=SHARED_SCHEDULE_PATH,
+                        help="SQLite queue on a filesystem every worker can lock")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="queue every station-year not yet fetched")
+    plan_parser.add_argument("--start-year", type=int, default=2025)
+    plan_parser.add_argument("--end-year", type=int, default=2029, help="inclusive")
+    plan_parser.add_argument("--policy", default="nearest-year", choices=PRIORITY_POLICIES)
+    work_parser = subparsers.add_parser("work", help="lease and fetch tasks until none are left")
+    work_parser.add_argument("hours", type=float, nargs="?", help="time budget in hours")
+    work_parser.add_argument("--worker", help="worker name, by default host:pid")
+    work_parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                             help="seconds a lease lasts without a heartbeat")
+    work_parser.add_argument("--verbose", action="store_true")
+    work_parser.add_argument("--cache-dir",
+                             help="response cache on a disk local to this host; none by default")
+    plan_parser.add_argument("--no-cache", action="store_true")
+    for sub in (plan_parser, work_parser):
+        sub.add_argument("--concurrency", type=int, default=8,
+                         help="maximum in-flight requests per host")
+        sub.add_argument("--rate", type=float, default=10.0,
+                         help="maximum requests per second (0 for unlimited)")
+        sub.add_argument("--api-root", default=API_ROOT)
+    subparsers.add_parser("status", help="print the queue's progress and failures")
+    args = parser.parse_args()
+    if args.command == "plan":
+        asyncio.run(plan(args))
+    elif args.command == "work":
+        t_end = time.time() + args.hours * 3600 if args.hours is not None else None
+        counts = asyncio.run(work(args, t_end))
+        print(f"{counts['committed']} committed, {counts['duplicates']} duplicates, "
+              f"{counts['failed']} failed attempts")
+    else:
+        status(args)
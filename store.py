@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+"""
+Compact binary store for the prediction archive, read with `numpy.memmap`.
+
+Each station's series is one contiguous float32 height array. Evenly spaced
+series (the usual 6-minute predictions) are described by a start time and a
+step, so no timestamps are stored; uneven ones (hilo tables, DST jumps in
+local-time files) also get a contiguous uint32 array of epoch minutes. The
+file layout is
+
+    [data arrays ...][JSON index][uint64 index offset][MAGIC]
+
+so a store is written in one streaming pass, one station at a time. Opening
+a store reads only the index; `query` returns views into the mapped file.
+"""
+
+MAGIC = b"NOAATS01"
+STORE_PATH = "predictions.tsdb"
+EPOCH = np.datetime64("1970-01-01T00:00", "m")
+
+
+def to_epoch_minutes(times):
+    """datetime64 values as uint32 minutes since 1970-01-01."""
+    return ((np.asarray(times, dtype="datetime64[m]") - EPOCH)
+            .astype(np.int64).astype(np.uint32))
+
+
+def write_store(path, series):
+    """
+    Write a store from (station ID, times, heights) triples.
+
+    Parameters
+    ----------
+    path : str
+        Output file
+    series : iterable[tuple[str, numpy.ndarray, numpy.ndarray]]
+        Station ID, sorted timestamps (datetime64) and heights, one station
+        at a time
+
+    Returns
+    -------
+    dict[str, dict]
+        The index that was written
+    """
+    index = {}
+    with open(path, "wb") as f:
+        for station_id, times, heights in series:
+            minutes = to_epoch_minutes(times)
+            entry = {"length": len(minutes), "heights": f.tell()}
+            f.write(np.ascontiguousarray(heights, dtype="<f4").tobytes())
+            steps = np.diff(minutes.astype(np.int64))
+            if len(minutes) > 1 and (steps == steps[0]).all():
+                entry.update(start=int(minutes[0]), step=int(steps[0]))
+            else:
+                entry.update(start=int(minutes[0]) if len(minutes) else 0, step=None,
+                             times=f.tell())
+                f.write(minutes.astype("<u4").tobytes())
+            index[str(station_id)] = entry
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.write(struct.pack("<Q", index_offset))
+        f.write(MAGIC)
+    return index
+
+
+def _epoch_minute(when):
+    return int((np.datetime64(when, "m") - EPOCH).astype(np.int64))
+
+
+class SeriesStore:
+    """
+    Read-only, memory-mapped view of a store written by `write_store`.
+
+    Example
+    -------
+        store = SeriesStore("predictions.tsdb")
+        times, heights = store.query("9414290", "2026-01-01", "2027-01-01")
+    """
+
+    def __init__(self, path=STORE_PATH):
+        with open(path, "rb") as f:
+            f.seek(-16, os.SEEK_END)
+            trailer = f.read(16)
+            if trailer[8:] != MAGIC:
+                raise ValueError(f"{path} is not a series store")
+            index_offset = struct.unpack("<Q", trailer[:8])[0]
+            f.seek(index_offset)
+            self.index = json.loads(f.read(os.path.getsize(path) - 16 - index_offset))
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def stations(self):
+        """IDs of every station in the store."""
+        return list(self.index)
+
+    def _bounds(self, entry, start, end):
+        length = entry["length"]
+        lo, hi = 0, length
+        if entry["step"] is not None:
+            if start is not None:
+                lo = -(-(_epoch_minute(start) - entry["start"]) // entry["step"])
+            if end is not None:
+                hi = -(-(_epoch_minute(end) - entry["start"]) // entry["step"])
+            return min(max(lo, 0), length), min(max(hi, 0), length)
+        times = self._times(entry)
+        if start is not None:
+            lo = int(np.searchsorted(times, min(max(_epoch_minute(start), 0), 2**32 - 1)))
+        if end is not None:
+            hi = int(np.searchsorted(times, min(max(_epoch_minute(end), 0), 2**32 - 1)))
+        return lo, hi
+
+    def _times(self, entry):
+        offset = entry["times"]
+        return self.data[offset:offset + 4 * entry["length"]].view("<u4")
+
+    def _heights(self, entry):
+        offset = entry["heights"]
+        return self.data[offset:offset + 4 * entry["length"]].view("<f4")
+
+    def heights(self, station_id, start=None, end=None):
+        """
+        Heights for a station and time range, as a view into the file.
+
+        Parameters
+        ----------
+        station_id : str
+            NOAA station ID
+        start : str or numpy.datetime64, optional
+            First time (inclusive); defaults to the start of the series
+        end : str or numpy.datetime64, optional
+            Last time (exclusive); defaults to the end of the series
+
+        Returns
+        -------
+        numpy.ndarray
+            float32 heights
+
+        Raises
+        ------
+        KeyError
+            When the station is not in the store
+        """
+        entry = self.index[str(station_id)]
+        lo, hi = self._bounds(entry, start, end)
+        return self._heights(entry)[lo:hi]
+
+    def query(self, station_id, start=None, end=None):
+        """
+        Timestamps and heights for a station and time range.
+
+        Heights are a view into the file; timestamps are a view too for
+        uneven series and are generated from the start and step otherwise.
+
+        Parameters
+        ----------
+        station_id : str
+            NOAA station ID
+        start : str or numpy.datetime64, optional
+            First time (inclusive); defaults to the start of the series
+        end : str or numpy.datetime64, optional
+            Last time (exclusive); defaults to the end of the series
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            uint32 epoch minutes and float32 heights
+
+        Raises
+        ------
+        KeyError
+            When the station is not in the store
+        """
+        entry = self.index[str(station_id)]
+        lo, hi = self._bounds(entry, start, end)
+        heights = self._heights(entry)[lo:hi]
+        if entry["step"] is None:
+            return self._times(entry)[lo:hi], heights
+        times = np.arange(lo, hi, dtype=np.uint32) * np.uint32(entry["step"])
+        return times + np.uint32(entry["start"]), heights
+
+
+def archive_files(data_dir="data"):
+    """
+    Group the prediction CSVs under `data_dir` by station.
+
+    Returns
+    -------
+    dict[str, list[str]]
+        Station ID mapped to its file paths, sorted by year
+    """
+    files = {}
+    for region in sorted(os.listdir(data_dir)):
+        region_path = os.path.join(data_dir, region)
+        if not os.path.isdir(region_path):
+            continue
+        for filename in os.listdir(region_path):
+            if filename.endswith(" Tidal Data.csv"):
+                files.setdefault(filename.split(" ")[-3], []).append(
+                    os.path.join(region_path, filename))
+    return {station_id: sorted(paths, key=os.path.basename)
+            for station_id, paths in files.items()}
+
+
+def read_station_series(paths):
+    """
+    Read and concatenate one station's prediction CSVs.
+
+    Files that are not prediction data (e.g. saved API errors) are ignored.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        Sorted datetime64[m] timestamps and float32 heights
+    """
+    times, heights = [], []
+    for path in paths:
+        with open(path, "r") as f:
+            header = f.readline()
+        if not header.startswith("Date Time"):
+            continue
+        data = pd.read_csv(path, skipinitialspace=True, usecols=[0, 1])
+        if list(data.columns) != ["Date Time", "Prediction"]:
+            continue
+        times.append(pd.to_datetime(data["Date Time"], format="%Y-%m-%d %H:%M")
+                     .to_numpy().astype("datetime64[m]"))
+        heights.append(data["Prediction"].to_numpy(dtype=np.float32))
+    if not times:
+        return np.array([], dtype="datetime64[m]"), np.array([], dtype=np.float32)
+    times, heights = np.concatenate(times), np.concatenate(heights)
+    order = np.argsort(times, kind="stable")
+    return times[order], heights[order]
+
+
+def build(data_dir="data", path=STORE_PATH):
+    """
+    Build a store from the CSV archive, one station at a time.
+
+    Returns
+    -------
+    int
+        Number of stations written
+    """
+    files = archive_files(data_dir)
+
+    def series():
+        for station_id, paths in files.items():
+            times, heights = read_station_series(paths)
+            if len(times):
+                yield station_id, times, heights
+
+    return len(write_store(path, series()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Store",
+                    description="Packs the tide prediction CSVs into a memory-mapped series store")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--output", default=STORE_PATH)
+    args = parser.parse_args()
+    print(f"Wrote {build(args.data_dir, args.output)} stations to {args.output}")
@@ -0,0 +1,314 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+import functools
+import json
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from noaa_scrape.noaa_scrape.station_catalog import CATALOG_PATH
+from scrape import load_region_stations
+from store import STORE_PATH, SeriesStore, write_store
+
+"""
+Time zones of the stations, and bulk conversion of local-time predictions
+to UTC.
+
+`scrape.py` asks for `time_zone=lst_ldt`, so its files are in local wall
+clock time: spring forward skips an hour and fall back repeats one. The
+spiders ask for GMT. Every station is mapped to an IANA zone from its
+region and the `timeZoneCorr` of its station list entry (`station_zone`),
+and series are converted with one offset table per zone: the zone's UTC
+offset transitions are looked up once per year, and each timestamp is
+converted with a `searchsorted` into them, so nothing per row touches
+`zoneinfo`.
+
+Local times that cannot be mapped one to one are resolved as follows:
+
+* missing (in the skipped hour): read with the offset before the jump, the
+  same as Python's `fold=0`
+* ambiguous (in the repeated hour): the first occurrence of a local time
+  is the earlier instant (daylight time) and any later occurrence of the
+  same time the later one, so both a file's own order and a stable sort of
+  it resolve correctly; pass `fold` to override
+
+`python timezones.py convert` writes the series store in UTC
+(`predictions-utc.tsdb`); `utc_to_local` produces local views again with a
+single lookup.
+"""
+
+ZONES_PATH = "station-zones.json"
+UTC_STORE_PATH = "predictions-utc.tsdb"
+# Zone of each `scrape.TIDE_PREDICTION_REGION_IDS` folder; a dict picks by
+# the station's standard UTC offset in hours where a region spans zones
+REGION_ZONES = {
+    "ca": "America/Los_Angeles", "or": "America/Los_Angeles", "wa": "America/Los_Angeles",
+    "ak": {-9: "America/Anchorage", -10: "America/Adak", -8: "America/Metlakatla"},
+    "me": "America/New_York", "nh": "America/New_York", "ma": "America/New_York",
+    "ri": "America/New_York", "ct": "America/New_York", "ny": "America/New_York",
+    "nj": "America/New_York", "de": "America/New_York", "pa": "America/New_York",
+    "md": "America/New_York", "va": "America/New_York", "dc": "America/New_York",
+    "nc": "America/New_York", "sc": "America/New_York", "ga": "America/New_York",
+    "fl": {-5: "America/New_York", -6: "America/Chicago"},
+    "al": "America/Chicago", "ms": "America/Chicago", "la": "America/Chicago",
+    "tx": "America/Chicago",
+    "marianas": "Pacific/Guam", "palau": "Pacific/Palau",
+    "micronesia": {10: "Pacific/Chuuk", 11: "Pacific/Pohnpei"},
+    "marshall": "Pacific/Majuro", "hi": "Pacific/Honolulu",
+    "kiribati": {12: "Pacific/Tarawa", 13: "Pacific/Kanton", 14: "Pacific/Kiritimati"},
+    "tokelau": "Pacific/Fakaofo", "american-samoa": "Pacific/Pago_Pago",
+    "french-polynesia": {-10: "Pacific/Tahiti", -9.5: "Pacific/Marquesas",
+                         -9: "Pacific/Gambier"},
+    "cook-islands": "Pacific/Rarotonga", "fiji": "Pacific/Fiji", "bermuda": "Atlantic/Bermuda",
+    "bahamas": "America/Nassau", "cuba": "America/Havana", "jamaica": "America/Jamaica",
+    "haiti-dr": {-5: "America/Port-au-Prince", -4: "America/Santo_Domingo"},
+    "pr": "America/Puerto_Rico", "antilles-vi": "America/Puerto_Rico",
+}
+
+
+def station_zone(stn, region=None):
+    """
+    IANA time zone of a station.
+
+    Parameters
+    ----------
+    stn : dict
+        Station definition from a region's stations.json (or the mdapi
+        station list); its "timeZoneCorr"/"timezonecorr" is the standard
+        UTC offset in hours
+    region : str, optional
+        Region folder name; defaults to the definition's "state"
+
+    Returns
+    -------
+    str
+        Zone name; a fixed-offset "Etc/GMT..." zone when the region is not
+        known, and "UTC" when the station has no offset either
+    """
+    region = region or stn.get("state")
+    offset = stn.get("timeZoneCorr", stn.get("timezonecorr"))
+    try:
+        offset = float(offset)
+    except (TypeError, ValueError):
+        offset = None
+    zone = REGION_ZONES.get(region)
+    if isinstance(zone, dict):
+        zone = zone.get(offset, next(iter(zone.values())))
+    if zone is not None:
+        return zone
+    if not offset or offset != int(offset):
+        return "UTC"
+    # POSIX sign convention: Etc/GMT+8 is eight hours behind UTC
+    return f"Etc/GMT{-int(offset):+d}"
+
+
+def station_zones(data_dir="data", catalog_path=CATALOG_PATH):
+    """
+    Zone of every station in the region station lists, from the saved
+    catalog or under `data_dir` (see `scrape.load_region_stations`).
+    """
+    return {station_id: station_zone(stn)
+            for station_id, stn in load_region_stations(data_dir, catalog_path).items()}
+
+
+def _offset_minutes(tz, when):
+    """UTC offset of `tz` at the aware UTC datetime `when`, in minutes."""
+    return int(when.astimezone(tz).utcoffset().total_seconds() // 60)
+
+
+@functools.lru_cache(maxsize=4096)
+def year_transitions(zone, year):
+    """
+    UTC offset changes of a zone during one year.
+
+    The offset is sampled daily and each change is then located to the
+    minute by bisection.
+
+    Returns
+    -------
+    tuple[tuple[int, int], ...]
+        (epoch minute in UTC, offset in minutes from then on) per change
+    """
+    tz = ZoneInfo(zone)
+    start = datetime(year, 1, 1, tzinfo=timezone.utc)
+    days = (datetime(year + 1, 1, 1, tzinfo=timezone.utc) - start).days
+    offsets = [_offset_minutes(tz, start + timedelta(days=d)) for d in range(days + 1)]
+    changes = []
+    for day in range(days):
+        if offsets[day] == offsets[day + 1]:
+            continue
+        lo, hi = 0, 1440
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            when = start + timedelta(days=day, minutes=mid)
+            if _offset_minutes(tz, when) == offsets[day]:
+                lo = mid
+            else:
+                hi = mid
+        minute = int((start + timedelta(days=day, minutes=hi)).timestamp() // 60)
+        changes.append((minute, offsets[day + 1]))
+    return tuple(changes)
+
+
+@functools.lru_cache(maxsize=1024)
+def offset_table(zone, first_year, last_year):
+    """
+    Offsets of a zone from `first_year` through `last_year`.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        int64 epoch minutes (UTC) at which each offset starts, the first
+        being far in the past, and the offsets in minutes
+    """
+    tz = ZoneInfo(zone)
+    starts = [np.iinfo(np.int64).min // 2]
+    offsets = [_offset_minutes(tz, datetime(first_year, 1, 1, tzinfo=timezone.utc))]
+    for year in range(first_year, last_year + 1):
+        for minute, offset in year_transitions(zone, year):
+            starts.append(minute)
+            offsets.append(offset)
+    return np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def _years(minutes):
+    if not len(minutes):
+        return 1970, 1970
+    years = np.asarray([minutes.min(), minutes.max()]).astype("datetime64[m]")
+    first, last = years.astype("datetime64[Y]").astype(np.int64) + 1970
+    # One year of margin covers offsets of up to a day either way
+    return int(first) - 1, int(last) + 1
+
+
+def utc_to_local(utc_minutes, zone):
+    """
+    Local wall clock times of UTC instants.
+
+    Parameters
+    ----------
+    utc_minutes : numpy.ndarray
+        Epoch minutes in UTC
+    zone : str
+        IANA zone name
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 local epoch minutes (wall clock time written as if it were UTC)
+    """
+    utc_minutes = np.asarray(utc_minutes, dtype=np.int64)
+    starts, offsets = offset_table(zone, *_years(utc_minutes))
+    return utc_minutes + offsets[np.searchsorted(starts, utc_minutes, side="right") - 1]
+
+
+def _repeats(values):
+    """Whether each value occurred earlier in `values`."""
+    order = np.argsort(values, kind="stable")
+    ordered = values[order]
+    repeated = np.zeros(len(values), dtype=bool)
+    repeated[order[1:]] = ordered[1:] == ordered[:-1]
+    return repeated
+
+
+def local_to_utc(local_minutes, zone, fold=None):
+    """
+    UTC instants of local wall clock times, see the module docstring for
+    missing and ambiguous times.
+
+    Parameters
+    ----------
+    local_minutes : numpy.ndarray
+        Local epoch minutes (wall clock time written as if it were UTC), in
+        the order they were recorded or stably sorted
+    zone : str
+        IANA zone name
+    fold : numpy.ndarray, optional
+        bool per time, True to take the later of two ambiguous instants;
+        by default repeated times take the later one
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 epoch minutes in UTC
+    """
+    local_minutes = np.asarray(local_minutes, dtype=np.int64)
+    starts, offsets = offset_table(zone, *_years(local_minutes))
+    local_starts = starts + offsets
+    local_ends = np.r_[starts[1:] + offsets[:-1], np.iinfo(np.int64).max]
+    segment = np.maximum(np.searchsorted(local_starts, local_minutes, side="right") - 1, 0)
+    previous = np.maximum(segment - 1, 0)
+    ambiguous = (segment > 0) & (local_minutes < local_ends[previous])
+    if fold is None:
+        fold = np.zeros(len(local_minutes), dtype=bool)
+        index = np.flatnonzero(ambiguous)
+        fold[index] = _repeats(local_minutes[index])
+    # Missing times fall past the end of their segment and keep its offset
+    chosen = np.where(ambiguous & ~np.asarray(fold, dtype=bool), previous, segment)
+    return local_minutes - offsets[chosen]
+
+
+def convert_store(source, destination, zones):
+    """
+    Write a copy of a local-time series store with UTC timestamps.
+
+    Stations without a zone are left out.
+
+    Returns
+    -------
+    tuple[int, list[str]]
+        Stations written and stations skipped
+    """
+    store = SeriesStore(source)
+    skipped = [i for i in store.stations() if i not in zones]
+
+    def series():
+        for station_id in store.stations():
+            if station_id not in zones:
+                continue
+            times, heights = store.query(station_id)
+            utc = local_to_utc(times, zones[station_id])
+            order = np.argsort(utc, kind="stable")
+            yield station_id, utc[order].astype("datetime64[m]"), heights[order]
+
+    return len(write_store(destination, series())), skipped
+
+
+def query_local(store, zone, station_id, start=None, end=None):
+    """
+    `SeriesStore.query` on a UTC store, with local wall clock timestamps.
+
+    `start` and `end` are UTC.
+    """
+    times, heights = store.query(station_id, start, end)
+    return utc_to_local(times, zone), heights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Timezones",
+                    description="Maps stations to time zones and converts local-time predictions to UTC")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    zones_parser = subparsers.add_parser("zones", help="write the station-to-zone map")
+    zones_parser.add_argument("--data-dir", default="data")
+    zones_parser.add_argument("--catalog", default=CATALOG_PATH,
+                              help="station catalog read instead of --data-dir when it has the region lists")
+    zones_parser.add_argument("--output", default=ZONES_PATH)
+    convert_parser = subparsers.add_parser("convert", help="write the series store in UTC")
+    convert_parser.add_argument("--data-dir", default="data")
+    convert_parser.add_argument("--catalog", default=CATALOG_PATH,
+                                help="station catalog read instead of --data-dir when it has the region lists")
+    convert_parser.add_argument("--store", default=STORE_PATH)
+    convert_parser.add_argument("--output", default=UTC_STORE_PATH)
+    args = parser.parse_args()
+    zones = station_zones(args.data_dir, args.catalog)
+    if args.command == "zones":
+        with open(args.output, "w") as f:
+            json.dump(zones, f, indent=1, sort_keys=True)
+        print(f"Wrote zones of {len(zones)} stations to {args.output}")
+    else:
+        started = time.monotonic()
+        written, skipped = convert_store(args.store, args.output, zones)
+        print(f"Wrote {written} stations to {args.output} in {time.monotonic() - started:.1f} s")
+        if skipped:
+            print(f"{len(skipped)} stations have no zone: {' '.join(skipped[:20])}")
@@ -1,33 +1,224 @@
 import argparse
+import calendar
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-                    prog="Validator",
-                    description="Validates that the length of stations.json matches the length of the data")
-    parser.add_argument("directory")
-    parser.add_argument("multiplier", type=int)
-    args = parser.parse_args()
-    print(args.directory, args.multiplier)
-    subdirs = [i for i in os.listdir(args.directory) if os.path.isdir(args.directory)]
-    files = [i for i in os.listdir(args.directory) if not os.path.isdir(args.directory)]
+import numpy as np
+
+from noaa_scrape.noaa_scrape import profiling
+
+"""
+Validates downloaded tide prediction files.
+
+The file-count check compares the number of files in each folder with the
+length of its stations.json times a multiplier (the number of years fetched).
+The content check opens every file in a process pool and checks:
+
+* the file is prediction data and not a saved API error message
+* row counts: 240 six-minute rows per day, or a plausible number of highs
+  and lows per day for hilo files
+* timestamps are increasing with no gaps or duplicates, allowing for the
+  two daylight saving time jumps of `time_zone=lst_ldt` files
+* the series covers the whole year, from January 1 to December 31
+* heights are within a plausible range
+
+It writes a JSON report of the files with problems and a JSON list of
+station-years to fetch again (bad files and missing files).
+"""
+
+ROWS_PER_DAY = 240
+HILO_PER_DAY = (1, 5)
+MAX_ABS_HEIGHT = 60.0
+# Spring forward skips an hour (a 66 minute step); fall back repeats one
+# (a -54 minute step).
+DST_STEPS = {66, -54}
+
+
+def check_file(path, year, interval):
+    """
+    Check the contents of one prediction file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV file
+    year : int
+        The 4-digit year the file should cover
+    interval : {"6", "hilo"}
+        Interval the file was fetched with
+
+    Returns
+    -------
+    tuple[int, list[str]]
+        Number of data rows and a list of problems (empty when valid)
+    """
+    with open(path, "r") as f:
+        header = f.readline()
+        lines = f.read().splitlines()
+    if not header.startswith("Date Time"):
+        return 0, [f"not prediction data: {header.strip()[:80]}"]
+    if not lines:
+        return 0, ["no rows"]
+    issues = []
+    try:
+        times = np.array([line[:16] for line in lines], dtype="datetime64[m]")
+        values = np.array([line.split(",")[1] for line in lines], dtype=float)
+    except (ValueError, IndexError) as e:
+        return len(lines), [f"unparseable rows: {e}"]
+    days = 366 if calendar.isleap(year) else 365
+    year_start = np.datetime64(f"{year}-01-01T00:00", "m")
+    year_end = np.datetime64(f"{year + 1}-01-01T00:00", "m")
+    steps = np.diff(times).astype(int)
+    if interval == "hilo":
+        low, high = HILO_PER_DAY
+        if not low * days <= len(lines) <= high * days:
+            issues.append(f"implausible hilo count {len(lines)}")
+        if (steps <= 0).sum() > 1:
+            issues.append("timestamps not increasing")
+        if times[0] >= year_start + np.timedelta64(1, "D"):
+            issues.append(f"starts late at {times[0]}")
+        if times[-1] < year_end - np.timedelta64(1, "D"):
+            issues.append(f"ends early at {times[-1]}")
+    else:
+        irregular = steps[steps != 6]
+        if len(lines) != ROWS_PER_DAY * days and len(irregular) == 0:
+            issues.append(f"{len(lines)} rows, expected {ROWS_PER_DAY * days}")
+        if len(irregular) > 2 or not set(irregular.tolist()) <= DST_STEPS:
+            gaps = int((irregular > 6).sum())
+            repeats = int((irregular <= 0).sum())
+            issues.append(f"{gaps} gaps and {repeats} duplicate or backward steps")
+        if times[0] != year_start:
+            issues.append(f"starts at {times[0]}")
+        if times[-1] != year_end - np.timedelta64(6, "m"):
+            issues.append(f"ends at {times[-1]}")
+    if (times < year_start).any() or (times >= year_end).any():
+        issues.append("rows outside the year")
+    if not np.isfinite(values).all() or (np.abs(values) > MAX_ABS_HEIGHT).any():
+        issues.append("heights out of range")
+    return len(lines), issues
+
+
+def _check_task(task):
+    path, year, interval = task
+    with profiling.stage("validate.check_file") as record:
+        try:
+            rows, issues = check_file(path, year, interval)
+        except (OSError, UnicodeDecodeError) as e:
+            rows, issues = 0, [f"unreadable: {e}"]
+        record.units = rows
+    return path, (rows, issues)
+
+
+def plan_checks(directory, years):
+    """
+    Match every region's stations.json against the files on disk.
+
+    Parameters
+    ----------
+    directory : str
+        Directory with one folder per region
+    years : range
+        Years every station is expected to have
+
+    Returns
+    -------
+    tuple[list[tuple[str, int, str]], dict[str, dict], list[dict]]
+        Files to check as (path, year, interval), the station-year task each
+        path belongs to, and the station-years with no file at all
+    """
+    with profiling.stage("validate.scan") as record:
+        checks, tasks, missing = _plan_checks(directory, years)
+        record.units = len(checks)
+    return checks, tasks, missing
+
+
+def _plan_checks(directory, years):
+    checks, tasks, missing = [], {}, []
+    for region in sorted(os.listdir(directory)):
+        region_path = os.path.join(directory, region)
+        stations_file = os.path.join(region_path, "stations.json")
+        if not os.path.isdir(region_path) or not os.path.exists(stations_file):
+            continue
+        with open(stations_file, "r") as f:
+            stations = {str(i["stationId"]): i for i in json.load(f)}
+        found = set()
+        for filename in os.listdir(region_path):
+            parts = filename.split(" ")
+            if not filename.endswith(".csv") or len(parts) < 3 or not parts[0].isdigit():
+                continue
+            stn_id, year = parts[-3], int(parts[0])
+            if stn_id not in stations:
+                continue
+            interval = "hilo" if stations[stn_id]["stationType"] == "S" else "6"
+            path = os.path.join(region_path, filename)
+            checks.append((path, year, interval))
+            tasks[path] = {"state": region, "stationId": stn_id, "year": year}
+            found.add((stn_id, year))
+        for stn_id in stations:
+            for year in years:
+                if (stn_id, year) not in found:
+                    missing.append({"state": region, "stationId": stn_id, "year": year})
+    return checks, tasks, missing
+
+
+def check_counts(directory, multiplier):
+    """Print folders whose file count does not match stations.json."""
+    subdirs = [i for i in os.listdir(directory) if os.path.isdir(os.path.join(directory, i))]
+    files = [i for i in os.listdir(directory) if not os.path.isdir(os.path.join(directory, i))]
     file_count = len(files)
-    stations_file = os.path.join(args.directory, "stations.json")
+    stations_file = os.path.join(directory, "stations.json")
     if os.path.exists(stations_file):
         with open(stations_file, "r") as f:
             stations_raw = f.read()
         stations = json.loads(stations_raw)
-        if len(stations) != file_count * args.multiplier:
-            print(f"Subdir {args.directory} failed validation.") 
+        if len(stations) * multiplier != file_count - 1:
+            print(f"Subdir {directory} failed validation.")
     for subdir in subdirs:
-        full_dir_path = os.path.join(args.directory, subdir)
+        full_dir_path = os.path.join(directory, subdir)
         stations_file = os.path.join(full_dir_path, "stations.json")
         file_count = len(os.listdir(full_dir_path)) - 1
         if os.path.exists(stations_file):
             with open(stations_file, "r") as f:
                 stations_raw = f.read()
             stations = json.loads(stations_raw)
-            expected_length = len(stations) * args.multiplier
+            expected_length = len(stations) * multiplier
             if file_count != expected_length:
                 print(f"Subdir {full_dir_path} failed validation: {file_count} {expected_length}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="Validator",
+                    description="Validates that the length of stations.json matches the length of the data")
+    parser.add_argument("directory")
+    parser.add_argument("multiplier", type=int)
+    parser.add_argument("--contents", action="store_true",
+                        help="also open and check every data file")
+    parser.add_argument("--start-year", type=int, default=2025)
+    parser.add_argument("--report", default="validation-report.json")
+    parser.add_argument("--refetch", default="refetch.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--profile", nargs="?", const="time", metavar="MODES",
+                        help="profile the directory scan and file checks, see profiling.py")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(args.profile)
+    print(args.directory, args.multiplier)
+    check_counts(args.directory, args.multiplier)
+    if args.contents:
+        years = range(args.start_year, args.start_year + args.multiplier)
+        checks, tasks, missing = plan_checks(args.directory, years)
+        report = {}
+        refetch = list(missing)
+        with ProcessPoolExecutor(args.workers) as executor:
+            for path, (rows, issues) in executor.map(_check_task, checks, chunksize=16):
+                if issues:
+                    report[path] = dict(tasks[path], rows=rows, issues=issues)
+                    refetch.append(tasks[path])
+        with open(args.report, "w") as f:
+            json.dump({"checked": len(checks), "failed": len(report),
+                       "missing": len(missing), "files": report}, f, indent=1)
+        with open(args.refetch, "w") as f:
+            json.dump(refetch, f, indent=1)
+        print(f"Checked {len(checks)} files: {len(report)} failed, {len(missing)} missing")